@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark da decisão de acesso facial contra um banco local.
+
+Compara o caminho antigo (cinco SELECTs dependentes) com a consulta única
+preparada de newAccess, ambos sem cache, e a decisão com o cache aquecido.
+
+Uso:
+    python benchmarks/benchDecisaoAcesso.py --device-id <deviceId> --user-id <idPessoa> [--iteracoes N]
+"""
+
+import sys
+import os
+
+# Adiciona o diretório raiz do servidor ao path para permitir importações
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import statistics
+import time
+from db import connection_pool
+from webservices.controlid import cacheAcesso
+from webservices.controlid.newAccess import _consultarDadosAcesso, _lerCache
+from webservices.controlid.periodosLote import compilarPeriodos
+
+
+def caminhoAntigo(device_id, user_id):
+    """Reproduz as cinco consultas sequenciais da versão anterior."""
+    conn = connection_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            "SELECT id, idEvento, idSetor FROM tblLeitor WHERE deviceId = %s AND status = 'T' LIMIT 1",
+            (device_id,)
+        )
+        leitor = cursor.fetchone()
+        if not leitor:
+            return
+        cursor.execute("SELECT id FROM tblPessoa WHERE id = %s AND status = 'T' LIMIT 1", (user_id,))
+        if not cursor.fetchone():
+            return
+        cursor.execute(
+            "SELECT id, idLote, codigoCredencial FROM tblCredencial WHERE idPessoa = %s AND status = 'T' ORDER BY dataCadastro DESC LIMIT 1",
+            (user_id,)
+        )
+        cred = cursor.fetchone()
+        if not cred:
+            return
+        cursor.execute(
+            "SELECT id FROM tblRelLoteSetor WHERE idLote = %s AND idSetor = %s AND status = 'T' LIMIT 1",
+            (cred['idLote'], leitor['idSetor'])
+        )
+        if not cursor.fetchone():
+            return
+        cursor.execute(
+            "SELECT dataInicio, dataTermino, horaInicio, horaTermino FROM tblLotePeriodo WHERE idLote = %s AND status = 'T'",
+            (cred['idLote'],)
+        )
+        compilarPeriodos(cursor.fetchall()).contem()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def consultaUnica(device_id, user_id):
+    cacheAcesso.limparCache()
+    _consultarDadosAcesso(device_id, user_id)
+
+
+def cacheAquecido(device_id, user_id):
+    _lerCache(device_id, user_id)
+
+
+def medir(nome, funcao, iteracoes, *args):
+    # Aquece conexões do pool e o plano de execução antes de medir
+    for _ in range(min(10, iteracoes)):
+        funcao(*args)
+
+    tempos = []
+    for _ in range(iteracoes):
+        inicio = time.perf_counter()
+        funcao(*args)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+
+    tempos.sort()
+    p99 = tempos[min(len(tempos) - 1, int(len(tempos) * 0.99))]
+    print(f"{nome:<28} média={statistics.mean(tempos):8.3f} ms  "
+          f"p50={statistics.median(tempos):8.3f} ms  p99={p99:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da decisão de acesso facial')
+    parser.add_argument('--device-id', required=True, help='deviceId de um leitor cadastrado')
+    parser.add_argument('--user-id', type=int, required=True, help='ID de uma pessoa com credencial')
+    parser.add_argument('--iteracoes', type=int, default=1000, help='Número de decisões por caminho')
+    args = parser.parse_args()
+
+    print(f"Decisões por caminho: {args.iteracoes}")
+    medir('5 consultas (antigo)', caminhoAntigo, args.iteracoes, args.device_id, args.user_id)
+    medir('consulta única preparada', consultaUnica, args.iteracoes, args.device_id, args.user_id)
+
+    cacheAcesso.limparCache()
+    _consultarDadosAcesso(args.device_id, args.user_id)
+    medir('cache aquecido', cacheAquecido, args.iteracoes, args.device_id, args.user_id)
+
+
+if __name__ == '__main__':
+    main()
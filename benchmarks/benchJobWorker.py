@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de vazão da fila tblJobSync contra um banco local.
+
+Insere jobs sintéticos (payload {"benchmark": true}), drena a fila com K
+processos trabalhadores (TrabalhadorJobs com reserva SKIP LOCKED), cada um
+com N lotes simultâneos de até --lote jobs, e mede jobs/s. O envio aos
+leitores é substituído por uma espera fixa por lote (--latencia), então nenhum
+leitor é acessado. Ao final confere que cada job foi reservado uma única vez e
+remove os jobs inseridos.
+
+Use um banco de desenvolvimento: jobs reais pendentes também seriam
+reservados (e marcados como concluídos pelo stub).
+
+Uso:
+    python benchmarks/benchJobWorker.py [--jobs N] [--processos K] [--concorrencia N] [--lote N] [--latencia MS]
+
+Exemplo (antes/depois):
+    python benchmarks/benchJobWorker.py --processos 1 --concorrencia 1 --lote 1   # um job por vez
+    python benchmarks/benchJobWorker.py --processos 4 --concorrencia 4 --lote 100
+"""
+
+import sys
+import os
+
+# Adiciona o diretório raiz do servidor ao path para permitir importações
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import multiprocessing
+import time
+from db import conectarBancoEvento
+
+PAYLOAD = '{"benchmark": true}'
+
+
+def inserirJobs(quantidade):
+    conn = conectarBancoEvento()
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO tblJobSync (idEvento, idPessoa, idArquivo, payload) VALUES (0, %s, %s, %s)",
+        [(i, i, PAYLOAD) for i in range(1, quantidade + 1)]
+    )
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def resultadoJobs():
+    """Retorna (total, concluídos, reservados mais de uma vez) dos jobs do benchmark."""
+    conn = conectarBancoEvento()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT COUNT(*), SUM(status = 'CONCLUIDO'), SUM(tentativas > 1)
+        FROM tblJobSync
+        WHERE payload->>'$.benchmark' = 'true'
+    """)
+    total, concluidos, repetidos = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return int(total or 0), int(concluidos or 0), int(repetidos or 0)
+
+
+def removerJobs():
+    conn = conectarBancoEvento()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM tblJobSync WHERE payload->>'$.benchmark' = 'true'")
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def trabalhador(concorrencia, lote, latencia):
+    """Processo trabalhador: drena a fila com um processamento simulado."""
+    from webservices.controlid.processarJobsSync import TrabalhadorJobs, marcarJobsComoConcluidos
+
+    def processar(jobs):
+        time.sleep(latencia)
+        marcarJobsComoConcluidos([job['id'] for job in jobs])
+        return len(jobs), 0
+
+    TrabalhadorJobs(concorrencia=concorrencia, intervalo=0.1, lote=lote, processar=processar).executar(ate_esvaziar=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de vazão dos trabalhadores de tblJobSync')
+    parser.add_argument('--jobs', type=int, default=500, help='Jobs sintéticos inseridos')
+    parser.add_argument('--processos', type=int, default=2, help='Processos trabalhadores')
+    parser.add_argument('--concorrencia', type=int, default=4, help='Lotes simultâneos por processo')
+    parser.add_argument('--lote', type=int, default=20, help='Jobs por lote')
+    parser.add_argument('--latencia', type=float, default=50, help='Duração simulada de cada lote (ms)')
+    args = parser.parse_args()
+
+    removerJobs()
+    inserirJobs(args.jobs)
+
+    # spawn: cada processo abre o próprio pool de conexões e tem o próprio pid (trabalhador)
+    contexto = multiprocessing.get_context('spawn')
+    processos = [
+        contexto.Process(target=trabalhador, args=(args.concorrencia, args.lote, args.latencia / 1000))
+        for _ in range(args.processos)
+    ]
+    inicio = time.perf_counter()
+    for processo in processos:
+        processo.start()
+    for processo in processos:
+        processo.join()
+    duracao = time.perf_counter() - inicio
+
+    total, concluidos, repetidos = resultadoJobs()
+    removerJobs()
+
+    lotes = -(-args.jobs // args.lote)
+    ideal = -(-lotes // (args.processos * args.concorrencia)) * args.latencia / 1000
+    print(f'Trabalhadores: {args.processos} processo(s) x {args.concorrencia} lotes simultâneos de {args.lote} jobs')
+    print(f'Jobs: {concluidos}/{total} concluídos em {duracao:.2f}s ({concluidos / duracao:.1f} jobs/s, '
+          f'limite teórico {ideal:.2f}s)')
+    print(f'Jobs reservados mais de uma vez: {repetidos}')
+    if concluidos != total or repetidos:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
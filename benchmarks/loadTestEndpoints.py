@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste de carga dos endpoints do servidor com o banco artificialmente lento.
+
+Executa o app FastAPI em processo (httpx + ASGITransport) e substitui os
+handlers por versões que apenas dormem, simulando o tempo de banco: as fotos
+de acesso demoram --atraso-banco segundos e as decisões/heartbeats alguns ms.
+Mede a latência de /new_user_identified.fcgi e /device_is_alive.fcgi enquanto
+--clientes-foto clientes enviam fotos sem parar.
+
+Uso:
+    python benchmarks/loadTestEndpoints.py [--atraso-banco 0.5] [--requisicoes 300] [--sem-offload]
+
+Com --sem-offload os handlers são chamados direto no event loop (comportamento
+anterior), para comparação.
+"""
+
+import sys
+import os
+
+# Adiciona o diretório raiz do servidor ao path para permitir importações
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+import main_server
+
+# Tempo de banco das requisições rápidas (decisão com cache / heartbeat)
+ATRASO_RAPIDO = 0.002
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def instalarHandlersSimulados(atraso_banco, sem_offload):
+    def decisao(**kwargs):
+        time.sleep(ATRASO_RAPIDO)
+        return {'result': {'event': 7, 'user_id': kwargs.get('user_id'), 'user_name': '', 'user_image': False, 'portal_id': 0}}
+
+    def heartbeat(device_id):
+        time.sleep(ATRASO_RAPIDO)
+
+    def foto(**kwargs):
+        time.sleep(atraso_banco)
+        return {'success': True, 'message': 'ok'}
+
+    main_server.handle_user_identified = decisao
+    main_server.handle_device_alive = heartbeat
+    main_server.handle_access_photo = foto
+
+    if sem_offload:
+        async def direto(tipo, funcao, *args, **kwargs):
+            return funcao(*args, **kwargs)
+        main_server.executarBloqueante = direto
+
+
+async def clienteFoto(cliente, parar):
+    corpo = {'device_id': '1', 'user_id': '1', 'event': '7', 'access_photo': 'AAAA'}
+    while not parar.is_set():
+        await cliente.post('/api/notifications/access_photo', json=corpo)
+
+
+async def medirLatencias(cliente, requisicoes):
+    decisoes, heartbeats = [], []
+    for i in range(requisicoes):
+        inicio = time.perf_counter()
+        await cliente.post(
+            '/new_user_identified.fcgi',
+            content=f'device_id=1&user_id={i}&event=7&portal_id=1',
+            headers={'Content-Type': 'application/x-www-form-urlencoded'}
+        )
+        decisoes.append((time.perf_counter() - inicio) * 1000)
+
+        inicio = time.perf_counter()
+        await cliente.post('/device_is_alive.fcgi?device_id=1')
+        heartbeats.append((time.perf_counter() - inicio) * 1000)
+    return decisoes, heartbeats
+
+
+async def cenario(nome, clientes_foto, requisicoes):
+    transporte = httpx.ASGITransport(app=main_server.app)
+    async with httpx.AsyncClient(transport=transporte, base_url='http://teste', timeout=120) as cliente:
+        parar = asyncio.Event()
+        fotos = [asyncio.create_task(clienteFoto(cliente, parar)) for _ in range(clientes_foto)]
+        await asyncio.sleep(0.1)
+        decisoes, heartbeats = await medirLatencias(cliente, requisicoes)
+        parar.set()
+        await asyncio.gather(*fotos)
+
+    for rotulo, valores in (('decisão', decisoes), ('heartbeat', heartbeats)):
+        print(f"{nome:<22} {rotulo:<10} p50={statistics.median(valores):9.2f} ms  "
+              f"p99={percentil(valores, 0.99):9.2f} ms  máx={max(valores):9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga dos endpoints com banco lento')
+    parser.add_argument('--atraso-banco', type=float, default=0.5, help='Tempo de banco das fotos, em segundos')
+    parser.add_argument('--clientes-foto', type=int, default=10, help='Clientes enviando fotos em paralelo')
+    parser.add_argument('--requisicoes', type=int, default=300, help='Decisões/heartbeats medidos por cenário')
+    parser.add_argument('--sem-offload', action='store_true', help='Chama os handlers direto no event loop')
+    args = parser.parse_args()
+
+    instalarHandlersSimulados(args.atraso_banco, args.sem_offload)
+    print(f"Offload: {'não' if args.sem_offload else 'sim'}  atraso do banco nas fotos: {args.atraso_banco}s")
+    asyncio.run(cenario('sem carga de fotos', 0, args.requisicoes))
+    asyncio.run(cenario('banco lento (fotos)', args.clientes_foto, args.requisicoes))
+
+
+if __name__ == '__main__':
+    main()
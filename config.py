@@ -7,3 +7,127 @@ Arquivo de configuração com constantes compartilhadas do sistema.
 # Caminho do sistema de gerenciamento
 SISTEMA_GERENCIAMENTO = '/var/www/html/credeSimpleTcc'
 
+
+# Cache em memória das decisões de acesso (por processo/worker), em segundos
+CACHE_ACESSO_TTL = 60
+# TTL menor para resultados negativos (leitor/pessoa inexistente), para que
+# cadastros novos passem a valer rapidamente
+CACHE_ACESSO_TTL_NEGATIVO = 10
+# Invalidação explícita pelo sistema de gerenciamento (POST /api/cache/acesso/invalidar).
+# O pedido é repassado a todos os processos do servidor, cada um com o seu cache.
+CACHE_ACESSO_TOKEN_INVALIDACAO = ''   # vazio: endpoint desativado
+CACHE_ACESSO_SERVIDORES = ('http://127.0.0.1:10080', 'https://127.0.0.1:10443')
+
+# Diretório para dados pendentes que não puderam ser gravados no banco
+DIRETORIO_SPOOL = '/var/www/spool'
+
+# Gravação assíncrona em lote da tblEntradas
+ENTRADAS_INTERVALO_FLUSH_MS = 200   # grava no máximo a cada N ms...
+ENTRADAS_LINHAS_POR_FLUSH = 200     # ...ou quando acumular M registros
+ENTRADAS_MAX_FILA = 10000           # excedente vai direto para o spool em disco
+
+# Máximo de chamadas bloqueantes (banco/disco) simultâneas por processo do
+# servidor, separado por tipo de requisição para que fotos ou heartbeats lentos
+# não atrasem as decisões de acesso. A soma não deve exceder o pool de conexões
+# do perfil do processo (db.DBConfig.POOL_CONFIG).
+DB_MAX_CONCORRENCIA = {
+    'acesso': 3,
+    'heartbeat': 1,
+    'foto': 1,
+    'arquivo': 2,   # escrita das fotos recebidas (não usa conexão do banco)
+}
+
+# Heartbeats (device_is_alive) dos leitores
+HEARTBEAT_INTERVALO_FLUSH = 5          # grava os heartbeats acumulados a cada N segundos
+HEARTBEAT_TTL_DISPOSITIVOS = 300       # validade do conjunto de deviceIds conhecidos
+HEARTBEAT_RECARGA_DISPOSITIVOS = 30    # intervalo mínimo entre recargas por deviceId desconhecido
+
+# Monitoramento dos leitores: sem heartbeat por N segundos o leitor fica OFF
+LEITOR_TIMEOUT_OFFLINE = 60
+
+# Recebimento em streaming das fotos de acesso. O diretório temporário deve
+# ficar no mesmo sistema de arquivos da mídia, para que a gravação final seja
+# um rename atômico.
+FOTO_ACESSO_DIRETORIO_TEMPORARIO = SISTEMA_GERENCIAMENTO + '/midia/acessos/.recebendo'
+FOTO_ACESSO_TAMANHO_MAXIMO = 5 * 1024 * 1024   # bytes da imagem decodificada
+FOTO_ACESSO_TAMANHO_ESCRITA = 64 * 1024        # grava no disco a cada N bytes decodificados
+
+# Vínculo das fotos de acesso com as tentativas (tblEntradas.idArquivo)
+FOTO_VINCULO_JANELA = 30        # segundos entre a decisão e a foto para considerá-las do mesmo acesso
+FOTO_VINCULO_INTERVALO = 2      # o conciliador grava os vínculos pendentes a cada N segundos
+FOTO_VINCULO_TENTATIVAS = 15    # rodadas do conciliador antes de desistir de uma foto
+
+# Sincronização incremental de imagens: a marca d'água do leitor recua N
+# segundos em relação ao início da sincronização, para não perder alterações
+# que ainda estavam em transações abertas (o reenvio é evitado pela tblLeitorFoto)
+SINCRONIZACAO_IMAGENS_MARGEM = 60
+
+# Cadastro em lote dos usuários nos leitores (usuariosLeitor.py)
+USUARIOS_LEITOR_PAGINA = 1000         # usuários por página ao listar todos os ids do leitor
+USUARIOS_LEITOR_LOTE_CONSULTA = 500   # ids por consulta com IN
+USUARIOS_LEITOR_LOTE_CRIACAO = 200    # usuários por create_objects
+
+# Cliente HTTP dos leitores (clienteLeitor.py)
+LEITOR_HTTP_MAX_CONCORRENCIA = 2      # requisições simultâneas por leitor (conexões keep-alive no pool)
+LEITOR_HTTP_TIMEOUT_CONEXAO = 3       # segundos para abrir a conexão
+LEITOR_HTTP_TIMEOUT_LEITURA = 10      # segundos aguardando a resposta (quando a chamada não informa)
+LEITOR_HTTP_TIMEOUT_FILA = 120        # segundos aguardando vaga no limite de concorrência do leitor
+LEITOR_HTTP_FAIXAS_LATENCIA_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# Sessões dos leitores (sessaoLeitor.py)
+LEITOR_SESSAO_VALIDADE = 600          # segundos em que uma sessão é usada sem revalidar
+LEITOR_SESSAO_RENOVAR_ANTES = 60      # faz novo login N segundos antes de a sessão expirar
+LEITOR_SESSAO_STATUS_INVALIDA = (401, 403)  # respostas do leitor para sessão inválida
+
+# Execução em vários leitores ao mesmo tempo (fanout.py)
+FANOUT_MAX_CONCORRENCIA = 32          # tarefas simultâneas no total (threads do pool)
+FANOUT_MAX_POR_LEITOR = 1             # tarefas simultâneas no mesmo leitor
+FANOUT_PRAZO_LEITOR = 100             # segundos de execução de uma tarefa em um leitor
+
+# Cache das imagens enviadas aos leitores (imagensLeitor.py)
+IMAGENS_CACHE_TAMANHO_MAXIMO = 64 * 1024 * 1024  # bytes de base64 mantidos em memória (LRU)
+
+# Normalização dos avatares antes do envio (imagensLeitor.py, requer Pillow)
+IMAGENS_NORMALIZAR = True
+IMAGENS_DIRETORIO_NORMALIZADAS = SISTEMA_GERENCIAMENTO + '/midia/pessoas/.normalizadas'
+IMAGENS_RESOLUCAO_MAXIMA = (640, 854)   # largura x altura máximas enviadas ao leitor
+IMAGENS_TAMANHO_ALVO = 150 * 1024       # bytes do JPEG gerado
+IMAGENS_QUALIDADES_JPEG = (85, 75, 65, 55)  # qualidades tentadas até atingir o tamanho alvo
+
+# Lotes de imagens enviados com user_set_image_list (loteAdaptativo.py)
+LOTE_IMAGENS_INICIAL = 2 * 1024 * 1024    # bytes de base64 no primeiro lote de cada leitor
+LOTE_IMAGENS_MINIMO = 256 * 1024
+LOTE_IMAGENS_MAXIMO = 8 * 1024 * 1024
+LOTE_IMAGENS_INCREMENTO = 512 * 1024      # aumento após um lote rápido e sem erros
+LOTE_IMAGENS_LATENCIA_ALVO = 10           # segundos; lotes mais lentos reduzem o tamanho
+LOTE_IMAGENS_TIMEOUT = 90                 # segundos aguardando a resposta de um lote
+LOTE_IMAGENS_TENTATIVAS = 3               # tentativas de um lote antes de dividi-lo
+LOTE_IMAGENS_BACKOFF_BASE = 1             # segundos; espera aleatória até base * 2^tentativa
+LOTE_IMAGENS_BACKOFF_MAXIMO = 30
+
+# Pipeline da sincronização de imagens (sincronizarImagens.py)
+PIPELINE_LINHAS_BLOCO = 200       # linhas do delta cujos usuários são conferidos no leitor por vez
+PIPELINE_FILA_LINHAS = 400        # linhas adiantadas entre o banco e a leitura do disco
+PIPELINE_FILA_IMAGENS = 16        # imagens em base64 adiantadas entre o disco e o envio
+
+# Processamento da fila tblJobSync (processarJobsSync.py)
+JOBS_CONCORRENCIA = 4             # lotes de jobs processados ao mesmo tempo por trabalhador
+JOBS_INTERVALO_CONSULTA = 30      # segundos entre consultas à fila quando ela está vazia (jobs novos chegam por aviso)
+JOBS_PRAZO_PROCESSANDO = 600      # segundos em PROCESSANDO após os quais o job é considerado abandonado
+JOBS_INTERVALO_RECUPERACAO = 60   # segundos entre verificações de jobs abandonados
+JOBS_LOTE = 100                   # jobs reservados e enviados aos leitores juntos
+JOBS_BACKOFF_BASE = 30            # segundos de espera antes da 2ª tentativa de um job (dobra a cada falha)
+JOBS_BACKOFF_MAXIMO = 3600        # espera máxima entre tentativas de um job
+
+# Aviso imediato de jobs novos aos trabalhadores residentes (despertarJobs.py)
+JOBS_DIRETORIO_DESPERTAR = '/tmp/processarJobsSync'   # sockets Unix dos trabalhadores deste host
+JOBS_TOKEN_DESPERTAR = ''         # token do POST /api/jobs/despertar (vazio: endpoint desativado)
+
+# Agendador residente (cron.py --daemon): intervalo e prazo de cada tarefa, em segundos
+AGENDADOR_TAREFAS = {
+    'monitorarLeitores': {'intervalo': 60, 'prazo': 50},
+    'sincronizarImagens': {'intervalo': 180, 'prazo': 900},
+    'configurarLeitor': {'intervalo': 300, 'prazo': 600},
+    'metricas': {'intervalo': 300, 'prazo': 30},
+}
+AGENDADOR_JITTER = 10             # atraso aleatório de até N segundos em cada execução
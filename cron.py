@@ -1,11 +1,38 @@
 # cron_control.py
+"""
+Tarefas periódicas dos leitores.
+
+Sem argumentos, executa as tarefas do minuto atual e termina (chamado pelo
+cron do sistema a cada minuto). Com --daemon, fica residente e executa as
+tarefas de AGENDADOR_TAREFAS pelo Agendador: o pool de conexões, as sessões e
+o cliente HTTP dos leitores e o cache de imagens são reaproveitados entre as
+execuções, uma tarefa não roda de novo enquanto a anterior não terminou e cada
+execução tem prazo e métricas de duração.
+
+Uso:
+    python cron.py              # execução única (cron do sistema)
+    python cron.py --daemon     # agendador residente (encerra com SIGTERM)
+    python cron.py manual
+"""
 import datetime
 import os
 import sys
 import asyncio
+import inspect
+import random
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from webservices.controlid.configurarLeitor import configurarLeitor
 from webservices.controlid.atualizarStatusLeitor import monitorarLeitores
 from webservices.controlid.sincronizarImagens import sincronizarImagens
+from webservices.controlid.fanout import Cancelamento
+from webservices.controlid.sessaoLeitor import persistirSessoes
+from webservices.controlid.clienteLeitor import estatisticasClientes
+from webservices.controlid.imagensLeitor import estatisticasImagens
+from db import configurarPool, connection_pool
+from config import AGENDADOR_TAREFAS, AGENDADOR_JITTER
 from logging_config import get_cron_logger
 
 # Configura o timezone, se necessário
@@ -34,6 +61,17 @@ def tarefa_3_min():
 async def tarefa_5_min():
     await configurarLeitor()
 
+def registrarMetricas():
+    # Latência das chamadas HTTP aos leitores
+    estatisticas = estatisticasClientes()
+    if estatisticas:
+        logger.info('Latência por leitor: %s', estatisticas)
+
+    # Aproveitamento do cache de imagens (uma leitura por imagem, não por leitor)
+    imagens = estatisticasImagens()
+    if imagens['hits'] or imagens['misses']:
+        logger.info('Cache de imagens: %s', imagens)
+
 def main():
     now = datetime.datetime.now()
     
@@ -48,10 +86,188 @@ def main():
     if now.minute % 5 == 0:
         asyncio.run(tarefa_5_min())
 
+    registrarMetricas()
+
+
+class Tarefa:
+    """Tarefa periódica do Agendador e as métricas de suas execuções."""
+
+    def __init__(self, nome, funcao, intervalo, prazo, jitter=AGENDADOR_JITTER):
+        self.nome = nome
+        self.funcao = funcao
+        self.intervalo = intervalo
+        self.prazo = prazo
+        self.jitter = jitter
+        # Tarefas síncronas que aceitam um Cancelamento podem ser interrompidas no prazo
+        self.cancelavel = 'cancelamento' in inspect.signature(funcao).parameters
+        self.em_execucao = False
+        self.execucoes = 0
+        self.falhas = 0
+        self.prazos_excedidos = 0
+        self.sobreposicoes = 0
+        self.ultima_duracao = None
+        self.duracao_total = 0.0
+        self.duracao_maxima = 0.0
+
+    def registrar(self, duracao, sucesso):
+        self.execucoes += 1
+        if not sucesso:
+            self.falhas += 1
+        self.ultima_duracao = duracao
+        self.duracao_total += duracao
+        self.duracao_maxima = max(self.duracao_maxima, duracao)
+
+    def estatisticas(self):
+        return {
+            'execucoes': self.execucoes,
+            'falhas': self.falhas,
+            'prazos_excedidos': self.prazos_excedidos,
+            'sobreposicoes': self.sobreposicoes,
+            'em_execucao': self.em_execucao,
+            'ultima_duracao': round(self.ultima_duracao, 3) if self.ultima_duracao is not None else None,
+            'duracao_media': round(self.duracao_total / self.execucoes, 3) if self.execucoes else None,
+            'duracao_maxima': round(self.duracao_maxima, 3),
+        }
+
+
+class Agendador:
+    """
+    Executa tarefas periódicas em um processo residente.
+
+    Cada tarefa roda a cada `intervalo` segundos (mais um atraso aleatório de
+    até `jitter`, para que as tarefas não batam sempre no mesmo instante). Uma
+    execução que encontra a anterior ainda em andamento é ignorada. Ao fim do
+    prazo, tarefas assíncronas são canceladas e as síncronas que recebem um
+    Cancelamento (argumento cancelamento) são avisadas e param no próximo ponto
+    de verificação; as demais não podem ser interrompidas e seguem em segundo
+    plano, bloqueando novas execuções até terminarem.
+    """
+
+    def __init__(self, tarefas):
+        self.tarefas = tarefas
+        self._executor = ThreadPoolExecutor(max_workers=len(tarefas), thread_name_prefix='agendador')
+        # Execuções ainda em andamento, inclusive as que excederam o prazo
+        self._execucoes = set()
+        self._rodadas = set()
+        self._parar = None
+
+    def estatisticas(self):
+        """Retorna as métricas de cada tarefa."""
+        return {tarefa.nome: tarefa.estatisticas() for tarefa in self.tarefas}
+
+    def parar(self):
+        if self._parar is not None:
+            self._parar.set()
+
+    async def executar(self):
+        """Executa as tarefas até receber SIGTERM/SIGINT; espera as execuções em andamento."""
+        loop = asyncio.get_running_loop()
+        self._parar = asyncio.Event()
+        for sinal in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sinal, self.parar)
+
+        logger.info('Agendador iniciado: %s', ', '.join(f'{t.nome} ({t.intervalo}s)' for t in self.tarefas))
+        agendamentos = [asyncio.create_task(self._agendar(tarefa)) for tarefa in self.tarefas]
+        await self._parar.wait()
+
+        logger.info('Encerrando agendador')
+        for agendamento in agendamentos:
+            agendamento.cancel()
+        await asyncio.gather(*agendamentos, return_exceptions=True)
+        if self._execucoes:
+            await asyncio.wait(set(self._execucoes))
+        self._executor.shutdown(wait=False)
+        logger.info('Agendador finalizado: %s', self.estatisticas())
+
+    async def _agendar(self, tarefa):
+        loop = asyncio.get_running_loop()
+        base = loop.time()
+        while True:
+            await asyncio.sleep(max(0, base + random.uniform(0, tarefa.jitter) - loop.time()))
+            if tarefa.em_execucao:
+                tarefa.sobreposicoes += 1
+                logger.warning('Tarefa %s ainda em execução, rodada ignorada', tarefa.nome)
+            else:
+                rodada = asyncio.create_task(self._rodar(tarefa))
+                self._rodadas.add(rodada)
+                rodada.add_done_callback(self._rodadas.discard)
+            # Horários fixos: uma execução lenta não desloca as seguintes
+            base += tarefa.intervalo
+            while base < loop.time():
+                base += tarefa.intervalo
+
+    async def _rodar(self, tarefa):
+        loop = asyncio.get_running_loop()
+        tarefa.em_execucao = True
+        inicio = time.monotonic()
+        cancelamento = None
+        if asyncio.iscoroutinefunction(tarefa.funcao):
+            execucao = asyncio.ensure_future(tarefa.funcao())
+        elif tarefa.cancelavel:
+            cancelamento = Cancelamento()
+            execucao = loop.run_in_executor(self._executor, partial(tarefa.funcao, cancelamento=cancelamento))
+        else:
+            execucao = loop.run_in_executor(self._executor, tarefa.funcao)
+        self._execucoes.add(execucao)
+        execucao.add_done_callback(lambda futuro: self._finalizar(tarefa, inicio, futuro))
+
+        try:
+            await asyncio.wait_for(asyncio.shield(execucao), tarefa.prazo)
+        except asyncio.TimeoutError:
+            tarefa.prazos_excedidos += 1
+            logger.error('Tarefa %s excedeu o prazo de %ss', tarefa.nome, tarefa.prazo)
+            if asyncio.iscoroutinefunction(tarefa.funcao):
+                execucao.cancel()
+            elif cancelamento is not None:
+                cancelamento.cancelar(f'Prazo de {tarefa.prazo}s do agendador excedido')
+        except Exception:
+            # Registrado em _finalizar
+            pass
+
+    def _finalizar(self, tarefa, inicio, futuro):
+        duracao = time.monotonic() - inicio
+        self._execucoes.discard(futuro)
+        tarefa.em_execucao = False
+        erro = None if futuro.cancelled() else futuro.exception()
+        tarefa.registrar(duracao, sucesso=erro is None and not futuro.cancelled())
+        if erro is not None:
+            logger.error('Tarefa %s falhou após %.2fs: %s', tarefa.nome, duracao, erro)
+        elif futuro.cancelled():
+            logger.error('Tarefa %s cancelada após %.2fs', tarefa.nome, duracao)
+        else:
+            logger.info('Tarefa %s concluída em %.2fs', tarefa.nome, duracao)
+
+
+def criarAgendador():
+    """Monta o Agendador com as tarefas e intervalos de AGENDADOR_TAREFAS."""
+    agendador = None
+
+    def metricas():
+        # Sessões novas dos leitores vão para a tblLeitor sem esperar o fim do processo
+        persistirSessoes()
+        registrarMetricas()
+        logger.info('Agendador: %s', agendador.estatisticas())
+        logger.info('Pool de conexões: %s', connection_pool.estatisticas())
+
+    funcoes = {
+        'monitorarLeitores': monitorarLeitores,
+        'sincronizarImagens': sincronizarImagens,
+        'configurarLeitor': configurarLeitor,
+        'metricas': metricas,
+    }
+    agendador = Agendador([
+        Tarefa(nome, funcoes[nome], parametros['intervalo'], parametros['prazo'])
+        for nome, parametros in AGENDADOR_TAREFAS.items()
+    ])
+    return agendador
+
 
 if __name__ == "__main__":
+    configurarPool('cron')
     if len(sys.argv) > 1 and sys.argv[1] == "manual": 
         roda_chamada_manual()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--daemon":
+        asyncio.run(criarAgendador().executar())
     else:
         try:
             main()
@@ -1,5 +1,10 @@
+import os
+import threading
+import time
+import weakref
+from collections import deque
 import mysql.connector
-from mysql.connector import pooling
+from mysql.connector.errors import PoolError
 
 # Ajuste estes valores conforme seu ambiente:
 DB_CONFIG = {
@@ -10,22 +15,240 @@ DB_CONFIG = {
     "database": "tcc_crede"
 }
 
-# Cria um pool de conexões reutilizável
-connection_pool = pooling.MySQLConnectionPool(
-    pool_name     = "mypool",
-    pool_size     = 5,
-    pool_reset_session = True,
-    **DB_CONFIG
-)
+# Dimensionamento do pool por perfil de processo. O perfil é escolhido com
+# configurarPool(perfil) antes do primeiro uso ou pela variável de ambiente
+# CREDE_POOL_PERFIL.
+#   tamanho:               conexões mantidas abertas
+#   excedente:             conexões extras abertas em picos (fechadas ao devolver se já houver `tamanho` ociosas)
+#   timeout_aquisicao:     segundos aguardando uma conexão livre antes do erro
+#   reciclar_apos:         idade máxima da conexão, em segundos
+#   verificar_apos_ocioso: faz ping na conexão ociosa há mais de N segundos
+POOL_CONFIG = {
+    'padrao': {'tamanho': 5, 'excedente': 5, 'timeout_aquisicao': 10, 'reciclar_apos': 1800, 'verificar_apos_ocioso': 30},
+    'http':   {'tamanho': 8, 'excedente': 4, 'timeout_aquisicao': 5, 'reciclar_apos': 1800, 'verificar_apos_ocioso': 30},
+    'https':  {'tamanho': 4, 'excedente': 4, 'timeout_aquisicao': 5, 'reciclar_apos': 1800, 'verificar_apos_ocioso': 30},
+    'cron':   {'tamanho': 4, 'excedente': 16, 'timeout_aquisicao': 30, 'reciclar_apos': 1800, 'verificar_apos_ocioso': 30},
+}
+
+
+class PoolEsgotadoError(PoolError):
+    """Nenhuma conexão ficou livre dentro do timeout de aquisição."""
+    pass
+
+
+class ConexaoPool:
+    """
+    Conexão emprestada do pool. Repassa tudo para a conexão do mysql-connector,
+    exceto close(), que devolve a conexão ao pool. Também pode ser usada com
+    `with`, que devolve a conexão ao sair do bloco.
+
+    Uma conexão esquecida sem close() é descartada quando o objeto é coletado,
+    liberando a vaga no pool.
+    """
+
+    def __init__(self, pool, conn, criada_em):
+        self._pool = pool
+        self._conn = conn
+        self._criada_em = criada_em
+        self._finalizador = weakref.finalize(self, pool._esquecidas.append, conn)
+
+    def __getattr__(self, nome):
+        if self._conn is None:
+            raise PoolError('Conexão já devolvida ao pool')
+        return getattr(self._conn, nome)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traceback):
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._finalizador.detach()
+            conn, self._conn = self._conn, None
+            self._pool._devolver(conn, self._criada_em)
+
+
+class PoolConexoes:
+    """
+    Pool de conexões MySQL com excedente, timeout de aquisição, verificação de
+    saúde, reciclagem por idade e métricas (em uso, aguardando, tempo de espera).
+    Interface compatível com o MySQLConnectionPool: get_connection() / close().
+    """
+
+    def __init__(self, config, tamanho, excedente, timeout_aquisicao, reciclar_apos, verificar_apos_ocioso):
+        self._config = config
+        self._cond = threading.Condition()
+        self._ociosas = deque()  # (conn, criada_em, devolvida_em)
+        # Conexões de ConexaoPool coletadas sem close(); o finalizador só
+        # enfileira (pode rodar em qualquer thread, até com o lock tomado) e o
+        # pool as fecha e libera as vagas em _recolherEsquecidas
+        self._esquecidas = deque()
+        self._total_esquecidas = 0
+        self._abertas = 0
+        self._em_uso = 0
+        self._aguardando = 0
+        self._aquisicoes = 0
+        self._esgotamentos = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self.reconfigurar(tamanho, excedente, timeout_aquisicao, reciclar_apos, verificar_apos_ocioso)
+
+    def reconfigurar(self, tamanho, excedente, timeout_aquisicao, reciclar_apos, verificar_apos_ocioso):
+        """Altera o dimensionamento do pool (as conexões existentes são mantidas)."""
+        with self._cond:
+            self.tamanho = tamanho
+            self.excedente = excedente
+            self.timeout_aquisicao = timeout_aquisicao
+            self.reciclar_apos = reciclar_apos
+            self.verificar_apos_ocioso = verificar_apos_ocioso
+            self._cond.notify_all()
+
+    def get_connection(self):
+        """
+        Empresta uma conexão do pool, abrindo uma nova se houver capacidade.
+
+        Raises:
+            PoolEsgotadoError: se nenhuma conexão ficar livre em timeout_aquisicao segundos
+        """
+        inicio = time.monotonic()
+        prazo = inicio + self.timeout_aquisicao
+        esquecidas = []
+        with self._cond:
+            while True:
+                esquecidas.extend(self._recolherEsquecidas())
+                if self._ociosas:
+                    conn, criada_em, devolvida_em = self._ociosas.pop()
+                    break
+                if self._abertas < self.tamanho + self.excedente:
+                    conn = criada_em = devolvida_em = None
+                    self._abertas += 1
+                    break
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    self._esgotamentos += 1
+                    raise PoolEsgotadoError(
+                        f'Pool de conexões esgotado ({self._em_uso} em uso, {self._aguardando} aguardando)'
+                    )
+                self._aguardando += 1
+                try:
+                    # Acorda periodicamente para recolher conexões esquecidas
+                    self._cond.wait(min(restante, 1))
+                finally:
+                    self._aguardando -= 1
+            self._em_uso += 1
+            espera = time.monotonic() - inicio
+            self._aquisicoes += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+
+        # Abertura, verificação e fechamento acontecem fora do lock
+        for esquecida in esquecidas:
+            self._fechar(esquecida)
+        try:
+            agora = time.monotonic()
+            if conn is not None and agora - criada_em > self.reciclar_apos:
+                self._fechar(conn)
+                conn = None
+            elif conn is not None and agora - devolvida_em > self.verificar_apos_ocioso:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    self._fechar(conn)
+                    conn = None
+            if conn is None:
+                conn = mysql.connector.connect(**self._config)
+                criada_em = time.monotonic()
+        except Exception:
+            with self._cond:
+                self._abertas -= 1
+                self._em_uso -= 1
+                self._cond.notify()
+            raise
+
+        return ConexaoPool(self, conn, criada_em)
+
+    def _devolver(self, conn, criada_em):
+        # Encerra transação pendente para não reaproveitar snapshot antigo
+        reutilizar = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            reutilizar = False
+
+        with self._cond:
+            self._em_uso -= 1
+            # Com alguém aguardando, a conexão passa direto para ele; sem espera,
+            # mantém até `tamanho` ociosas e fecha só as excedentes
+            if reutilizar and (self._aguardando > len(self._ociosas) or len(self._ociosas) < self.tamanho):
+                self._ociosas.append((conn, criada_em, time.monotonic()))
+                conn = None
+            else:
+                self._abertas -= 1
+            self._cond.notify()
+
+        if conn is not None:
+            self._fechar(conn)
+
+    def _recolherEsquecidas(self):
+        """Libera as vagas das conexões esquecidas (chamado com o lock tomado)."""
+        esquecidas = []
+        while self._esquecidas:
+            esquecidas.append(self._esquecidas.popleft())
+            self._abertas -= 1
+            self._em_uso -= 1
+            self._total_esquecidas += 1
+        return esquecidas
+
+    @staticmethod
+    def _fechar(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def estatisticas(self):
+        """
+        Retorna as métricas do pool.
+
+        Returns:
+            dict: tamanho, excedente, abertas, em_uso, ociosas, aguardando,
+            aquisicoes, esgotamentos, esquecidas, espera_media_ms, espera_max_ms
+        """
+        with self._cond:
+            return {
+                'tamanho': self.tamanho,
+                'excedente': self.excedente,
+                'abertas': self._abertas,
+                'em_uso': self._em_uso,
+                'ociosas': len(self._ociosas),
+                'aguardando': self._aguardando,
+                'aquisicoes': self._aquisicoes,
+                'esgotamentos': self._esgotamentos,
+                'esquecidas': self._total_esquecidas + len(self._esquecidas),
+                'espera_media_ms': round(self._espera_total / self._aquisicoes * 1000, 3) if self._aquisicoes else 0.0,
+                'espera_max_ms': round(self._espera_max * 1000, 3),
+            }
+
+
+# Cria um pool de conexões reutilizável (as conexões são abertas sob demanda)
+connection_pool = PoolConexoes(DB_CONFIG, **POOL_CONFIG[os.environ.get('CREDE_POOL_PERFIL', 'padrao')])
+
+def configurarPool(perfil):
+    """
+    Ajusta o pool ao perfil do processo ('http', 'https', 'cron'...).
+    Deve ser chamado no início do processo, antes das primeiras consultas.
+    """
+    connection_pool.reconfigurar(**POOL_CONFIG[perfil])
 
 def conectarBancoCrede():
-    import mysql.connector
-    return mysql.connector.connect(**DB_CONFIG)
+    return connection_pool.get_connection()
 
 def conectarBancoEvento():
     """
     Conecta ao banco de dados do evento.
     Por enquanto, retorna a mesma conexão do banco Crede.
     """
-    import mysql.connector
-    return mysql.connector.connect(**DB_CONFIG)
+    return connection_pool.get_connection()
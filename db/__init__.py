@@ -1,3 +1,3 @@
-from .DBConfig import connection_pool, conectarBancoEvento
+from .DBConfig import connection_pool, conectarBancoEvento, configurarPool
 from .accessAttempt import register_facial_access_attempt
-from .funcoes import updateLeitorSession, updateLeitorDeviceId, findLeitores, findLeitoresParaConfigurar, getEventoBanco, marcarLeitorConfigurado, updateLeitorServerId, updateLeitor
\ No newline at end of file
+from .funcoes import updateLeitorSession, updateLeitorDeviceId, findLeitores, findLeitoresParaConfigurar, getEventoBanco, marcarLeitorConfigurado, updateLeitorServerId, updateLeitor, marcarLeitoresOffline, updateLeitoresSession, registrarLeitorFotos
\ No newline at end of file
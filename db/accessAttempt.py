@@ -1,5 +1,6 @@
 from datetime import datetime
-from db import connection_pool
+from db.filaEntradas import fila_entradas
+from db.vinculoFotos import vinculo_fotos
 
 def register_facial_access_attempt(
     user_id: int,
@@ -16,34 +17,26 @@ def register_facial_access_attempt(
 ):
     """
     Registra uma tentativa de acesso na tblEntradas de acordo com a nova estrutura.
+    A gravação é assíncrona e em lote (ver db.filaEntradas); a função retorna
+    imediatamente, sem esperar o commit. A tentativa fica disponível em memória
+    para receber a foto de acesso (ver db.vinculoFotos).
     """
-    conn = connection_pool.get_connection()
-    cursor = conn.cursor()
-    try:
-        # Se a coluna 'id' é AUTO_INCREMENT, não precisa passar o valor
-        sql = """
-            INSERT INTO tblEntradas
-                (idEvento, idPessoa, idCredencial, idSetor,
-                 idLeitor, credencial, tipoEntrada, permitida, mensagem,
-                 dataTentativa, idLote)
-            VALUES (%s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(sql, (
-            event_id,
-            user_id,
-            credential_id,
-            setor_id,
-            leitor_id,
-            credential,
-            tipo_entrada,
-            'T' if success else 'F',
-            message,
-            data_tentativa if data_tentativa else datetime.now(),
-            idLote
-        ))
-        conn.commit()
-    finally:
-        cursor.close()
-        conn.close()
-        
\ No newline at end of file
+    registro = {
+        'idEvento': event_id,
+        # Rosto não identificado (user_id 0) fica NULL, como a chave usada no vínculo da foto
+        'idPessoa': user_id or None,
+        'idCredencial': credential_id,
+        'idSetor': setor_id,
+        'idLeitor': leitor_id,
+        'credencial': credential,
+        'tipoEntrada': tipo_entrada,
+        'permitida': 'T' if success else 'F',
+        'mensagem': message,
+        # Sem microssegundos, igual ao TIMESTAMP gravado, para o vínculo exato da foto
+        'dataTentativa': (data_tentativa if data_tentativa else datetime.now()).replace(microsecond=0),
+        'idLote': idLote,
+        'idArquivo': None,
+    }
+    vinculo_fotos.registrarDecisao(registro)
+    fila_entradas.adicionar(registro)
+    return registro
@@ -0,0 +1,45 @@
+"""
+Execução de código bloqueante (mysql-connector, disco) fora do event loop.
+
+As rotas do FastAPI são async; chamar o mysql-connector diretamente nelas
+trava o event loop e, com ele, todos os leitores atendidos pelo processo.
+As chamadas são repassadas a pools de threads limitados, um por tipo de
+requisição (DB_MAX_CONCORRENCIA), de forma que uma consulta lenta ocupa
+apenas uma thread do seu próprio tipo e não atrasa os demais.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from config import DB_MAX_CONCORRENCIA
+
+_executores = {}
+
+
+def _obterExecutor(tipo):
+    # Criados sob demanda para que cada worker do uvicorn tenha os seus
+    executor = _executores.get(tipo)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=DB_MAX_CONCORRENCIA[tipo], thread_name_prefix=f'db-{tipo}')
+        _executores[tipo] = executor
+    return executor
+
+
+async def executarBloqueante(tipo, funcao, *args, **kwargs):
+    """
+    Executa funcao(*args, **kwargs) no pool de threads do tipo informado.
+
+    Args:
+        tipo: Chave de DB_MAX_CONCORRENCIA ('acesso', 'heartbeat', 'foto')
+        funcao: Função bloqueante (acesso ao banco ou disco)
+
+    Returns:
+        O retorno da função
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_obterExecutor(tipo), partial(funcao, *args, **kwargs))
+
+
+def encerrarExecutores():
+    """Aguarda as chamadas em andamento e encerra os pools de threads."""
+    for tipo in list(_executores):
+        _executores.pop(tipo).shutdown(wait=True)
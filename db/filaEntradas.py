@@ -0,0 +1,293 @@
+"""
+Fila de gravação assíncrona (write-behind) da tblEntradas.
+
+As tentativas de acesso são enfileiradas em memória e gravadas por uma thread
+em INSERTs de várias linhas (executemany), a cada ENTRADAS_INTERVALO_FLUSH_MS
+ou ENTRADAS_LINHAS_POR_FLUSH registros. Se o banco estiver indisponível ou a
+fila estiver cheia, os registros vão para um arquivo de spool local e são
+regravados quando o banco voltar.
+
+A regravação do spool avança em blocos e guarda a posição já gravada em um
+arquivo ao lado (.posicao): se o processo for interrompido no meio, a próxima
+regravação continua de onde parou (um bloco pode ser gravado duas vezes, mas
+nenhum registro se perde). Linhas corrompidas (gravação interrompida) são
+ignoradas e registradas no log.
+"""
+import atexit
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from db import connection_pool
+from config import (
+    DIRETORIO_SPOOL,
+    ENTRADAS_INTERVALO_FLUSH_MS,
+    ENTRADAS_LINHAS_POR_FLUSH,
+    ENTRADAS_MAX_FILA,
+)
+from logging_config import get_logger
+
+# Obtém o logger configurado para este módulo
+logging = get_logger('FilaEntradas', arquivo_log='logFilaEntradas.log')
+
+COLUNAS = (
+    'idEvento', 'idPessoa', 'idCredencial', 'idSetor', 'idLeitor', 'credencial',
+    'tipoEntrada', 'permitida', 'mensagem', 'dataTentativa', 'idLote', 'idArquivo',
+)
+
+SQL_INSERT = f"""
+    INSERT INTO tblEntradas ({', '.join(COLUNAS)})
+    VALUES ({', '.join(['%s'] * len(COLUNAS))})
+"""
+
+# Intervalo mínimo entre tentativas de regravar o spool (segundos)
+INTERVALO_REPROCESSAR_SPOOL = 30
+
+
+def _terminaComNovaLinha(caminho):
+    """False se o arquivo termina em uma linha incompleta (gravação interrompida)."""
+    try:
+        with open(caminho, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+    except FileNotFoundError:
+        return True
+
+
+class FilaEntradas:
+    """Fila limitada de registros da tblEntradas gravados em lote por uma thread."""
+
+    def __init__(self, intervalo_ms=ENTRADAS_INTERVALO_FLUSH_MS, linhas_por_flush=ENTRADAS_LINHAS_POR_FLUSH,
+                 max_fila=ENTRADAS_MAX_FILA, arquivo_spool=os.path.join(DIRETORIO_SPOOL, 'entradasPendentes.jsonl')):
+        self.intervalo = intervalo_ms / 1000
+        self.linhas_por_flush = linhas_por_flush
+        self.arquivo_spool = arquivo_spool
+        self._fila = queue.Queue(maxsize=max_fila)
+        self._lock = threading.Lock()
+        self._lock_registros = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        self._ultimo_reprocessamento = 0
+
+    def adicionar(self, registro):
+        """
+        Enfileira um registro para gravação e retorna imediatamente.
+
+        Args:
+            registro: dict com as colunas de COLUNAS
+        """
+        self._iniciar()
+        try:
+            self._fila.put_nowait(registro)
+        except queue.Full:
+            # Memória limitada: o excedente vai direto para o disco
+            logging.warning('Fila de entradas cheia, registro enviado para o spool')
+            self._gravarSpool([registro])
+
+    def definirSeNaoGravado(self, registro, coluna, valor):
+        """
+        Altera uma coluna de um registro enfileirado, se ele ainda não foi
+        enviado ao banco nem ao spool.
+
+        Returns:
+            bool: True se o valor vai junto no INSERT do registro
+        """
+        with self._lock_registros:
+            if registro.get('_gravado'):
+                return False
+            registro[coluna] = valor
+            return True
+
+    def _valores(self, registros):
+        """Congela os registros (ver definirSeNaoGravado) e retorna os valores na ordem de COLUNAS."""
+        with self._lock_registros:
+            for registro in registros:
+                registro['_gravado'] = True
+            return [tuple(registro.get(c) for c in COLUNAS) for registro in registros]
+
+    def encerrar(self, timeout=10):
+        """Grava tudo o que estiver na fila e encerra a thread."""
+        self._parar.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _iniciar(self):
+        # A thread é criada sob demanda para funcionar após o fork dos workers
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._parar.clear()
+                self._thread = threading.Thread(target=self._executar, name='FilaEntradas', daemon=True)
+                self._thread.start()
+
+    def _executar(self):
+        while not (self._parar.is_set() and self._fila.empty()):
+            try:
+                lote = self._coletarLote()
+                if lote and self._gravarBanco(lote):
+                    self._reprocessarSpool()
+            except Exception as e:
+                # A thread não pode morrer: os registros seguintes ficariam só na fila
+                logging.error('Erro inesperado na fila de entradas: %s', e, exc_info=True)
+                time.sleep(self.intervalo)
+
+    def _coletarLote(self):
+        """Aguarda o primeiro registro e junta os demais até o limite de linhas ou de tempo."""
+        try:
+            lote = [self._fila.get(timeout=self.intervalo)]
+        except queue.Empty:
+            return []
+        prazo = time.monotonic() + self.intervalo
+        while len(lote) < self.linhas_por_flush and not self._parar.is_set():
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        # No encerramento, esvazia a fila sem esperar o intervalo
+        while len(lote) < self.linhas_por_flush:
+            try:
+                lote.append(self._fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _inserir(self, lote):
+        """Grava o lote com um único INSERT de várias linhas (exceções são propagadas)."""
+        conn = connection_pool.get_connection()
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(SQL_INSERT, self._valores(lote))
+            conn.commit()
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
+
+    def _gravarBanco(self, lote):
+        """Grava o lote no banco; em caso de erro, envia ao spool."""
+        try:
+            self._inserir(lote)
+            return True
+        except Exception as e:
+            logging.error('Erro ao gravar %d entradas, enviando para o spool: %s', len(lote), e)
+            self._gravarSpool(lote)
+            return False
+
+    def _gravarSpool(self, registros):
+        try:
+            valores = self._valores(registros)
+            with self._lock:
+                os.makedirs(os.path.dirname(self.arquivo_spool), exist_ok=True)
+                with open(self.arquivo_spool, 'a', encoding='utf-8') as f:
+                    if not _terminaComNovaLinha(self.arquivo_spool):
+                        f.write('\n')
+                    for linha in valores:
+                        f.write(json.dumps(dict(zip(COLUNAS, linha)), default=str) + '\n')
+        except Exception as e:
+            logging.error('Erro ao gravar %d entradas no spool, registros perdidos: %s', len(registros), e)
+
+    def _reprocessarSpool(self):
+        """Regrava no banco os registros do spool (chamado após uma gravação bem-sucedida)."""
+        agora = time.monotonic()
+        if agora - self._ultimo_reprocessamento < INTERVALO_REPROCESSAR_SPOOL:
+            return
+        self._ultimo_reprocessamento = agora
+        processando = self.arquivo_spool + '.processando'
+        if not os.path.exists(self.arquivo_spool) and not os.path.exists(processando):
+            return
+
+        with self._lock:
+            self._moverSpool(processando)
+
+        posicao = self._lerPosicao(processando)
+        regravados = 0
+        with open(processando, 'rb') as f:
+            f.seek(posicao)
+            while True:
+                registros, fim = self._lerBloco(f)
+                if registros:
+                    try:
+                        self._inserir(registros)
+                    except Exception as e:
+                        # O restante fica no arquivo para a próxima regravação
+                        logging.error('Erro ao regravar entradas do spool (%d regravadas): %s', regravados, e)
+                        return
+                    regravados += len(registros)
+                posicao = f.tell()
+                self._gravarPosicao(processando, posicao)
+                if fim:
+                    break
+
+        os.remove(processando)
+        self._removerPosicao(processando)
+        logging.info('%d entradas do spool regravadas', regravados)
+
+    def _moverSpool(self, processando):
+        """Move o spool para o arquivo em processamento, acrescentando ao que restou da regravação anterior."""
+        if not os.path.exists(self.arquivo_spool):
+            return
+        if not os.path.exists(processando):
+            os.replace(self.arquivo_spool, processando)
+            return
+        with open(self.arquivo_spool, 'rb') as origem, open(processando, 'ab') as destino:
+            if not _terminaComNovaLinha(processando):
+                destino.write(b'\n')
+            shutil.copyfileobj(origem, destino)
+            destino.flush()
+            os.fsync(destino.fileno())
+        os.remove(self.arquivo_spool)
+
+    def _lerBloco(self, f):
+        """
+        Lê até linhas_por_flush registros válidos.
+
+        Returns:
+            tuple: (registros: list, fim do arquivo: bool)
+        """
+        registros = []
+        while len(registros) < self.linhas_por_flush:
+            linha = f.readline()
+            if not linha:
+                return registros, True
+            if not linha.strip():
+                continue
+            try:
+                registros.append(json.loads(linha))
+            except ValueError:
+                logging.error('Linha inválida ignorada no spool de entradas: %r', linha[:200])
+        return registros, False
+
+    @staticmethod
+    def _lerPosicao(processando):
+        try:
+            with open(processando + '.posicao', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    @staticmethod
+    def _gravarPosicao(processando, posicao):
+        temporario = processando + '.posicao.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            f.write(str(posicao))
+        os.replace(temporario, processando + '.posicao')
+
+    @staticmethod
+    def _removerPosicao(processando):
+        try:
+            os.remove(processando + '.posicao')
+        except FileNotFoundError:
+            pass
+
+fila_entradas = FilaEntradas()
+atexit.register(fila_entradas.encerrar)
@@ -29,10 +29,12 @@ def getEventoBanco(codigo: str):
             LIMIT 1
         """
 
-        cursor.execute(query, (codigo,))
-        evento = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        try:
+            cursor.execute(query, (codigo,))
+            evento = cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
         
         return evento['nomeBanco'] if evento else None
     except Exception as e:
@@ -42,20 +44,24 @@ def getEventoBanco(codigo: str):
 def findLeitores():
     conn = conectarBancoEvento()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM tblLeitor")
-    leitores = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    try:
+        cursor.execute("SELECT * FROM tblLeitor")
+        leitores = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
     logging.info('Leitores faciais encontrados: %s', leitores)
     return leitores
 
 def findLeitoresParaConfigurar():
     conn = conectarBancoEvento()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM tblLeitor WHERE configurado = 'F'")
-    leitores = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    try:
+        cursor.execute("SELECT * FROM tblLeitor WHERE configurado = 'F'")
+        leitores = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
     logging.info('Leitores faciais encontrados: %s', leitores)
     return leitores
 
@@ -91,35 +97,139 @@ def updateLeitor(leitor_id: str, campos: dict):
 def marcarLeitorConfigurado(leitor_id):
     conn = conectarBancoEvento()
     cursor = conn.cursor()
-    cursor.execute("UPDATE tblLeitor SET configurado = 'T' WHERE id = %s", (leitor_id,))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    try:
+        cursor.execute("UPDATE tblLeitor SET configurado = 'T' WHERE id = %s", (leitor_id,))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
     logging.info('Leitor %s marcado como configurado', leitor_id)
 
 def updateLeitorSession(leitor_id, session):
     conn = conectarBancoEvento()
     cursor = conn.cursor()
-    cursor.execute("UPDATE tblLeitor SET session = %s WHERE id = %s", (session, leitor_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    try:
+        cursor.execute("UPDATE tblLeitor SET session = %s WHERE id = %s", (session, leitor_id))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
     logging.info('Sessão atualizada para o leitor %s: %s', leitor_id, session)
 
 def updateLeitorDeviceId(leitor_id, device_id):
     conn = conectarBancoEvento()
     cursor = conn.cursor()
-    cursor.execute("UPDATE tblLeitor SET deviceId = %s WHERE id = %s", (device_id, leitor_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    try:
+        cursor.execute("UPDATE tblLeitor SET deviceId = %s WHERE id = %s", (device_id, leitor_id))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
     logging.info('ID do dispositivo atualizado para o leitor %s: %s', leitor_id, device_id)
 
 def updateLeitorServerId(leitor_id, server_id):
     conn = conectarBancoEvento()
     cursor = conn.cursor()
-    cursor.execute("UPDATE tblLeitor SET serverId = %s WHERE id = %s", (server_id, leitor_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
-    logging.info('ID do servidor atualizado para o leitor %s: %s', leitor_id, server_id)
\ No newline at end of file
+    try:
+        cursor.execute("UPDATE tblLeitor SET serverId = %s WHERE id = %s", (server_id, leitor_id))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    logging.info('ID do servidor atualizado para o leitor %s: %s', leitor_id, server_id)
+
+def marcarLeitoresOffline(limite, device_ids=None):
+    """
+    Marca como OFF, em um único UPDATE, os leitores ON sem heartbeat desde limite.
+
+    Args:
+        limite: datetime; leitores com dataMonitoramento anterior a ele ficam OFF
+        device_ids: Restringe aos deviceIds informados (default: todos os leitores)
+
+    Returns:
+        int: Quantidade de leitores marcados como OFF
+    """
+    sql = "UPDATE tblLeitor SET condicao = 'OFF' WHERE condicao = 'ON' AND dataMonitoramento < %s"
+    params = [limite]
+    if device_ids is not None:
+        if not device_ids:
+            return 0
+        sql += f" AND deviceId IN ({', '.join(['%s'] * len(device_ids))})"
+        params.extend(device_ids)
+
+    conn = conectarBancoEvento()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+        conn.close()
+
+def updateLeitorSincronizacaoImagens(leitor_id, data_sincronizacao):
+    """Grava a marca d'água da última sincronização completa de imagens do leitor."""
+    conn = conectarBancoEvento()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE tblLeitor SET dataSincronizacaoImagens = %s WHERE id = %s", (data_sincronizacao, leitor_id))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    logging.info('Marca de sincronização de imagens atualizada para o leitor %s: %s', leitor_id, data_sincronizacao)
+
+def updateLeitoresSession(sessoes: dict):
+    """
+    Grava as sessões de vários leitores em um único executemany.
+
+    :param sessoes: dicionário {leitor_id: session}
+    """
+    conn = conectarBancoEvento()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            "UPDATE tblLeitor SET session = %s WHERE id = %s",
+            [(session, leitor_id) for leitor_id, session in sessoes.items()]
+        )
+        conn.commit()
+        logging.info('Sessões atualizadas para os leitores %s', list(sessoes))
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# Um registro por (idLeitor, idArquivo): o resultado mais recente substitui o anterior
+SQL_REGISTRAR_LEITOR_FOTOS = """
+    INSERT INTO tblLeitorFoto (idEvento, idLeitor, idArquivo, status, mensagem, dataCadastro)
+    VALUES {valores}
+    ON DUPLICATE KEY UPDATE
+        idEvento = VALUES(idEvento),
+        status = VALUES(status),
+        mensagem = VALUES(mensagem)
+"""
+LEITOR_FOTOS_POR_INSERT = 500
+
+
+def registrarLeitorFotos(registros):
+    """
+    Grava o resultado do envio de imagens aos leitores com INSERT de várias
+    linhas e upsert em (idLeitor, idArquivo) (ver sql/leitor_foto_unico.sql).
+
+    :param registros: lista de tuplas (idEvento, idLeitor, idArquivo, status, mensagem)
+    """
+    if not registros:
+        return
+    conn = conectarBancoEvento()
+    cursor = conn.cursor()
+    try:
+        for i in range(0, len(registros), LEITOR_FOTOS_POR_INSERT):
+            bloco = registros[i:i + LEITOR_FOTOS_POR_INSERT]
+            cursor.execute(
+                SQL_REGISTRAR_LEITOR_FOTOS.format(valores=', '.join(['(%s, %s, %s, %s, %s, NOW())'] * len(bloco))),
+                [valor for registro in bloco for valor in registro]
+            )
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,280 @@
+"""
+Vínculo das fotos de acesso com as tentativas de acesso (tblEntradas.idArquivo).
+
+As decisões recentes ficam em memória por (idLeitor, idPessoa) durante
+FOTO_VINCULO_JANELA segundos. Quando a foto chega:
+    - se a tentativa ainda está na fila de gravação (db.filaEntradas), o
+      idArquivo é preenchido no próprio registro e vai junto no INSERT;
+    - se já foi gravada, o vínculo é feito pelo conciliador com a chave exata
+      (idLeitor, idPessoa, dataTentativa);
+    - sem decisão em memória (outro processo, reinício do servidor), o
+      conciliador procura a tentativa mais recente na janela de tempo da foto.
+O conciliador grava os vínculos pendentes a cada FOTO_VINCULO_INTERVALO
+segundos, com um UPDATE para os exatos e outro para os da janela, ambos pelo
+índice (idLeitor, idPessoa, dataTentativa).
+"""
+import atexit
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from db import connection_pool
+from db.filaEntradas import fila_entradas
+from config import FOTO_VINCULO_JANELA, FOTO_VINCULO_INTERVALO, FOTO_VINCULO_TENTATIVAS
+from logging_config import get_logger
+
+# Obtém o logger configurado para este módulo
+logging = get_logger('VinculoFotos', arquivo_log='logVinculoFotos.log')
+
+# Vínculos com a chave exata da tentativa, gravados com um único UPDATE ... JOIN
+SQL_VINCULAR_EXATOS = """
+    UPDATE tblEntradas e
+      JOIN ({valores}) v
+        ON e.idLeitor = v.idLeitor
+       AND e.idPessoa <=> v.idPessoa
+       AND e.dataTentativa = v.dataTentativa
+       SET e.idArquivo = v.idArquivo
+     WHERE e.idArquivo IS NULL
+"""
+SQL_VALOR_EXATO = "SELECT %s AS idLeitor, %s AS idPessoa, %s AS dataTentativa, %s AS idArquivo"
+
+# Vínculos sem decisão em memória: tentativa mais recente na janela de cada foto,
+# todas no mesmo UPDATE. A subconsulta na lista do SELECT impede o MySQL de
+# fundir a tabela derivada (que lê tblEntradas) com a tabela atualizada.
+SQL_VINCULAR_JANELA = """
+    UPDATE tblEntradas e
+      JOIN (
+            SELECT v.idArquivo,
+                   (SELECT c.id FROM tblEntradas c
+                     WHERE c.idLeitor = v.idLeitor AND c.idPessoa <=> v.idPessoa
+                       AND c.dataTentativa BETWEEN v.inicio AND v.fim
+                       AND c.idArquivo IS NULL
+                     ORDER BY c.dataTentativa DESC
+                     LIMIT 1) AS idEntrada
+              FROM ({valores}) v
+           ) j
+        ON e.id = j.idEntrada
+       SET e.idArquivo = j.idArquivo
+     WHERE e.idArquivo IS NULL
+"""
+SQL_VALOR_JANELA = "SELECT %s AS idLeitor, %s AS idPessoa, %s AS inicio, %s AS fim, %s AS idArquivo"
+
+# Fotos já registradas na tentativa, pelo índice (idLeitor, idPessoa, dataTentativa)
+SQL_CONFERIR_VINCULOS = """
+    SELECT v.idArquivo
+      FROM ({valores}) v
+     WHERE EXISTS (
+            SELECT 1 FROM tblEntradas e
+             WHERE e.idLeitor = v.idLeitor AND e.idPessoa <=> v.idPessoa
+               AND e.dataTentativa BETWEEN v.inicio AND v.fim
+               AND e.idArquivo = v.idArquivo
+           )
+"""
+
+def _chave(leitor_id, pessoa_id):
+    # Pessoa 0 (rosto não identificado) é gravada como NULL em tblEntradas (ver db.accessAttempt)
+    return str(leitor_id), (str(pessoa_id) if pessoa_id else None)
+
+
+class VinculoFotos:
+    """Decisões recentes em memória e conciliador dos vínculos foto/tentativa."""
+
+    def __init__(self, janela=FOTO_VINCULO_JANELA, intervalo=FOTO_VINCULO_INTERVALO, tentativas=FOTO_VINCULO_TENTATIVAS):
+        self.janela = timedelta(seconds=janela)
+        self.intervalo = intervalo
+        self.tentativas = tentativas
+        self._decisoes = {}
+        self._pendentes = []
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        self._vinculadas_memoria = 0
+        self._vinculadas_banco = 0
+        self._descartadas = 0
+
+    def registrarDecisao(self, registro):
+        """
+        Guarda a tentativa de acesso recém-enfileirada para receber a foto.
+
+        Args:
+            registro: dict enfileirado em db.filaEntradas
+        """
+        chave = _chave(registro['idLeitor'], registro['idPessoa'])
+        limite = registro['dataTentativa'] - self.janela
+        with self._lock:
+            decisoes = self._decisoes.setdefault(chave, deque())
+            while decisoes and decisoes[0]['dataTentativa'] < limite:
+                decisoes.popleft()
+            decisoes.append(registro)
+
+    def vincular(self, leitor_id, pessoa_id, arquivo_id, data_foto=None):
+        """
+        Relaciona a foto com a tentativa de acesso correspondente.
+
+        Args:
+            leitor_id: ID do leitor
+            pessoa_id: ID da pessoa (None para foto não identificada)
+            arquivo_id: ID da foto em tblArquivo
+            data_foto: Horário do evento informado pelo leitor (default: agora)
+        """
+        data_foto = data_foto or datetime.now()
+        chave = _chave(leitor_id, pessoa_id)
+        registro = None
+        with self._lock:
+            for candidato in reversed(self._decisoes.get(chave, ())):
+                if abs(candidato['dataTentativa'] - data_foto) <= self.janela and not candidato.get('idArquivo'):
+                    registro = candidato
+                    break
+
+        if registro is not None:
+            if fila_entradas.definirSeNaoGravado(registro, 'idArquivo', arquivo_id):
+                with self._lock:
+                    self._vinculadas_memoria += 1
+                return
+            # Já foi para o INSERT: vínculo exato pelo conciliador
+            registro['idArquivo'] = arquivo_id
+            pendente = {'exato': True, 'dataTentativa': registro['dataTentativa']}
+        else:
+            pendente = {'exato': False, 'dataTentativa': data_foto}
+
+        pendente.update({'idLeitor': chave[0], 'idPessoa': chave[1], 'idArquivo': arquivo_id, 'tentativas': 0})
+        with self._lock:
+            self._pendentes.append(pendente)
+        self._iniciar()
+
+    def _iniciar(self):
+        # A thread é criada sob demanda para funcionar após o fork dos workers
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._parar.clear()
+                self._thread = threading.Thread(target=self._executar, name='VinculoFotos', daemon=True)
+                self._thread.start()
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            self.conciliar()
+            self._limparDecisoes()
+        self.conciliar()
+
+    def _limparDecisoes(self):
+        limite = datetime.now() - self.janela
+        with self._lock:
+            for chave in list(self._decisoes):
+                decisoes = self._decisoes[chave]
+                while decisoes and decisoes[0]['dataTentativa'] < limite:
+                    decisoes.popleft()
+                if not decisoes:
+                    del self._decisoes[chave]
+
+    def conciliar(self):
+        """Grava os vínculos pendentes; os não encontrados voltam para a próxima rodada."""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, []
+        if not pendentes:
+            return
+
+        exatos = [p for p in pendentes if p['exato']]
+        janela = [p for p in pendentes if not p['exato']]
+        nao_vinculados = []
+
+        conn = None
+        cursor = None
+        try:
+            conn = connection_pool.get_connection()
+            cursor = conn.cursor()
+
+            if exatos:
+                valores = ' UNION ALL '.join([SQL_VALOR_EXATO] * len(exatos))
+                params = [v for p in exatos for v in (p['idLeitor'], p['idPessoa'], p['dataTentativa'], p['idArquivo'])]
+                cursor.execute(SQL_VINCULAR_EXATOS.format(valores=valores), params)
+                if cursor.rowcount < len(exatos):
+                    # Alguma tentativa ainda não gravada (spool): volta para a próxima rodada
+                    nao_vinculados.extend(self._conferir(cursor, exatos, timedelta(0)))
+                else:
+                    self._vinculadas_banco += len(exatos)
+
+            if janela:
+                valores = ' UNION ALL '.join([SQL_VALOR_JANELA] * len(janela))
+                params = [
+                    v for p in janela for v in (
+                        p['idLeitor'], p['idPessoa'],
+                        p['dataTentativa'] - self.janela, p['dataTentativa'] + self.janela, p['idArquivo'],
+                    )
+                ]
+                cursor.execute(SQL_VINCULAR_JANELA.format(valores=valores), params)
+                if cursor.rowcount < len(janela):
+                    # Sem tentativa na janela, ou duas fotos disputando a mesma tentativa
+                    nao_vinculados.extend(self._conferir(cursor, janela, self.janela))
+                else:
+                    self._vinculadas_banco += len(janela)
+
+            conn.commit()
+        except Exception as e:
+            logging.error('Erro ao vincular %d fotos: %s', len(pendentes), e)
+            nao_vinculados = pendentes
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+        self._reagendar(nao_vinculados)
+
+    def _conferir(self, cursor, pendentes, janela):
+        """
+        Retorna os vínculos cuja foto ainda não ficou registrada na tentativa.
+
+        Args:
+            cursor: Cursor da transação do conciliador
+            pendentes: Vínculos enviados no UPDATE
+            janela: Tolerância em torno de dataTentativa (timedelta(0) para os exatos)
+        """
+        valores = ' UNION ALL '.join([SQL_VALOR_JANELA] * len(pendentes))
+        params = [
+            v for p in pendentes for v in (
+                p['idLeitor'], p['idPessoa'], p['dataTentativa'] - janela, p['dataTentativa'] + janela, p['idArquivo'],
+            )
+        ]
+        cursor.execute(SQL_CONFERIR_VINCULOS.format(valores=valores), params)
+        gravados = {str(linha[0]) for linha in cursor.fetchall()}
+        self._vinculadas_banco += len(gravados)
+        return [p for p in pendentes if str(p['idArquivo']) not in gravados]
+
+    def _reagendar(self, pendentes):
+        devolver = []
+        for p in pendentes:
+            p['tentativas'] += 1
+            if p['tentativas'] < self.tentativas:
+                devolver.append(p)
+            else:
+                self._descartadas += 1
+                logging.warning(
+                    'Nenhuma entrada encontrada para relacionar a foto %s (leitor: %s, pessoa: %s)',
+                    p['idArquivo'], p['idLeitor'], p['idPessoa'],
+                )
+        if devolver:
+            with self._lock:
+                self._pendentes.extend(devolver)
+
+    def estatisticas(self):
+        """Retorna os contadores de vínculos feitos em memória, no banco e descartados."""
+        with self._lock:
+            return {
+                'decisoes_em_memoria': sum(len(d) for d in self._decisoes.values()),
+                'pendentes': len(self._pendentes),
+                'vinculadas_memoria': self._vinculadas_memoria,
+                'vinculadas_banco': self._vinculadas_banco,
+                'descartadas': self._descartadas,
+            }
+
+    def encerrar(self, timeout=10):
+        """Grava os vínculos pendentes e encerra a thread."""
+        self._parar.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+
+
+vinculo_fotos = VinculoFotos()
+atexit.register(vinculo_fotos.encerrar)
@@ -4,12 +4,21 @@ import httpx
 import time
 import os
 import json
+import hmac
 from urllib.parse import parse_qs
 from datetime import datetime
-from config import SISTEMA_GERENCIAMENTO
-from webservices.controlid.deviceAlive import handle_device_alive
+from config import SISTEMA_GERENCIAMENTO, JOBS_TOKEN_DESPERTAR, CACHE_ACESSO_TOKEN_INVALIDACAO, CACHE_ACESSO_SERVIDORES
+from webservices.controlid.deviceAlive import handle_device_alive, coletor_heartbeats
 from webservices.controlid.newAccess import handle_user_identified
 from webservices.controlid.accessPhoto import handle_access_photo
+from webservices.controlid.recebimentoFoto import receberFotoAcesso, descartarTemporario, JSONInvalidoError, FotoInvalidaError
+from webservices.controlid.cacheAcesso import estatisticasCache, invalidarLeitor, invalidarPessoa, invalidarLote, limparCache
+from webservices.controlid.atualizarStatusLeitor import monitor_leitores
+from webservices.controlid.despertarJobs import despertarTrabalhadores
+from db import connection_pool, configurarPool
+from db.filaEntradas import fila_entradas
+from db.vinculoFotos import vinculo_fotos
+from db.execucaoAssincrona import executarBloqueante, encerrarExecutores
 from logging_config import get_server_logger
 
 app = FastAPI()
@@ -17,6 +26,15 @@ app = FastAPI()
 # Obtém o logger configurado para o servidor
 logging = get_server_logger()
 
+@app.on_event("shutdown")
+def encerrar_servidor():
+    # Aguarda as requisições em andamento e grava heartbeats e tentativas de acesso pendentes
+    encerrarExecutores()
+    monitor_leitores.encerrar()
+    coletor_heartbeats.encerrar()
+    fila_entradas.encerrar()
+    vinculo_fotos.encerrar()
+
 @app.post("/device_is_alive.fcgi")
 async def device_is_alive(request: Request):
     logging.info("Requisição em /device_is_alive.fcgi")
@@ -28,7 +46,9 @@ async def device_is_alive(request: Request):
             logging.error("device_id não fornecido em: " + datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
             return JSONResponse(content={}, status_code=400)
 
-        handle_device_alive(device_id)
+        if not await executarBloqueante('heartbeat', handle_device_alive, device_id):
+            logging.warning(f"device_id desconhecido em /device_is_alive.fcgi: {device_id}")
+            return JSONResponse(content={}, status_code=404)
         return JSONResponse(content={}, status_code=200)
         
     except Exception as e:
@@ -38,32 +58,35 @@ async def device_is_alive(request: Request):
 @app.post("/api/notifications/access_photo")
 async def access_photo(request: Request):
     logging.info("Requisição em /api/notifications/access_photo")
+    arquivo_temporario = None
     try:
-        # Obtém o body da requisição
-        body = await request.body()
-        
-        if not body:
-            logging.warning("Body vazio recebido em /api/notifications/access_photo")
-            return JSONResponse(content={'message': 'Body vazio'}, status_code=400)
-        
-        # Parse do JSON
+        # Lê o body em streaming; a foto é decodificada direto para um arquivo temporário
         try:
-            data = json.loads(body.decode('utf-8'))
-        except json.JSONDecodeError as e:
+            data, arquivo_temporario = await receberFotoAcesso(request)
+        except JSONInvalidoError as e:
             logging.error(f"Erro ao fazer parse do JSON: {str(e)}")
             return JSONResponse(content={'message': 'JSON inválido'}, status_code=400)
+        except FotoInvalidaError as e:
+            logging.error(f"Erro ao receber foto: {str(e)}")
+            return JSONResponse(content={'message': str(e)}, status_code=200)  # Sempre 200 para não travar o leitor
+        
+        if data is None:
+            logging.warning("Body vazio recebido em /api/notifications/access_photo")
+            return JSONResponse(content={'message': 'Body vazio'}, status_code=400)
         
         logging.info(f"Foto de acesso recebida - device_id: {data.get('device_id')}, user_id: {data.get('user_id')}, event: {data.get('event')}")
         
         # Processa a foto de acesso
-        result = handle_access_photo(
+        result = await executarBloqueante(
+            'foto',
+            handle_access_photo,
             device_id=data.get('device_id', '0'),
             time=data.get('time', ''),
             portal_id=data.get('portal_id', '0'),
             identifier_id=data.get('identifier_id', '0'),
             event=data.get('event', '0'),
             user_id=data.get('user_id', '0'),
-            access_photo=data.get('access_photo', '')
+            arquivo_temporario=arquivo_temporario
         )
         
         if result['success']:
@@ -75,6 +98,10 @@ async def access_photo(request: Request):
     except Exception as e:
         logging.error(f"Erro ao processar /api/notifications/access_photo: {str(e)}", exc_info=True)
         return JSONResponse(content={'message': 'Erro interno'}, status_code=200)
+    finally:
+        # Foto não aproveitada (leitor inexistente, erro no banco...)
+        if arquivo_temporario:
+            await executarBloqueante('arquivo', descartarTemporario, arquivo_temporario)
 
 @app.post("/new_user_identified.fcgi")
 async def new_user_identified(request: Request):
@@ -103,7 +130,9 @@ async def new_user_identified(request: Request):
             logging.warning("Nenhum dado recebido em /new_user_identified.fcgi")
             return JSONResponse(content={}, status_code=400)
         
-        response = handle_user_identified(
+        response = await executarBloqueante(
+            'acesso',
+            handle_user_identified,
             device_id=data.get("device_id"),
             user_id=data.get("user_id"),
             event=data.get("event"),
@@ -143,15 +172,86 @@ async def new_user_identified(request: Request):
             }
         }, status_code=200)
 
+@app.get("/api/cache/acesso")
+async def cache_acesso():
+    # Contadores de hit/miss do cache de decisões de acesso deste processo
+    return JSONResponse(content=estatisticasCache(), status_code=200)
+
+@app.get("/api/pool/banco")
+async def pool_banco():
+    # Métricas do pool de conexões MySQL deste processo
+    return JSONResponse(content=connection_pool.estatisticas(), status_code=200)
+
+@app.get("/api/leitores/monitor")
+async def monitor_leitores_status():
+    # Leitores acompanhados pelo monitor de heartbeats deste processo
+    return JSONResponse(content=monitor_leitores.estatisticas(), status_code=200)
+
+def tokenValido(request, esperado):
+    # Authorization: Bearer <token>; token vazio na configuração desativa o endpoint
+    token = request.headers.get('authorization', '').removeprefix('Bearer ')
+    return bool(esperado) and hmac.compare_digest(token.encode(), esperado.encode())
+
+@app.post("/api/cache/acesso/invalidar")
+async def invalidar_cache_acesso(request: Request):
+    # Chamado pelo sistema de gerenciamento ao alterar leitores, pessoas, credenciais ou lotes.
+    # Corpo JSON opcional: {"leitor": deviceId, "pessoa": idPessoa, "lote": idLote}; vazio limpa tudo.
+    if not tokenValido(request, CACHE_ACESSO_TOKEN_INVALIDACAO):
+        logging.warning("Token inválido em /api/cache/acesso/invalidar")
+        return JSONResponse(content={'message': 'Não autorizado'}, status_code=401)
+    body = await request.body()
+    try:
+        alvos = json.loads(body) if body.strip() else {}
+        if not isinstance(alvos, dict):
+            raise ValueError('o corpo deve ser um objeto JSON')
+    except ValueError as e:
+        return JSONResponse(content={'message': f'JSON inválido: {e}'}, status_code=400)
+
+    if request.headers.get('x-invalidacao-local'):
+        if not alvos:
+            limparCache()
+        if 'leitor' in alvos:
+            invalidarLeitor(alvos['leitor'])
+        if 'pessoa' in alvos:
+            invalidarPessoa(alvos['pessoa'])
+        if 'lote' in alvos:
+            invalidarLote(alvos['lote'])
+        return JSONResponse(content={'invalidado': alvos or 'tudo'}, status_code=200)
+
+    # Repassa a todos os processos do servidor (inclusive este), cada um com o seu cache
+    servidores = {}
+    cabecalhos = {'authorization': request.headers['authorization'], 'x-invalidacao-local': '1',
+                  'content-type': 'application/json'}
+    async with httpx.AsyncClient(verify=False, timeout=5) as cliente:
+        for servidor in CACHE_ACESSO_SERVIDORES:
+            try:
+                resposta = await cliente.post(f'{servidor}/api/cache/acesso/invalidar', content=body, headers=cabecalhos)
+                servidores[servidor] = resposta.status_code == 200
+            except httpx.HTTPError as e:
+                logging.error(f"Erro ao invalidar o cache em {servidor}: {str(e)}")
+                servidores[servidor] = False
+    return JSONResponse(content={'servidores': servidores}, status_code=200 if all(servidores.values()) else 502)
+
+@app.post("/api/jobs/despertar")
+async def despertar_jobs(request: Request):
+    # Chamado pelo sistema de gerenciamento após gravar um job em tblJobSync
+    if not tokenValido(request, JOBS_TOKEN_DESPERTAR):
+        logging.warning("Token inválido em /api/jobs/despertar")
+        return JSONResponse(content={'message': 'Não autorizado'}, status_code=401)
+    avisados = despertarTrabalhadores()
+    return JSONResponse(content={'trabalhadores_avisados': avisados}, status_code=200)
+
 
 if __name__ == '__main__':
     import multiprocessing
     import uvicorn
 
     def start_http():
+        configurarPool('http')
         uvicorn.run(app, host="0.0.0.0", port=10080)
 
     def start_https():
+        configurarPool('https')
         uvicorn.run(
             app,
             host="0.0.0.0",
@@ -5,6 +5,7 @@ import base64
 import os
 from datetime import datetime
 from db import connection_pool
+from db.vinculoFotos import vinculo_fotos
 from config import SISTEMA_GERENCIAMENTO
 from logging_config import get_logger
 
@@ -12,6 +13,14 @@ from logging_config import get_logger
 logging = get_logger('AccessPhoto', arquivo_log='logAccessPhoto.log')
 
 
+def _dataEvento(time):
+    """Converte o timestamp epoch enviado pelo leitor; sem ele, usa o horário atual."""
+    try:
+        return datetime.fromtimestamp(int(time))
+    except (ValueError, TypeError, OverflowError, OSError):
+        return datetime.now()
+
+
 def handle_access_photo(
     device_id: str,
     time: str,
@@ -19,7 +28,8 @@ def handle_access_photo(
     identifier_id: str,
     event: str,
     user_id: str,
-    access_photo: str
+    access_photo: str = None,
+    arquivo_temporario: str = None
 ):
     """
     Processa uma foto de acesso enviada pelo leitor facial.
@@ -32,6 +42,8 @@ def handle_access_photo(
         event: Tipo de evento
         user_id: ID do usuário identificado
         access_photo: Foto em base64 (JPEG)
+        arquivo_temporario: Foto já decodificada em arquivo temporário (recebida
+            em streaming); é movida para o destino final com um rename atômico
         
     Returns:
         dict: Resultado do processamento
@@ -50,7 +62,7 @@ def handle_access_photo(
         logging.info(f"Recebendo foto de acesso - device_id: {device_id_int}, user_id: {user_id_int}, event: {event_int}")
         
         # Verifica se tem foto
-        if not access_photo:
+        if not access_photo and not arquivo_temporario:
             logging.warning("Foto vazia recebida")
             return {'success': False, 'message': 'Foto vazia'}
         
@@ -96,11 +108,15 @@ def handle_access_photo(
             caminho_arquivo = os.path.join(caminho_completo, nome_arquivo)
             path_local = f"{diretorio}/{nome_arquivo}"
             
-            # Decodifica e salva a foto
+            # Salva a foto; o rename garante que o arquivo final nunca fica parcial
             try:
-                foto_bytes = base64.b64decode(access_photo)
-                with open(caminho_arquivo, 'wb') as f:
-                    f.write(foto_bytes)
+                if arquivo_temporario:
+                    os.replace(arquivo_temporario, caminho_arquivo)
+                else:
+                    foto_bytes = base64.b64decode(access_photo)
+                    with open(caminho_arquivo + '.part', 'wb') as f:
+                        f.write(foto_bytes)
+                    os.replace(caminho_arquivo + '.part', caminho_arquivo)
                 logging.info(f"Foto salva em: {path_local}")
             except Exception as e:
                 logging.error(f"Erro ao salvar foto: {str(e)}")
@@ -121,37 +137,12 @@ def handle_access_photo(
             
             arquivo_id = cursor.lastrowid
             
-            # Busca a entrada mais recente deste usuário/leitor para relacionar
-            if user_id_int > 0:
-                cursor.execute("""
-                    SELECT id FROM tblEntradas
-                    WHERE idPessoa = %s AND idLeitor = %s
-                    ORDER BY dataTentativa DESC
-                    LIMIT 1
-                """, (user_id_int, leitor_id))
-            else:
-                cursor.execute("""
-                    SELECT id FROM tblEntradas
-                    WHERE idLeitor = %s AND idPessoa IS NULL
-                    ORDER BY dataTentativa DESC
-                    LIMIT 1
-                """, (leitor_id,))
-            
-            entrada = cursor.fetchone()
-            
-            # Se encontrou uma entrada, atualiza com o ID do arquivo
-            if entrada:
-                cursor.execute("""
-                    UPDATE tblEntradas
-                    SET idArquivo = %s
-                    WHERE id = %s
-                """, (arquivo_id, entrada['id']))
-                logging.info(f"Foto relacionada com entrada ID: {entrada['id']}")
-            else:
-                logging.warning(f"Nenhuma entrada encontrada para relacionar a foto (user_id: {user_id_int}, leitor_id: {leitor_id})")
-            
             conn.commit()
             
+            # Relaciona com a tentativa de acesso: direto na fila de gravação se a
+            # decisão ainda estiver em memória, senão pelo conciliador em segundo plano
+            vinculo_fotos.vincular(leitor_id, user_id_int or None, arquivo_id, _dataEvento(time))
+            
             logging.info(f"Foto de acesso processada com sucesso - arquivo_id: {arquivo_id}")
             return {
                 'success': True,
@@ -1,23 +1,133 @@
+"""
+Monitoramento da condição (ON/OFF) dos leitores.
+
+O servidor alimenta o MonitorLeitores a cada heartbeat (device_is_alive): cada
+leitor tem um prazo em um heap e, quando o prazo vence sem nova batida, os
+leitores vencidos são marcados como OFF em um único UPDATE. monitorarLeitores()
+continua disponível para o cron como rede de segurança (leitores que pararam
+de enviar heartbeats enquanto o servidor estava fora do ar).
+"""
+import heapq
+import threading
 import time
-from db.funcoes import (
-    findLeitores,
-    updateLeitor,
-)
 from datetime import datetime, timedelta
+from db.funcoes import marcarLeitoresOffline
+from config import LEITOR_TIMEOUT_OFFLINE, HEARTBEAT_INTERVALO_FLUSH
 from logging_config import get_atualizar_status_logger
+import pytz
 
 # Obtém o logger configurado para este módulo
 logging = get_atualizar_status_logger()
 
+
+def _limiteOffline(timeout=LEITOR_TIMEOUT_OFFLINE):
+    """Horário (America/Sao_Paulo) antes do qual o último heartbeat deixa o leitor OFF."""
+    return (datetime.now(pytz.timezone("America/Sao_Paulo")) - timedelta(seconds=timeout)).replace(tzinfo=None)
+
+
+class MonitorLeitores:
+    """
+    Heap de prazos por deviceId. Entradas antigas do heap (de batidas
+    substituídas) são descartadas ao serem retiradas.
+    """
+
+    def __init__(self, timeout=LEITOR_TIMEOUT_OFFLINE):
+        self.timeout = timeout
+        self._prazos = {}
+        self._heap = []
+        self._cond = threading.Condition()
+        self._parar = False
+        self._thread = None
+        self._marcados_offline = 0
+
+    def batida(self, device_id):
+        """Registra um heartbeat e reinicia o prazo do leitor."""
+        prazo = time.monotonic() + self.timeout
+        with self._cond:
+            adiantou = not self._heap or prazo < self._heap[0][0]
+            self._prazos[device_id] = prazo
+            heapq.heappush(self._heap, (prazo, device_id))
+            if adiantou:
+                self._cond.notify()
+        self._iniciar()
+
+    def _iniciar(self):
+        # A thread é criada sob demanda para funcionar após o fork dos workers
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._parar = False
+                self._thread = threading.Thread(target=self._executar, name='MonitorLeitores', daemon=True)
+                self._thread.start()
+
+    def _retirarVencidos(self):
+        """Retira do heap os leitores com prazo vencido (chamado com o lock)."""
+        agora = time.monotonic()
+        vencidos = []
+        while self._heap and self._heap[0][0] <= agora:
+            prazo, device_id = heapq.heappop(self._heap)
+            if self._prazos.get(device_id) == prazo:
+                del self._prazos[device_id]
+                vencidos.append(device_id)
+        return vencidos
+
+    def _executar(self):
+        while True:
+            with self._cond:
+                while not self._parar:
+                    vencidos = self._retirarVencidos()
+                    if vencidos:
+                        break
+                    espera = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(espera)
+                if self._parar:
+                    return
+            self._marcarOffline(vencidos)
+
+    def _marcarOffline(self, device_ids):
+        # A condição em dataMonitoramento evita derrubar um leitor cujos
+        # heartbeats chegaram por outro processo do servidor
+        try:
+            marcados = marcarLeitoresOffline(_limiteOffline(self.timeout), device_ids)
+            self._marcados_offline += marcados
+            if marcados:
+                logging.info('%d leitor(es) sem heartbeat marcado(s) como OFF', marcados)
+        except Exception as e:
+            logging.error(f"Erro ao marcar leitores como OFF: {e}")
+            # Tenta novamente após o próximo flush dos heartbeats
+            prazo = time.monotonic() + HEARTBEAT_INTERVALO_FLUSH
+            with self._cond:
+                for device_id in device_ids:
+                    if device_id not in self._prazos:
+                        self._prazos[device_id] = prazo
+                        heapq.heappush(self._heap, (prazo, device_id))
+
+    def estatisticas(self):
+        """Retorna a quantidade de leitores monitorados e de leitores marcados como OFF."""
+        with self._cond:
+            return {'monitorados': len(self._prazos), 'marcados_offline': self._marcados_offline}
+
+    def encerrar(self, timeout=5):
+        """Encerra a thread do monitor."""
+        with self._cond:
+            self._parar = True
+            self._cond.notify()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+
+
+monitor_leitores = MonitorLeitores()
+
+
 def monitorarLeitores():
+    """
+    Rede de segurança do cron: marca como OFF, em um único UPDATE, todos os
+    leitores sem heartbeat há mais de LEITOR_TIMEOUT_OFFLINE segundos.
+    """
     try:
-        leitores = findLeitores()
-        for leitor in leitores:
-            dataMonitoramento = leitor['dataMonitoramento']
-            if dataMonitoramento:
-                if (datetime.now() - dataMonitoramento).total_seconds() > 60:
-                    updateLeitor(leitor['id'], {'condicao': 'OFF'})
-                    
+        marcados = marcarLeitoresOffline(_limiteOffline())
+        if marcados:
+            logging.info('%d leitor(es) sem heartbeat marcado(s) como OFF', marcados)
     except Exception as e:
         logging.error(f"Erro ao monitorar leitores: {e}")
-            
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Cache em memória dos dados usados na decisão de acesso facial.
+
+Cada processo (worker do uvicorn) mantém o seu próprio cache. As entradas
+expiram por TTL e podem ser invalidadas explicitamente quando o cadastro de
+leitores, pessoas, credenciais ou lotes for alterado: o sistema de
+gerenciamento chama POST /api/cache/acesso/invalidar (main_server.py), que
+repassa o pedido a todos os processos do servidor.
+
+Caches mantidos:
+    leitores:     deviceId -> {'id', 'idEvento', 'idSetor'} ou None
+    credenciais:  idPessoa -> credencial ativa mais recente, {} (pessoa sem
+                  credencial) ou None (pessoa inexistente/inativa)
+    lotesSetores: (idLote, idSetor) -> bool (lote tem acesso ao setor)
+    periodos:     idLote -> IndicePeriodos com os períodos ativos do lote
+"""
+import threading
+import time
+from config import CACHE_ACESSO_TTL, CACHE_ACESSO_TTL_NEGATIVO
+
+# Marcador para diferenciar "não está no cache" de um valor None armazenado
+AUSENTE = object()
+
+
+class CacheTTL:
+    """
+    Dicionário thread-safe com expiração por entrada e contadores de hit/miss.
+    Valores "falsos" (None, {}, [], False) usam o TTL negativo.
+    """
+
+    def __init__(self, nome, ttl=CACHE_ACESSO_TTL, ttl_negativo=CACHE_ACESSO_TTL_NEGATIVO):
+        self.nome = nome
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self.hits = 0
+        self.misses = 0
+        self._dados = {}
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        """Retorna o valor em cache ou AUSENTE se não existir ou tiver expirado."""
+        agora = time.monotonic()
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is not None:
+                valor, expira_em = item
+                if expira_em > agora:
+                    self.hits += 1
+                    return valor
+                del self._dados[chave]
+            self.misses += 1
+            return AUSENTE
+
+    def definir(self, chave, valor):
+        """Armazena um valor com o TTL adequado (positivo ou negativo)."""
+        ttl = self.ttl if valor else self.ttl_negativo
+        with self._lock:
+            self._dados[chave] = (valor, time.monotonic() + ttl)
+
+    def obterOuCarregar(self, chave, carregar):
+        """
+        Retorna o valor em cache ou executa carregar() e armazena o resultado.
+
+        Args:
+            chave: Chave do cache
+            carregar: Função sem argumentos que busca o valor no banco
+
+        Returns:
+            Valor armazenado para a chave
+        """
+        valor = self.obter(chave)
+        if valor is AUSENTE:
+            valor = carregar()
+            self.definir(chave, valor)
+        return valor
+
+    def invalidar(self, chave=None, predicado=None):
+        """
+        Remove entradas do cache.
+
+        Args:
+            chave: Remove apenas esta chave
+            predicado: Remove as chaves para as quais predicado(chave) é verdadeiro
+            (sem chave nem predicado, limpa o cache inteiro)
+        """
+        with self._lock:
+            if chave is not None:
+                self._dados.pop(chave, None)
+            elif predicado is not None:
+                for k in [k for k in self._dados if predicado(k)]:
+                    del self._dados[k]
+            else:
+                self._dados.clear()
+
+    def estatisticas(self):
+        """Retorna os contadores do cache."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entradas': len(self._dados),
+                'hits': self.hits,
+                'misses': self.misses,
+                'taxa_acerto': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+leitores = CacheTTL('leitores')
+credenciais = CacheTTL('credenciais')
+lotesSetores = CacheTTL('lotesSetores')
+periodos = CacheTTL('periodos')
+
+_CACHES = (leitores, credenciais, lotesSetores, periodos)
+
+
+def invalidarLeitor(device_id=None):
+    """Invalida o leitor informado (ou todos os leitores)."""
+    leitores.invalidar(device_id)
+
+
+def invalidarPessoa(pessoa_id=None):
+    """Invalida a pessoa/credencial informada (ou todas)."""
+    credenciais.invalidar(int(pessoa_id) if pessoa_id is not None else None)
+
+
+def invalidarLote(lote_id=None):
+    """Invalida as relações lote/setor e os períodos do lote informado (ou de todos)."""
+    if lote_id is None:
+        lotesSetores.invalidar()
+        periodos.invalidar()
+        return
+    lote_id = str(lote_id)
+    lotesSetores.invalidar(predicado=lambda chave: str(chave[0]) == lote_id)
+    periodos.invalidar(predicado=lambda chave: str(chave) == lote_id)
+
+
+def limparCache():
+    """Limpa todos os caches de acesso."""
+    for cache in _CACHES:
+        cache.invalidar()
+
+
+def estatisticasCache():
+    """
+    Retorna os contadores de hit/miss de cada cache.
+
+    Returns:
+        dict: {nome_do_cache: {'entradas', 'hits', 'misses', 'taxa_acerto'}}
+    """
+    return {cache.nome: cache.estatisticas() for cache in _CACHES}
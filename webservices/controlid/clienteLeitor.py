@@ -0,0 +1,139 @@
+"""
+Cliente HTTP compartilhado para as chamadas aos leitores Control iD.
+
+Cada leitor (ip) tem um ClienteLeitor com uma requests.Session própria
+(conexões keep-alive reaproveitadas pelo HTTPAdapter), um limite de
+requisições simultâneas (os leitores atendem poucas conexões ao mesmo tempo)
+e um histograma de latência das requisições. Os clientes ficam em um registro
+por processo e são obtidos com clienteLeitor(leitor).
+"""
+import threading
+import time
+from bisect import bisect_left
+import requests
+from requests.adapters import HTTPAdapter
+from config import (
+    LEITOR_HTTP_MAX_CONCORRENCIA,
+    LEITOR_HTTP_TIMEOUT_CONEXAO,
+    LEITOR_HTTP_TIMEOUT_LEITURA,
+    LEITOR_HTTP_TIMEOUT_FILA,
+    LEITOR_HTTP_FAIXAS_LATENCIA_MS,
+)
+
+
+class ClienteLeitor:
+    """Session HTTP de um leitor, com limite de concorrência e métricas de latência."""
+
+    def __init__(self, ip, max_concorrencia=LEITOR_HTTP_MAX_CONCORRENCIA):
+        self.ip = ip
+        self._sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=max_concorrencia)
+        self._sessao.mount('http://', adaptador)
+        self._semaforo = threading.BoundedSemaphore(max_concorrencia)
+        self._lock = threading.Lock()
+        self._faixas = [0] * (len(LEITOR_HTTP_FAIXAS_LATENCIA_MS) + 1)
+        self._requisicoes = 0
+        self._erros = 0
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+
+    def get(self, caminho, **kwargs):
+        return self.requisicao('GET', caminho, **kwargs)
+
+    def post(self, caminho, **kwargs):
+        return self.requisicao('POST', caminho, **kwargs)
+
+    def requisicao(self, metodo, caminho, timeout=None, **kwargs):
+        """
+        Faz uma requisição ao leitor.
+
+        Args:
+            metodo: 'GET', 'POST'...
+            caminho: Caminho da URL, ex.: 'load_objects.fcgi?session=...'
+            timeout: Timeout de leitura em segundos (default: LEITOR_HTTP_TIMEOUT_LEITURA)
+            **kwargs: Repassados para requests (json, data, headers...)
+
+        Returns:
+            requests.Response
+
+        Raises:
+            requests.exceptions.RequestException: Erro de comunicação, ou
+            requests.exceptions.Timeout se o leitor ficar ocupado por mais de
+            LEITOR_HTTP_TIMEOUT_FILA segundos
+        """
+        leitura = timeout or LEITOR_HTTP_TIMEOUT_LEITURA
+        timeout = (min(LEITOR_HTTP_TIMEOUT_CONEXAO, leitura), leitura)
+        url = f"http://{self.ip}/{caminho.lstrip('/')}"
+
+        if not self._semaforo.acquire(timeout=LEITOR_HTTP_TIMEOUT_FILA):
+            raise requests.exceptions.Timeout(f'Leitor {self.ip} ocupado: limite de requisições simultâneas atingido')
+        inicio = time.monotonic()
+        erro = True
+        try:
+            response = self._sessao.request(metodo, url, timeout=timeout, **kwargs)
+            erro = False
+            return response
+        finally:
+            self._semaforo.release()
+            self._registrar((time.monotonic() - inicio) * 1000, erro)
+
+    def _registrar(self, duracao_ms, erro):
+        with self._lock:
+            self._faixas[bisect_left(LEITOR_HTTP_FAIXAS_LATENCIA_MS, duracao_ms)] += 1
+            self._requisicoes += 1
+            self._erros += erro
+            self._latencia_total += duracao_ms
+            self._latencia_max = max(self._latencia_max, duracao_ms)
+
+    def estatisticas(self):
+        """
+        Retorna as métricas do leitor.
+
+        Returns:
+            dict: requisicoes, erros, latencia_media_ms, latencia_max_ms e
+            histograma ({'<=N': quantidade, ..., '>N': quantidade})
+        """
+        with self._lock:
+            rotulos = [f'<={limite}' for limite in LEITOR_HTTP_FAIXAS_LATENCIA_MS]
+            rotulos.append(f'>{LEITOR_HTTP_FAIXAS_LATENCIA_MS[-1]}')
+            return {
+                'requisicoes': self._requisicoes,
+                'erros': self._erros,
+                'latencia_media_ms': round(self._latencia_total / self._requisicoes, 1) if self._requisicoes else 0.0,
+                'latencia_max_ms': round(self._latencia_max, 1),
+                'histograma': dict(zip(rotulos, self._faixas)),
+            }
+
+    def fechar(self):
+        self._sessao.close()
+
+
+_clientes = {}
+_lock_clientes = threading.Lock()
+
+
+def clienteLeitor(leitor):
+    """
+    Retorna o cliente HTTP compartilhado do leitor (criado no primeiro uso).
+
+    Args:
+        leitor: Leitor (tblLeitor) ou ip do leitor
+    """
+    ip = leitor['ip'] if isinstance(leitor, dict) else leitor
+    cliente = _clientes.get(ip)
+    if cliente is None:
+        with _lock_clientes:
+            cliente = _clientes.get(ip)
+            if cliente is None:
+                cliente = _clientes[ip] = ClienteLeitor(ip)
+    return cliente
+
+
+def estatisticasClientes():
+    """
+    Retorna as métricas de todos os leitores usados por este processo.
+
+    Returns:
+        dict: {ip: ClienteLeitor.estatisticas()}
+    """
+    return {ip: cliente.estatisticas() for ip, cliente in list(_clientes.items())}
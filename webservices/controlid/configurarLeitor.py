@@ -4,14 +4,14 @@ import mysql.connector
 import time
 import os
 import fcntl
-from threading import Thread
 from db.funcoes import (
-    updateLeitorSession,
     updateLeitorDeviceId,  
     updateLeitorServerId,
     findLeitoresParaConfigurar,
     marcarLeitorConfigurado,
 )
+from webservices.controlid.sessaoLeitor import sessaoLeitor, gerenciador_sessoes
+from webservices.controlid.fanout import fanoutLeitores, Cancelamento
 from logging_config import get_config_leitor_logger
 
 # Obtém o logger configurado para este módulo
@@ -19,45 +19,29 @@ logging = get_config_leitor_logger()
 
 # Função para fazer o login no leitor
 def login(leitor):
-    try:
-        response = requests.post(
-            f"http://{leitor['ip']}/login.fcgi",
-            data={'login': leitor['usuario'], 'password': leitor['senha']},
-            timeout=5
-        )
-    except requests.exceptions.RequestException as e:
-        logging.error('Erro de conexão ao tentar logar no leitor %s: %s', leitor['nomeLeitor'], str(e))
-        return None
-    if response.status_code == 200:
-        session = response.json().get('session')
-        updateLeitorSession(leitor['id'], session)
-        return session
-    else:
-        logging.error('Falha ao logar no leitor facial %s: %s', leitor['nomeLeitor'], response.text)
-        return None
+    """
+    Faz um novo login no leitor. A sessão fica no cache de sessões do processo
+    e é gravada na tblLeitor de forma adiada (ver sessaoLeitor).
+    """
+    return gerenciador_sessoes.renovar(leitor, leitor.get('session'))
 
-# Função para verificar se a sessão do leitor é válida
+# Função para obter uma sessão válida do leitor
 def isSessionValid(leitor):
-    try:
-        response = requests.get(f"http://{leitor['ip']}/session_is_valid.fcgi?session={leitor['session']}", timeout=5)
-        if response.status_code == 200 and response.json().get('session_is_valid', False):
-            return leitor['session']
-        else:
-            nova_session = login(leitor)
-            if nova_session:
-                logging.info('Sessão do leitor %s foi renovada com sucesso', leitor['nomeLeitor'])
-                return nova_session
-            else:
-                logging.error('Falha ao renovar a sessão do leitor %s', leitor['nomeLeitor'])
-                return None
-    except requests.exceptions.RequestException:
-        return None
+    """
+    Retorna a sessão do leitor a partir do cache, sem consultar
+    session_is_valid.fcgi; faz login apenas se não houver sessão ou se ela
+    estiver perto de expirar. Sessões recusadas pelo leitor são renovadas nas
+    chamadas feitas com sessaoLeitor(leitor).
+    """
+    return gerenciador_sessoes.obter(leitor)
     
-def configurarUnicoLeitor(leitor, master_password):
+def configurarUnicoLeitor(leitor, master_password, cancelamento=None):
     """
     Função Worker: Executa a configuração de um único leitor.
-    Esta função será executada dentro de cada Thread.
+    Executada pelo fan-out (ver fanout), que interrompe a configuração entre
+    as etapas se o prazo do leitor acabar.
     """
+    cancelamento = cancelamento or Cancelamento()
     session = isSessionValid(leitor)
     
     if not session:
@@ -67,8 +51,8 @@ def configurarUnicoLeitor(leitor, master_password):
     logging.info('Iniciando configuração do leitor %s', leitor['nomeLeitor'])
     
     try:
-        device_response = requests.post(
-            f"http://{leitor['ip']}/load_objects.fcgi?session={session}",
+        device_response = sessaoLeitor(leitor).post(
+            "load_objects.fcgi",
             json={
                 'object': 'devices',
                 'where': [{'object': 'devices', 'field': 'ip', 'operator': '=', 'value': leitor['ip']}]
@@ -96,9 +80,13 @@ def configurarUnicoLeitor(leitor, master_password):
 
     # Processo de configuração sequencial
     server_url = leitor.get('serverUrl') + ":10080"
+    cancelamento.verificar()
     updateOrCreateServer(leitor, session, server_url)
+    cancelamento.verificar()
     changeMasterPassword(leitor, session, master_password)
+    cancelamento.verificar()
     configureMonitor(leitor, session, server_url)
+    cancelamento.verificar()
     configureRTSP(leitor, session)
     
     logging.info('Configuração do leitor %s concluída com sucesso', leitor['nomeLeitor'])
@@ -107,7 +95,8 @@ def configurarUnicoLeitor(leitor, master_password):
 
 async def configurarLeitor(master_password="654123"):
     """
-    Função Principal: Gerencia as threads para configurar leitores em paralelo.
+    Função Principal: Configura os leitores em paralelo, no event loop atual,
+    com threads e prazo por leitor limitados (ver fanout).
     """
     leitores = findLeitoresParaConfigurar()
     
@@ -117,29 +106,20 @@ async def configurarLeitor(master_password="654123"):
 
     print(f"Leitores encontrados para configurar: {len(leitores)}")
     
-    threads = []
-    for leitor in leitores:
-        # Cria uma thread para cada leitor apontando para a função worker
-        thread = Thread(target=configurarUnicoLeitor, args=(leitor, master_password))
-        thread.daemon = True
-        thread.start()
-        threads.append(thread)
-        logging.info('Thread de configuração iniciada para o leitor %s', leitor['nomeLeitor'])
-
-    print(f"Threads de configuração iniciadas: {len(threads)}")
-
-    # Aguarda todas as threads completarem (timeout de segurança do exemplo)
-    for thread in threads:
-        thread.join(timeout=100)
-        if thread.is_alive():
-            logging.error('Thread de configuração para um leitor não finalizou no tempo esperado')
+    resultados = await fanoutLeitores(leitores, configurarUnicoLeitor, master_password)
+    
+    for resultado in resultados:
+        if not resultado['sucesso']:
+            logging.error('Configuração do leitor %s não concluída em %.1fs: %s',
+                          resultado['leitor']['nomeLeitor'], resultado['duracao'], resultado['erro'] or 'falha')
 
-    logging.info('Todas as threads de configuração finalizadas.')
+    logging.info('Configuração finalizada: %d de %d leitores configurados.',
+                 sum(r['sucesso'] for r in resultados), len(resultados))
     
 def configureRTSP(leitor, session):
     try:
-        rtsp_response = requests.post(
-            f"http://{leitor['ip']}/set_configuration.fcgi?session={session}",
+        rtsp_response = sessaoLeitor(leitor).post(
+            "set_configuration.fcgi",
             json={
                 'onvif': {
                     'rtsp_enabled': '1',
@@ -172,8 +152,8 @@ def configureRTSP(leitor, session):
 def changeMasterPassword(leitor, session, master_password):
     logging.info('Iniciando alteração da senha mestre para o leitor %s', leitor['nomeLeitor'])
     try:
-        master_pass_response = requests.post(
-            f"http://{leitor['ip']}/master_password.fcgi?session={session}",
+        master_pass_response = sessaoLeitor(leitor).post(
+            "master_password.fcgi",
             json={'password': master_password},
             headers={'Content-Type': 'application/json'},
             timeout=5
@@ -191,8 +171,8 @@ def changeMasterPassword(leitor, session, master_password):
 def updateOrCreateServer(leitor, session, server_url):
     logging.info('Atualizando ou criando servidor para o leitor %s', leitor['nomeLeitor'])
     try:
-        exist_server_response = requests.post(
-            f"http://{leitor['ip']}/load_objects.fcgi?session={session}",
+        exist_server_response = sessaoLeitor(leitor).post(
+            "load_objects.fcgi",
             json={
                 'object': 'devices',
                 'where': [{'object': 'devices', 'field': 'id', 'operator': '=', 'server_id': int(leitor.get('serverId') or 0)}]
@@ -201,8 +181,8 @@ def updateOrCreateServer(leitor, session, server_url):
             timeout=5
         )
         if exist_server_response.status_code == 200:
-            update_response = requests.post(
-                f"http://{leitor['ip']}/modify_objects.fcgi?session={session}",
+            update_response = sessaoLeitor(leitor).post(
+                "modify_objects.fcgi",
                 json={
                     'object': 'devices',
                     'values': {'ip': server_url},
@@ -217,8 +197,8 @@ def updateOrCreateServer(leitor, session, server_url):
             else:
                 configure_server(leitor, session, leitor['serverId'])
         else:
-            create_response = requests.post(
-                f"http://{leitor['ip']}/create_objects.fcgi?session={session}",
+            create_response = sessaoLeitor(leitor).post(
+                "create_objects.fcgi",
                 json={
                     'object': 'devices',
                     'values': [{'name': 'Servidor do Credenciamento', 'ip': server_url, 'public_key': ''}]
@@ -241,15 +221,15 @@ def updateOrCreateServer(leitor, session, server_url):
 def configureServer(leitor, session, server_id):
     logging.info('Configurando servidor para o leitor %s', leitor['nomeLeitor'])
     try:
-        config_response = requests.post(
-            f"http://{leitor['ip']}/set_configuration.fcgi?session={session}",
+        config_response = sessaoLeitor(leitor).post(
+            "set_configuration.fcgi",
             json={'online_client': {'server_id': str(server_id)}},
             headers={'Content-Type': 'application/json'},
             timeout=5
         )
         if config_response.status_code == 200:
-            online_response = requests.post(
-                f"http://{leitor['ip']}/set_configuration.fcgi?session={session}",
+            online_response = sessaoLeitor(leitor).post(
+                "set_configuration.fcgi",
                 json={
                     'general': {
                         'online': '1', 
@@ -295,8 +275,8 @@ def configureMonitor(leitor, session, server_url):
                 "alive_interval": "60000"
             }
         }
-        response = requests.post(
-            f"http://{leitor['ip']}/set_configuration.fcgi?session={session}",
+        response = sessaoLeitor(leitor).post(
+            "set_configuration.fcgi",
             json=monitor_config,
             headers={'Content-Type': 'application/json'},
             timeout=5
@@ -309,8 +289,8 @@ def configureMonitor(leitor, session, server_url):
         photo_config = {
             "monitor": {"enable_photo_upload": "1"},
         }
-        photo_response = requests.post(
-            f"http://{leitor['ip']}/set_configuration.fcgi?session={session}",
+        photo_response = sessaoLeitor(leitor).post(
+            "set_configuration.fcgi",
             json=photo_config,
             headers={'Content-Type': 'application/json'},
             timeout=5
@@ -0,0 +1,93 @@
+"""
+Aviso imediato aos trabalhadores de tblJobSync de que há jobs novos.
+
+Cada trabalhador residente (processarJobsSync.py --daemon) abre um socket Unix
+de datagramas em JOBS_DIRETORIO_DESPERTAR. despertarTrabalhadores() envia um
+datagrama a cada socket do diretório e o trabalhador reserva os jobs na hora,
+sem esperar a próxima consulta periódica (JOBS_INTERVALO_CONSULTA), que
+continua valendo caso o aviso se perca. O aviso alcança apenas os
+trabalhadores do mesmo host; os demais encontram os jobs na consulta
+periódica.
+
+O sistema de gerenciamento avisa após gravar o job, pelo endpoint
+POST /api/jobs/despertar (com JOBS_TOKEN_DESPERTAR) ou executando
+processarJobsSync.py --despertar.
+"""
+import errno
+import glob
+import os
+import socket
+import threading
+from config import JOBS_DIRETORIO_DESPERTAR
+from logging_config import get_logger
+
+# Obtém o logger configurado para este módulo
+logging = get_logger('DespertarJobs', arquivo_log='logDespertarJobs.log')
+
+
+class DespertadorJobs:
+    """
+    Socket de aviso de um trabalhador: cada datagrama recebido sinaliza o
+    evento informado, acordando o laço do trabalhador.
+    """
+
+    def __init__(self, evento, diretorio=JOBS_DIRETORIO_DESPERTAR):
+        self.evento = evento
+        self.caminho = os.path.join(diretorio, f'trabalhador-{os.getpid()}.sock')
+        os.makedirs(diretorio, exist_ok=True)
+        if os.path.exists(self.caminho):
+            os.unlink(self.caminho)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.caminho)
+        self._socket.settimeout(1)
+        self._encerrar = threading.Event()
+        self._thread = threading.Thread(target=self._receber, name='despertador-jobs', daemon=True)
+        self._thread.start()
+
+    def _receber(self):
+        while not self._encerrar.is_set():
+            try:
+                self._socket.recv(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.evento.set()
+
+    def fechar(self):
+        self._encerrar.set()
+        self._thread.join(timeout=2)
+        self._socket.close()
+        try:
+            os.unlink(self.caminho)
+        except FileNotFoundError:
+            pass
+
+
+def despertarTrabalhadores(diretorio=JOBS_DIRETORIO_DESPERTAR):
+    """
+    Avisa os trabalhadores deste host de que há jobs na fila.
+
+    Returns:
+        int: Número de trabalhadores avisados
+    """
+    avisados = 0
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for caminho in glob.glob(os.path.join(diretorio, 'trabalhador-*.sock')):
+            try:
+                sock.sendto(b'1', caminho)
+                avisados += 1
+            except BlockingIOError:
+                # Fila do socket cheia: o trabalhador já tem avisos pendentes
+                avisados += 1
+            except OSError as e:
+                if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    # Trabalhador encerrado sem remover o socket
+                    try:
+                        os.unlink(caminho)
+                    except OSError:
+                        pass
+                else:
+                    logging.error('Erro ao avisar o trabalhador %s: %s', caminho, str(e))
+    return avisados
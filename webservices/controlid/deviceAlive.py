@@ -1,25 +1,145 @@
+"""
+Registro dos heartbeats (device_is_alive) dos leitores.
+
+Os heartbeats são guardados em memória (último horário por deviceId) e gravados
+por uma thread em um único UPDATE ... CASE deviceId a cada
+HEARTBEAT_INTERVALO_FLUSH segundos. deviceIds desconhecidos são rejeitados com
+base em um conjunto de deviceIds em cache, sem consultar o banco a cada chamada.
+Cada heartbeat também renova o prazo do leitor no MonitorLeitores, que marca
+como OFF os leitores que deixam de enviá-los.
+"""
+import atexit
+import threading
+import time
 from datetime import datetime
 from db import conectarBancoEvento
+from config import HEARTBEAT_INTERVALO_FLUSH, HEARTBEAT_TTL_DISPOSITIVOS, HEARTBEAT_RECARGA_DISPOSITIVOS
+from logging_config import get_logger
+from webservices.controlid.atualizarStatusLeitor import monitor_leitores
 import pytz
 
+# Obtém o logger configurado para este módulo
+logging = get_logger('DeviceAlive', arquivo_log='logDeviceAlive.log')
+
+
+class ColetorHeartbeats:
+    """Acumula os heartbeats dos leitores e os grava em lote."""
+
+    def __init__(self, intervalo=HEARTBEAT_INTERVALO_FLUSH):
+        self.intervalo = intervalo
+        self._ultimos = {}
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        self._dispositivos = frozenset()
+        self._dispositivos_em = None
+
+    def registrar(self, device_id):
+        """
+        Registra o heartbeat de um leitor.
+
+        Returns:
+            bool: False se o deviceId não pertence a nenhum leitor cadastrado
+        """
+        if not self._dispositivoConhecido(device_id):
+            return False
+        with self._lock:
+            self._ultimos[device_id] = datetime.now(pytz.timezone("America/Sao_Paulo"))
+        self._iniciar()
+        monitor_leitores.batida(device_id)
+        return True
+
+    def _dispositivoConhecido(self, device_id):
+        agora = time.monotonic()
+        idade = agora - self._dispositivos_em if self._dispositivos_em is not None else None
+        if idade is None or idade > HEARTBEAT_TTL_DISPOSITIVOS or (
+            device_id not in self._dispositivos and idade > HEARTBEAT_RECARGA_DISPOSITIVOS
+        ):
+            self._recarregarDispositivos()
+        return device_id in self._dispositivos
+
+    def _recarregarDispositivos(self):
+        conn = conectarBancoEvento()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT deviceId FROM tblLeitor WHERE deviceId IS NOT NULL")
+            self._dispositivos = frozenset(str(linha[0]) for linha in cursor.fetchall())
+            self._dispositivos_em = time.monotonic()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _iniciar(self):
+        # A thread é criada sob demanda para funcionar após o fork dos workers
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._parar.clear()
+                self._thread = threading.Thread(target=self._executar, name='ColetorHeartbeats', daemon=True)
+                self._thread.start()
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            self.descarregar()
+        self.descarregar()
+
+    def descarregar(self):
+        """Grava os heartbeats acumulados com um único UPDATE."""
+        with self._lock:
+            pendentes, self._ultimos = self._ultimos, {}
+        if not pendentes:
+            return
+
+        casos = ' '.join(['WHEN %s THEN %s'] * len(pendentes))
+        sql = f"""
+            UPDATE tblLeitor
+               SET condicao   = 'ON',
+                   dataEdicao = CASE deviceId {casos} END,
+                   dataMonitoramento = CASE deviceId {casos} END
+             WHERE deviceId IN ({', '.join(['%s'] * len(pendentes))})
+        """
+        pares = [valor for item in pendentes.items() for valor in item]
+        params = pares + pares + list(pendentes)
+
+        conn = None
+        cursor = None
+        try:
+            conn = conectarBancoEvento()
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            conn.commit()
+        except Exception as e:
+            logging.error('Erro ao gravar %d heartbeats: %s', len(pendentes), e)
+            # Devolve os heartbeats não gravados, sem sobrescrever os mais novos
+            with self._lock:
+                for device_id, quando in pendentes.items():
+                    self._ultimos.setdefault(device_id, quando)
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    def encerrar(self, timeout=10):
+        """Grava os heartbeats pendentes e encerra a thread."""
+        self._parar.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+        else:
+            self.descarregar()
+
+
+coletor_heartbeats = ColetorHeartbeats()
+atexit.register(coletor_heartbeats.encerrar)
+
+
 def handle_device_alive(device_id: str):
     """
-    Se existir um registro com este device_id,
-    atualiza status para 1 e atualiza o timestamp.
+    Registra o heartbeat do leitor com este device_id. O status (condicao = ON)
+    e os timestamps são gravados em lote pelo coletor.
+
+    Returns:
+        bool: False se o device_id não pertence a nenhum leitor cadastrado
     """
-    conn = conectarBancoEvento()
-    cursor = conn.cursor()
-    try:
-        sql = """
-            UPDATE tblLeitor
-               SET condicao   = %s,
-                   dataEdicao = %s,
-                   dataMonitoramento = %s
-             WHERE deviceId = %s
-        """
-        now = datetime.now(pytz.timezone("America/Sao_Paulo"))
-        cursor.execute(sql, ('ON', now, now, device_id))
-        conn.commit()
-    finally:
-        cursor.close()
-        conn.close()
+    return coletor_heartbeats.registrar(str(device_id))
@@ -0,0 +1,190 @@
+"""
+Execução de uma mesma tarefa em vários leitores ao mesmo tempo (fan-out).
+
+As tarefas por leitor usam requests e mysql-connector (bloqueantes) e rodam em
+um pool de threads limitado, coordenado por um event loop asyncio: o número de
+threads não cresce com o número de leitores (FANOUT_MAX_CONCORRENCIA), cada
+leitor recebe no máximo FANOUT_MAX_POR_LEITOR tarefas simultâneas e cada
+tarefa tem um prazo (FANOUT_PRAZO_LEITOR). Ao fim do prazo, ou se a execução
+for cancelada, a tarefa é avisada pelo Cancelamento que recebe e para no
+próximo ponto de verificação.
+
+    resultados = executarEmLeitores(leitores, sincronizarImagensLeitor)
+    resultados = await fanoutLeitores(leitores, configurarUnicoLeitor, senha)
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from config import FANOUT_MAX_CONCORRENCIA, FANOUT_MAX_POR_LEITOR, FANOUT_PRAZO_LEITOR
+from logging_config import get_logger
+
+# Obtém o logger configurado para este módulo
+logging = get_logger('Fanout', arquivo_log='logFanout.log')
+
+
+class OperacaoCancelada(Exception):
+    """A tarefa foi cancelada ou excedeu o prazo do leitor."""
+    pass
+
+
+class Cancelamento:
+    """
+    Sinal de cancelamento compartilhado entre o event loop e as threads das
+    tarefas. Um cancelamento filho também fica cancelado quando o pai é.
+    """
+
+    def __init__(self, pai=None):
+        self._evento = threading.Event()
+        self._pai = pai
+        self._motivo = None
+
+    def cancelar(self, motivo='Operação cancelada'):
+        if not self._evento.is_set():
+            self._motivo = motivo
+            self._evento.set()
+
+    @property
+    def cancelado(self):
+        return self._evento.is_set() or (self._pai is not None and self._pai.cancelado)
+
+    @property
+    def motivo(self):
+        if self._evento.is_set():
+            return self._motivo
+        return self._pai.motivo if self._pai is not None else None
+
+    def verificar(self):
+        """
+        Raises:
+            OperacaoCancelada: Se a tarefa foi cancelada
+        """
+        if self.cancelado:
+            raise OperacaoCancelada(self.motivo)
+
+    def aguardar(self, segundos):
+        """
+        Espera como time.sleep, mas retorna assim que a tarefa for cancelada.
+
+        Returns:
+            bool: True se foi cancelada durante a espera
+        """
+        fim = time.monotonic() + segundos
+        while not self.cancelado:
+            restante = fim - time.monotonic()
+            if restante <= 0:
+                return False
+            # O pai não acorda este evento: a espera é feita em fatias
+            self._evento.wait(min(restante, 0.5))
+        return True
+
+
+class Fanout:
+    """Pool de threads e limites de concorrência de uma execução em vários leitores."""
+
+    def __init__(self, max_concorrencia=FANOUT_MAX_CONCORRENCIA, max_por_leitor=FANOUT_MAX_POR_LEITOR,
+                 prazo=FANOUT_PRAZO_LEITOR, cancelamento=None):
+        self.max_concorrencia = max_concorrencia
+        self.max_por_leitor = max_por_leitor
+        self.prazo = prazo
+        self.cancelamento = cancelamento or Cancelamento()
+        self._executor = ThreadPoolExecutor(max_workers=max_concorrencia, thread_name_prefix='fanout')
+        self._global = None
+        self._por_leitor = {}
+
+    async def executar(self, leitores, funcao, *args, prazo=None, **kwargs):
+        """
+        Executa funcao(leitor, *args, cancelamento=..., **kwargs) em cada leitor.
+
+        Args:
+            leitores: Lista de leitores (tblLeitor)
+            funcao: Tarefa bloqueante; recebe um Cancelamento no argumento cancelamento
+            prazo: Segundos por leitor (default: o prazo do Fanout)
+
+        Returns:
+            list: Um dict por leitor, na ordem recebida, com leitor, sucesso,
+            retorno, erro e duracao (segundos)
+        """
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_concorrencia)
+        tarefas = [
+            asyncio.ensure_future(self._executarLeitor(leitor, funcao, args, kwargs, prazo or self.prazo))
+            for leitor in leitores
+        ]
+        try:
+            return await asyncio.gather(*tarefas)
+        except asyncio.CancelledError:
+            self.cancelamento.cancelar()
+            for tarefa in tarefas:
+                tarefa.cancel()
+            raise
+
+    async def _executarLeitor(self, leitor, funcao, args, kwargs, prazo):
+        cancelamento = Cancelamento(self.cancelamento)
+        resultado = {'leitor': leitor, 'sucesso': False, 'retorno': None, 'erro': None, 'duracao': 0.0}
+        semaforo = self._por_leitor.setdefault(leitor['id'], asyncio.Semaphore(self.max_por_leitor))
+        loop = asyncio.get_running_loop()
+
+        # Espera pelas vagas fora do prazo: o prazo conta só a execução no leitor
+        async with semaforo, self._global:
+            if cancelamento.cancelado:
+                resultado['erro'] = cancelamento.motivo
+                return resultado
+            inicio = time.monotonic()
+            try:
+                resultado['retorno'] = await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, partial(funcao, leitor, *args, cancelamento=cancelamento, **kwargs)),
+                    prazo,
+                )
+                resultado['sucesso'] = resultado['retorno'] is not False
+            except asyncio.TimeoutError:
+                cancelamento.cancelar(f'Prazo de {prazo}s excedido')
+                resultado['erro'] = cancelamento.motivo
+                logging.error('Leitor %s: prazo de %ss excedido', leitor['nomeLeitor'], prazo)
+            except OperacaoCancelada as e:
+                resultado['erro'] = str(e)
+            except Exception as e:
+                resultado['erro'] = str(e)
+                logging.error('Leitor %s: erro na tarefa %s: %s', leitor['nomeLeitor'], funcao.__name__, e)
+            resultado['duracao'] = time.monotonic() - inicio
+        return resultado
+
+    def cancelar(self, motivo='Operação cancelada'):
+        """Avisa todas as tarefas em andamento e descarta as que ainda não começaram."""
+        self.cancelamento.cancelar(motivo)
+
+    def encerrar(self):
+        """
+        Libera o pool de threads sem esperar tarefas que excederam o prazo
+        (elas já foram avisadas pelo cancelamento).
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def fanoutLeitores(leitores, funcao, *args, max_concorrencia=FANOUT_MAX_CONCORRENCIA,
+                         max_por_leitor=FANOUT_MAX_POR_LEITOR, prazo=FANOUT_PRAZO_LEITOR,
+                         cancelamento=None, **kwargs):
+    """
+    Executa a tarefa em todos os leitores, no event loop atual (ver Fanout.executar).
+
+    Returns:
+        list: Resultados por leitor (dicts com leitor, sucesso, retorno, erro e duracao)
+    """
+    fanout = Fanout(max_concorrencia, max_por_leitor, prazo, cancelamento)
+    try:
+        return await fanout.executar(leitores, funcao, *args, **kwargs)
+    finally:
+        fanout.encerrar()
+
+
+def executarEmLeitores(leitores, funcao, *args, **kwargs):
+    """
+    Versão síncrona de fanoutLeitores, para scripts e rotinas sem event loop.
+
+    Returns:
+        list: Resultados por leitor (dicts com leitor, sucesso, retorno, erro e duracao)
+    """
+    if not leitores:
+        return []
+    return asyncio.run(fanoutLeitores(leitores, funcao, *args, **kwargs))
@@ -0,0 +1,284 @@
+"""
+Leitura das imagens (avatares) enviadas aos leitores faciais.
+
+A mesma imagem costuma ser enviada a vários leitores ao mesmo tempo. O
+conteúdo em base64 fica em um cache LRU limitado em bytes
+(IMAGENS_CACHE_TAMANHO_MAXIMO), com chave (id do arquivo, mtime): o arquivo é
+lido e codificado uma vez e compartilhado por todos os envios, e uma imagem
+substituída no disco gera uma nova chave. Envios simultâneos da mesma imagem
+esperam a leitura em andamento em vez de ler o arquivo de novo.
+
+Antes de codificar, os avatares são normalizados (IMAGENS_NORMALIZAR): a
+orientação EXIF é aplicada, a imagem é reduzida para caber em
+IMAGENS_RESOLUCAO_MAXIMA e recodificada em JPEG próximo de IMAGENS_TAMANHO_ALVO.
+O resultado é gravado em IMAGENS_DIRETORIO_NORMALIZADAS com o hash do arquivo
+original no nome e reaproveitado nas próximas execuções. Sem Pillow instalado,
+as imagens são enviadas como estão.
+"""
+import base64
+import hashlib
+import io
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from config import (
+    SISTEMA_GERENCIAMENTO,
+    IMAGENS_CACHE_TAMANHO_MAXIMO,
+    IMAGENS_NORMALIZAR,
+    IMAGENS_DIRETORIO_NORMALIZADAS,
+    IMAGENS_RESOLUCAO_MAXIMA,
+    IMAGENS_TAMANHO_ALVO,
+    IMAGENS_QUALIDADES_JPEG,
+)
+from logging_config import get_logger
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Obtém o logger configurado para este módulo
+logging = get_logger('ImagensLeitor', arquivo_log='logImagensLeitor.log')
+
+
+class CacheImagens:
+    """Cache LRU thread-safe de imagens em base64, limitado pelo total de bytes."""
+
+    def __init__(self, tamanho_maximo=IMAGENS_CACHE_TAMANHO_MAXIMO):
+        self.tamanho_maximo = tamanho_maximo
+        self.hits = 0
+        self.misses = 0
+        self.descartes = 0
+        self._dados = OrderedDict()
+        self._versoes = {}
+        self._carregando = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obterOuCarregar(self, chave, carregar):
+        """
+        Retorna a imagem em cache ou executa carregar() uma única vez, mesmo
+        com várias threads pedindo a mesma chave.
+
+        Args:
+            chave: (id do arquivo, mtime)
+            carregar: Função sem argumentos que retorna a imagem em base64 ou None
+
+        Returns:
+            str: Imagem em base64 ou None
+        """
+        with self._lock:
+            valor = self._obter(chave)
+            if valor is not None:
+                return valor
+            evento = self._carregando.get(chave)
+            carregador = evento is None
+            if carregador:
+                evento = self._carregando[chave] = threading.Event()
+                self.misses += 1
+
+        if not carregador:
+            # Outra thread está lendo a mesma imagem: usa o resultado dela
+            evento.wait()
+            with self._lock:
+                valor = self._obter(chave)
+                if valor is None:
+                    self.misses += 1
+            return valor if valor is not None else carregar()
+
+        valor = None
+        try:
+            valor = carregar()
+        finally:
+            with self._lock:
+                del self._carregando[chave]
+                if valor:
+                    self._armazenar(chave, valor)
+            evento.set()
+        return valor
+
+    def _obter(self, chave):
+        valor = self._dados.get(chave)
+        if valor is not None:
+            self._dados.move_to_end(chave)
+            self.hits += 1
+        return valor
+
+    def _armazenar(self, chave, valor):
+        if len(valor) > self.tamanho_maximo:
+            return
+        # Versão anterior do mesmo arquivo (mtime diferente) não será mais usada
+        anterior = self._versoes.get(chave[0])
+        if anterior is not None and anterior != chave:
+            self._remover(anterior)
+        self._dados[chave] = valor
+        self._versoes[chave[0]] = chave
+        self._bytes += len(valor)
+        while self._bytes > self.tamanho_maximo:
+            self._remover(next(iter(self._dados)))
+            self.descartes += 1
+
+    def _remover(self, chave):
+        valor = self._dados.pop(chave, None)
+        if valor is not None:
+            self._bytes -= len(valor)
+            if self._versoes.get(chave[0]) == chave:
+                del self._versoes[chave[0]]
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+            self._versoes.clear()
+            self._bytes = 0
+
+    def estatisticas(self):
+        """Retorna os contadores do cache."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entradas': len(self._dados),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'descartes': self.descartes,
+                'taxa_acerto': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+cache_imagens = CacheImagens()
+
+# Parâmetros da normalização; entram no hash para que uma mudança gere novos arquivos
+# (a versão muda quando o algoritmo muda: 2 = orientação EXIF aplicada também em JPEGs pequenos)
+_VERSAO_NORMALIZACAO = 2
+_ASSINATURA_NORMALIZACAO = repr((_VERSAO_NORMALIZACAO, IMAGENS_RESOLUCAO_MAXIMA, IMAGENS_TAMANHO_ALVO,
+                                 IMAGENS_QUALIDADES_JPEG)).encode()
+
+# Tag EXIF Orientation (1 = imagem já na posição correta)
+_EXIF_ORIENTACAO = 0x0112
+
+
+def _recodificar(dados):
+    """Reduz e recodifica a imagem em JPEG; retorna os bytes originais se já estiver adequada."""
+    imagem = Image.open(io.BytesIO(dados))
+    largura, altura = IMAGENS_RESOLUCAO_MAXIMA
+    rotacionada = imagem.getexif().get(_EXIF_ORIENTACAO, 1) != 1
+    if (not rotacionada and imagem.format == 'JPEG' and len(dados) <= IMAGENS_TAMANHO_ALVO
+            and imagem.width <= largura and imagem.height <= altura):
+        return dados
+
+    # Em JPEGs grandes, decodifica já em escala reduzida (bem mais rápido)
+    imagem.draft('RGB', (largura, altura))
+    imagem = ImageOps.exif_transpose(imagem)
+    if imagem.mode != 'RGB':
+        imagem = imagem.convert('RGB')
+    if imagem.width > largura or imagem.height > altura:
+        # Só reduz: contain também ampliaria imagens menores que o limite
+        imagem = ImageOps.contain(imagem, (largura, altura), Image.LANCZOS)
+
+    for qualidade in IMAGENS_QUALIDADES_JPEG:
+        saida = io.BytesIO()
+        imagem.save(saida, 'JPEG', quality=qualidade, optimize=True)
+        if saida.tell() <= IMAGENS_TAMANHO_ALVO:
+            break
+    resultado = saida.getvalue()
+    # O original só serve se não precisava de rotação (o leitor ignora o EXIF)
+    return resultado if rotacionada or len(resultado) < len(dados) else dados
+
+
+def normalizarImagem(dados):
+    """
+    Retorna a versão normalizada da imagem, usando o arquivo derivado gravado
+    em uma execução anterior quando existir.
+
+    Args:
+        dados: Bytes da imagem original
+
+    Returns:
+        bytes: Imagem normalizada (ou os bytes originais se a normalização
+        estiver desligada, sem Pillow ou se a imagem não puder ser lida)
+    """
+    if not IMAGENS_NORMALIZAR or Image is None:
+        return dados
+
+    digest = hashlib.sha256(_ASSINATURA_NORMALIZACAO + dados).hexdigest()
+    derivado = os.path.join(IMAGENS_DIRETORIO_NORMALIZADAS, digest[:2], f'{digest}.jpg')
+    try:
+        with open(derivado, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    try:
+        resultado = _recodificar(dados)
+    except Exception as e:
+        logging.warning('Imagem enviada sem normalização: %s', str(e))
+        return dados
+
+    try:
+        os.makedirs(os.path.dirname(derivado), exist_ok=True)
+        temporario = f'{derivado}.{uuid.uuid4().hex}.part'
+        with open(temporario, 'wb') as f:
+            f.write(resultado)
+        os.replace(temporario, derivado)
+    except OSError as e:
+        logging.warning('Não foi possível gravar a imagem normalizada %s: %s', derivado, str(e))
+    return resultado
+
+
+def _lerArquivo(caminho_completo):
+    with open(caminho_completo, 'rb') as f:
+        dados = f.read()
+    return base64.b64encode(normalizarImagem(dados)).decode('utf-8')
+
+
+def lerImagemBase64(pathLocal, pathNuvem=None, arquivo_id=None):
+    """
+    Lê uma imagem do disco ou nuvem e retorna em base64.
+
+    Args:
+        pathLocal: Caminho local da imagem (ex: /midia/pessoas/5/imagens/avatar/...)
+        pathNuvem: URL da nuvem (se disponível)
+        arquivo_id: ID do arquivo em tblArquivo (chave do cache; default: o caminho)
+
+    Returns:
+        str: Imagem em base64 ou None se não encontrada
+    """
+    try:
+        # Se tem pathNuvem, retorna diretamente (já está em base64)
+        if pathNuvem:
+            return pathNuvem
+
+        if not pathLocal:
+            return None
+
+        caminho_completo = os.path.join(SISTEMA_GERENCIAMENTO, pathLocal.lstrip('/'))
+        try:
+            mtime = os.stat(caminho_completo).st_mtime_ns
+        except FileNotFoundError:
+            logging.error('Arquivo não encontrado: %s', caminho_completo)
+            return None
+
+        chave = (arquivo_id if arquivo_id is not None else caminho_completo, mtime)
+        return cache_imagens.obterOuCarregar(chave, lambda: _lerArquivo(caminho_completo))
+
+    except Exception as e:
+        logging.error('Erro ao ler imagem: %s', str(e))
+        return None
+
+
+def imagemDisponivel(pathLocal, pathNuvem=None):
+    """Confere, sem ler o arquivo, se lerImagemBase64 encontrará a imagem."""
+    if pathNuvem:
+        return True
+    return bool(pathLocal) and os.path.isfile(os.path.join(SISTEMA_GERENCIAMENTO, pathLocal.lstrip('/')))
+
+
+def estatisticasImagens():
+    """
+    Retorna as métricas do cache de imagens deste processo.
+
+    Returns:
+        dict: entradas, bytes, hits, misses, descartes e taxa_acerto
+    """
+    return cache_imagens.estatisticas()
@@ -0,0 +1,316 @@
+"""
+Envio de imagens aos leitores com user_set_image_list.fcgi em lotes de
+tamanho adaptativo.
+
+O tamanho do lote (bytes de base64) é ajustado por leitor, no estilo AIMD:
+cresce LOTE_IMAGENS_INCREMENTO após um lote aceito dentro de
+LOTE_IMAGENS_LATENCIA_ALVO e cai pela metade após erro ou lote lento. Erros de
+comunicação e respostas 5xx são repetidos com espera exponencial aleatória
+(backoff com jitter); se o lote continuar falhando, ele é dividido ao meio até
+isolar as imagens problemáticas. O resultado de cada imagem vem da resposta do
+leitor (results[].success), não apenas do status HTTP; uma imagem só é tida
+como recusada (não reenviada) quando o leitor rejeita o conteúdo dela.
+"""
+import random
+import threading
+import time
+import requests
+from db import registrarLeitorFotos
+from webservices.controlid.sessaoLeitor import sessaoLeitor
+from config import (
+    LOTE_IMAGENS_INICIAL,
+    LOTE_IMAGENS_MINIMO,
+    LOTE_IMAGENS_MAXIMO,
+    LOTE_IMAGENS_INCREMENTO,
+    LOTE_IMAGENS_LATENCIA_ALVO,
+    LOTE_IMAGENS_TIMEOUT,
+    LOTE_IMAGENS_TENTATIVAS,
+    LOTE_IMAGENS_BACKOFF_BASE,
+    LOTE_IMAGENS_BACKOFF_MAXIMO,
+)
+from logging_config import get_logger
+
+# Obtém o logger configurado para este módulo
+logging = get_logger('LoteAdaptativo', arquivo_log='logLoteAdaptativo.log')
+
+# Respostas sobre o conteúdo enviado: com uma imagem só, o leitor rejeitou a imagem
+STATUS_IMAGEM_RECUSADA = (400, 413, 422)
+# Respostas sobre o acesso ao leitor (sessão, permissão, limite de requisições):
+# dividir o lote não ajuda e a imagem deve ser reenviada depois
+STATUS_SEM_DIVISAO = (401, 403, 404, 429)
+
+
+class TamanhoLote:
+    """Tamanho de lote de um leitor, ajustado pela latência e pelos erros observados."""
+
+    def __init__(self, inicial=LOTE_IMAGENS_INICIAL, minimo=LOTE_IMAGENS_MINIMO, maximo=LOTE_IMAGENS_MAXIMO,
+                 incremento=LOTE_IMAGENS_INCREMENTO, latencia_alvo=LOTE_IMAGENS_LATENCIA_ALVO):
+        self.bytes = inicial
+        self.minimo = minimo
+        self.maximo = maximo
+        self.incremento = incremento
+        self.latencia_alvo = latencia_alvo
+        self._lock = threading.Lock()
+
+    def sucesso(self, duracao):
+        with self._lock:
+            if duracao <= self.latencia_alvo:
+                self.bytes = min(self.maximo, self.bytes + self.incremento)
+            else:
+                self.bytes = max(self.minimo, self.bytes // 2)
+
+    def falha(self):
+        with self._lock:
+            self.bytes = max(self.minimo, self.bytes // 2)
+
+
+_tamanhos = {}
+_lock_tamanhos = threading.Lock()
+
+
+def tamanhoLote(leitor):
+    """Retorna o TamanhoLote do leitor (mantido enquanto o processo estiver ativo)."""
+    with _lock_tamanhos:
+        return _tamanhos.setdefault(leitor['id'], TamanhoLote())
+
+
+class LeitorInacessivelError(Exception):
+    """
+    O leitor não aceitou conexão; não adianta dividir o lote.
+
+    Attributes:
+        resultados: Resultados das imagens do início do lote já enviadas
+            (partes de um lote dividido concluídas antes da falha)
+    """
+
+    def __init__(self, mensagem, resultados=None):
+        super().__init__(mensagem)
+        self.resultados = resultados or []
+
+
+def aguardarBackoff(tentativa, cancelamento=None):
+    """Espera aleatória entre 0 e min(LOTE_IMAGENS_BACKOFF_MAXIMO, base * 2^tentativa) segundos."""
+    espera = random.uniform(0, min(LOTE_IMAGENS_BACKOFF_MAXIMO, LOTE_IMAGENS_BACKOFF_BASE * 2 ** tentativa))
+    if cancelamento:
+        cancelamento.aguardar(espera)
+    else:
+        time.sleep(espera)
+
+
+def _resultado(imagem, sucesso, mensagem, recusada=False):
+    return {
+        'arquivo_id': imagem['arquivo_id'],
+        'user_id': imagem['user_id'],
+        'sucesso': sucesso,
+        'recusada': recusada,
+        'mensagem': mensagem,
+    }
+
+
+def _resultadosPorImagem(response, lote):
+    """Lê results[] da resposta; sem ele, todas as imagens do lote foram aceitas."""
+    try:
+        resultados = response.json().get('results')
+    except (ValueError, AttributeError):
+        resultados = None
+    if not isinstance(resultados, list):
+        return [_resultado(imagem, True, None) for imagem in lote]
+
+    por_usuario = {}
+    for item in resultados:
+        if isinstance(item, dict) and item.get('user_id') is not None:
+            por_usuario.setdefault(int(item['user_id']), []).append(item)
+
+    saida = []
+    for imagem in lote:
+        itens = por_usuario.get(int(imagem['user_id']))
+        item = itens.pop(0) if itens else None
+        if item is None:
+            saida.append(_resultado(imagem, False, 'Leitor não retornou resultado para a imagem'))
+        elif item.get('success'):
+            saida.append(_resultado(imagem, True, None))
+        else:
+            erros = item.get('errors') or []
+            mensagem = '; '.join(str(e.get('message', e)) if isinstance(e, dict) else str(e) for e in erros)
+            saida.append(_resultado(imagem, False, mensagem or 'Imagem recusada pelo leitor', recusada=True))
+    return saida
+
+
+def _postarLote(leitor, lote, cancelamento=None):
+    """
+    Envia o lote, repetindo erros de comunicação e 5xx com backoff.
+
+    Returns:
+        requests.Response: Última resposta do leitor (status < 500)
+
+    Raises:
+        LeitorInacessivelError: O leitor recusou a conexão em todas as tentativas
+        requests.exceptions.RequestException: Erro persistente (timeout, 5xx)
+    """
+    payload = {
+        'match': False,
+        'user_images': [
+            {'user_id': img['user_id'], 'timestamp': img['timestamp'], 'image': img['image']}
+            for img in lote
+        ]
+    }
+    for tentativa in range(LOTE_IMAGENS_TENTATIVAS):
+        if cancelamento:
+            cancelamento.verificar()
+        try:
+            response = sessaoLeitor(leitor).post(
+                "user_set_image_list.fcgi",
+                json=payload,
+                headers={'Content-Type': 'application/json'},
+                timeout=LOTE_IMAGENS_TIMEOUT
+            )
+            if response.status_code < 500:
+                return response
+            erro = requests.exceptions.HTTPError(f'HTTP {response.status_code}: {response.text[:200]}', response=response)
+        except requests.exceptions.ConnectionError as e:
+            erro = LeitorInacessivelError(str(e))
+        except requests.exceptions.RequestException as e:
+            erro = e
+
+        logging.warning('Lote de %d imagens para o leitor %s falhou (tentativa %d/%d): %s',
+                        len(lote), leitor['nomeLeitor'], tentativa + 1, LOTE_IMAGENS_TENTATIVAS, erro)
+        if tentativa < LOTE_IMAGENS_TENTATIVAS - 1:
+            aguardarBackoff(tentativa, cancelamento)
+    raise erro
+
+
+def _enviarLote(leitor, lote, tamanho, cancelamento=None):
+    """Envia um lote; se ele falhar como um todo, divide ao meio e envia cada parte."""
+    inicio = time.monotonic()
+    try:
+        response = _postarLote(leitor, lote, cancelamento)
+    except LeitorInacessivelError:
+        raise
+    except requests.exceptions.RequestException as e:
+        response = None
+        mensagem = f'Erro na requisição: {str(e)[:200]}'
+
+    if response is not None and response.status_code == 200:
+        tamanho.sucesso(time.monotonic() - inicio)
+        return _resultadosPorImagem(response, lote)
+
+    tamanho.falha()
+    if response is not None:
+        mensagem = f'Falha ao sincronizar (HTTP {response.status_code}): {response.text[:200]}'
+        if response.status_code in STATUS_SEM_DIVISAO:
+            logging.error('Lote de %d imagens não aceito pelo leitor %s: %s', len(lote), leitor['nomeLeitor'], mensagem)
+            return [_resultado(imagem, False, mensagem) for imagem in lote]
+    if len(lote) == 1:
+        # Só é recusa da imagem se o leitor reclamou do conteúdo enviado;
+        # timeouts e demais erros voltam como falha e são reenviados
+        recusada = response is not None and response.status_code in STATUS_IMAGEM_RECUSADA
+        logging.error('Imagem %s %s pelo leitor %s: %s', lote[0]['arquivo_id'],
+                      'recusada' if recusada else 'não aceita', leitor['nomeLeitor'], mensagem)
+        return [_resultado(lote[0], False, mensagem, recusada=recusada)]
+
+    meio = len(lote) // 2
+    logging.info('Dividindo lote de %d imagens para o leitor %s', len(lote), leitor['nomeLeitor'])
+    primeira = _enviarLote(leitor, lote[:meio], tamanho, cancelamento)
+    try:
+        segunda = _enviarLote(leitor, lote[meio:], tamanho, cancelamento)
+    except LeitorInacessivelError as e:
+        # A primeira metade já foi entregue: segue junto com a exceção
+        e.resultados = primeira + e.resultados
+        raise
+    return primeira + segunda
+
+
+def enviarLotesAdaptativos(leitor, imagens, cancelamento=None):
+    """
+    Envia as imagens ao leitor em lotes de tamanho adaptativo, consumindo o
+    iterável aos poucos (cada lote é montado só quando o anterior terminou).
+
+    Args:
+        leitor: Leitor (tblLeitor)
+        imagens: Iterável de dicts com user_id, timestamp, image (base64) e arquivo_id
+        cancelamento: Cancelamento do fan-out, verificado antes de cada lote
+
+    Yields:
+        list: Resultados do lote, um dict por imagem com arquivo_id, user_id,
+        sucesso, recusada (o leitor rejeitou a imagem em si) e mensagem. Se o
+        leitor ficar inacessível, as imagens do lote atual ainda não enviadas
+        são devolvidas como falha e as imagens restantes não são consumidas.
+    """
+    tamanho = tamanhoLote(leitor)
+    imagens = iter(imagens)
+    proxima = next(imagens, None)
+    enviadas = total = 0
+    while proxima is not None:
+        if cancelamento:
+            cancelamento.verificar()
+        # O tamanho da string base64 é o tamanho em bytes (ASCII)
+        limite = tamanho.bytes
+        lote = [proxima]
+        ocupado = len(proxima['image'] or '')
+        proxima = next(imagens, None)
+        while proxima is not None and ocupado + len(proxima['image'] or '') <= limite:
+            ocupado += len(proxima['image'] or '')
+            lote.append(proxima)
+            proxima = next(imagens, None)
+
+        try:
+            resultados = _enviarLote(leitor, lote, tamanho, cancelamento)
+        except LeitorInacessivelError as e:
+            # Sem conexão com o leitor: o restante também falharia. As partes
+            # já entregues mantêm o resultado; só as não enviadas são falha
+            logging.error('Leitor %s inacessível, envio interrompido: %s', leitor['nomeLeitor'], e)
+            yield e.resultados + [
+                _resultado(imagem, False, f'Erro na requisição: {str(e)[:200]}') for imagem in lote[len(e.resultados):]
+            ]
+            return
+
+        total += len(resultados)
+        enviadas += sum(r['sucesso'] for r in resultados)
+        yield resultados
+
+    logging.info('Leitor %s: %d de %d imagens aceitas (lote atual: %d bytes)',
+                 leitor['nomeLeitor'], enviadas, total, tamanho.bytes)
+
+
+def enviarImagensAdaptativo(leitor, imagens, cancelamento=None):
+    """
+    Envia uma lista de imagens em lotes adaptativos (ver enviarLotesAdaptativos).
+
+    Returns:
+        list: Um dict por imagem com arquivo_id, user_id, sucesso, recusada e
+        mensagem; imagens não enviadas por o leitor estar inacessível voltam
+        como falha
+    """
+    resultados = [r for lote in enviarLotesAdaptativos(leitor, imagens, cancelamento) for r in lote]
+    if len(resultados) < len(imagens):
+        mensagem = resultados[-1]['mensagem'] if resultados else 'Leitor inacessível'
+        for imagem in imagens[len(resultados):]:
+            resultados.append(_resultado(imagem, False, mensagem))
+    return resultados
+
+
+def registrosLeitorFoto(leitor, resultados, mensagem_sucesso):
+    """Converte resultados de envio nas tuplas gravadas por registrarLeitorFotos."""
+    return [
+        (
+            leitor['idEvento'],
+            leitor['id'],
+            r['arquivo_id'],
+            1 if r['sucesso'] else 0,
+            (mensagem_sucesso if r['sucesso'] else r['mensagem'] or '')[:255],
+        )
+        for r in resultados
+    ]
+
+
+def registrarResultadosImagens(leitor, resultados, mensagem_sucesso):
+    """
+    Registra em tblLeitorFoto, em um único INSERT com upsert, o resultado de
+    cada imagem enviada.
+
+    Args:
+        leitor: Leitor (tblLeitor)
+        resultados: Retorno de enviarImagensAdaptativo (ou um lote de enviarLotesAdaptativos)
+        mensagem_sucesso: Mensagem gravada para as imagens aceitas
+    """
+    registrarLeitorFotos(registrosLeitorFoto(leitor, resultados, mensagem_sucesso))
@@ -1,6 +1,7 @@
-from datetime import datetime, timedelta
 from db import connection_pool
 from db.accessAttempt import register_facial_access_attempt
+from webservices.controlid import cacheAcesso
+from webservices.controlid.periodosLote import compilarPeriodos
 
 def handle_user_identified(
     device_id: str,
@@ -44,147 +45,212 @@ def handle_user_identified(
             }
         }
     
-    conn = connection_pool.get_connection()
-    cursor = conn.cursor(dictionary=True)
-    try:
-        # 1) Leitor existe?
-        cursor.execute(
-            "SELECT id, idEvento, idSetor FROM tblLeitor WHERE deviceId = %s AND status = 'T' LIMIT 1",
-            (device_id,)
-        )
-        leitor = cursor.fetchone()
-        if not leitor:
-            # Não é possível registrar o evento se o leitor não for encontrado
-            return {
-                'result': {
-                    'event': 1,
-                    'message': 'Equipamento inválido.',
-                    'user_id': user_id,
-                    'user_name': user_name,
-                    'user_image': False,
-                    'portal_id': portal_id
-                }
-            }
+    # Dados da decisão vêm do cache; se faltar algum, uma única consulta ao
+    # banco traz leitor, pessoa, credencial, relação com o setor e períodos
+    dados = _lerCache(device_id, user_id)
+    if dados is None:
+        dados = _consultarDadosAcesso(device_id, user_id)
+    leitor, cred, rel, indice_periodos = dados
 
-        event_id = leitor['idEvento']
-        setor_id = leitor['idSetor']
-        leitor_id = leitor['id']
-
-        # 2) Usuário existe?
-        cursor.execute("SELECT id FROM tblPessoa WHERE id = %s AND status = 'T' LIMIT 1", (user_id,))
-        pessoa = cursor.fetchone()
-        if not pessoa:
-            register_facial_access_attempt(user_id, leitor_id, False, 'Usuário não encontrado.', event_id, setor_id=setor_id)
-            return {
-                'result': {
-                    'event': 3,
-                    'message': 'Usuário não encontrado.',
-                    'user_id': user_id,
-                    'user_name': user_name,
-                    'user_image': False
-                }
+    # 1) Leitor existe?
+    if not leitor:
+        # Não é possível registrar o evento se o leitor não for encontrado
+        return {
+            'result': {
+                'event': 1,
+                'message': 'Equipamento inválido.',
+                'user_id': user_id,
+                'user_name': user_name,
+                'user_image': False,
+                'portal_id': portal_id
             }
+        }
 
-        # 3) Última credencial ativa da pessoa
-        cursor.execute(
-            "SELECT id, idLote, codigoCredencial FROM tblCredencial WHERE idPessoa = %s AND status = 'T' ORDER BY dataCadastro DESC LIMIT 1",
-            (user_id,)
-        )
-        cred = cursor.fetchone()
-        if not cred:
-            register_facial_access_attempt(user_id, leitor_id, False, 'Credencial inválida.', event_id, setor_id=setor_id)
-            return {
-                'result': {
-                    'event': 6,
-                    'message': 'Credencial inválida.',
-                    'user_id': user_id,
-                    'user_name': user_name,
-                    'user_image': False,
-                    'portal_id': portal_id
-                }
+    event_id = leitor['idEvento']
+    setor_id = leitor['idSetor']
+    leitor_id = leitor['id']
+
+    # 2) Usuário existe?
+    if cred is None:
+        register_facial_access_attempt(user_id, leitor_id, False, 'Usuário não encontrado.', event_id, setor_id=setor_id)
+        return {
+            'result': {
+                'event': 3,
+                'message': 'Usuário não encontrado.',
+                'user_id': user_id,
+                'user_name': user_name,
+                'user_image': False
             }
-        
-        credential_id = cred['id']
-        id_lote = cred['idLote']
-        credencial = cred['codigoCredencial']
-
-        # 4) O lote da credencial tem acesso a este setor?
-        cursor.execute(
-            "SELECT id FROM tblRelLoteSetor WHERE idLote = %s AND idSetor = %s AND status = 'T' LIMIT 1",
-            (id_lote, setor_id)
-        )
-        rel = cursor.fetchone()
-        if not rel:
-            register_facial_access_attempt(user_id, leitor_id, False, 'Acesso não autorizado para este setor.', event_id, credential_id=credential_id, setor_id=setor_id, credential=credencial, idLote=id_lote)
-            return {
-                'result': {
-                    'event': 6,
-                    'message': 'Acesso não autorizado para este setor.',
-                    'user_id': user_id,
-                    'user_name': user_name,
-                    'user_image': False,
-                    'portal_id': portal_id
-                }
+        }
+
+    # 3) Última credencial ativa da pessoa
+    if not cred:
+        register_facial_access_attempt(user_id, leitor_id, False, 'Credencial inválida.', event_id, setor_id=setor_id)
+        return {
+            'result': {
+                'event': 6,
+                'message': 'Credencial inválida.',
+                'user_id': user_id,
+                'user_name': user_name,
+                'user_image': False,
+                'portal_id': portal_id
             }
+        }
+
+    credential_id = cred['id']
+    id_lote = cred['idLote']
+    credencial = cred['codigoCredencial']
 
-        # 5) O acesso está dentro de algum período válido do lote?
-        cursor.execute(
-            "SELECT dataInicio, dataTermino, horaInicio, horaTermino FROM tblLotePeriodo WHERE idLote = %s AND status = 'T'",
-            (id_lote,)
-        )
-        periodos = cursor.fetchall()
-        agora = datetime.now()
-        acesso_permitido_no_periodo = False
-        
-        if not periodos: # Se não houver períodos definidos para o lote, o acesso pode ser livre
-            acesso_permitido_no_periodo = False
-        else:
-            for p in periodos:
-                # MySQL retorna TIME como timedelta, precisa converter para time
-                hora_inicio = p['horaInicio']
-                hora_termino = p['horaTermino']
-                
-                # Se for timedelta, converte para time
-                if isinstance(hora_inicio, timedelta):
-                    hora_inicio = (datetime.min + hora_inicio).time()
-                if isinstance(hora_termino, timedelta):
-                    hora_termino = (datetime.min + hora_termino).time()
-                
-                dt_ini = datetime.combine(p['dataInicio'], hora_inicio)
-                dt_fim = datetime.combine(p['dataTermino'], hora_termino)
-                
-                if dt_ini <= agora <= dt_fim:
-                    acesso_permitido_no_periodo = True
-                    break
-
-        if not acesso_permitido_no_periodo:
-            register_facial_access_attempt(user_id, leitor_id, False, 'Fora do período de acesso.', event_id, credential_id=credential_id, setor_id=setor_id, credential=credencial, idLote=id_lote)
-            return {
-                'result': {
-                    'event': 6,
-                    'message': 'Fora do período de acesso.',
-                    'user_id': user_id,
-                    'user_name': user_name,
-                    'user_image': False,
-                    'portal_id': portal_id
-                }
+    # 4) O lote da credencial tem acesso a este setor?
+    if not rel:
+        register_facial_access_attempt(user_id, leitor_id, False, 'Acesso não autorizado para este setor.', event_id, credential_id=credential_id, setor_id=setor_id, credential=credencial, idLote=id_lote)
+        return {
+            'result': {
+                'event': 6,
+                'message': 'Acesso não autorizado para este setor.',
+                'user_id': user_id,
+                'user_name': user_name,
+                'user_image': False,
+                'portal_id': portal_id
             }
+        }
 
-        # 6) Acesso Concedido
-        register_facial_access_attempt(user_id, leitor_id, True, 'Acesso concedido.', event_id, credential_id=credential_id, setor_id=setor_id, credential=credencial, idLote=id_lote)
+    # 5) O acesso está dentro de algum período válido do lote?
+    # Sem períodos definidos para o lote, o acesso é negado
+    if not indice_periodos.contem():
+        register_facial_access_attempt(user_id, leitor_id, False, 'Fora do período de acesso.', event_id, credential_id=credential_id, setor_id=setor_id, credential=credencial, idLote=id_lote)
         return {
             'result': {
-                'event': 7,
+                'event': 6,
+                'message': 'Fora do período de acesso.',
                 'user_id': user_id,
                 'user_name': user_name,
                 'user_image': False,
-                'portal_id': portal_id,
-                'actions': [
-                    {'action': "sec_box", 'parameters': "id=65793, reason=1"}
-                ]
+                'portal_id': portal_id
             }
         }
 
+    # 6) Acesso Concedido
+    register_facial_access_attempt(user_id, leitor_id, True, 'Acesso concedido.', event_id, credential_id=credential_id, setor_id=setor_id, credential=credencial, idLote=id_lote)
+    return {
+        'result': {
+            'event': 7,
+            'user_id': user_id,
+            'user_name': user_name,
+            'user_image': False,
+            'portal_id': portal_id,
+            'actions': [
+                {'action': "sec_box", 'parameters': "id=65793, reason=1"}
+            ]
+        }
+    }
+
+
+# Consulta única da decisão de acesso. Retorna uma linha por período ativo do
+# lote (ou uma linha com os períodos nulos); as colunas nulas indicam em qual
+# etapa a validação falhou: pessoa, credencial ou relação lote/setor.
+SQL_DADOS_ACESSO = """
+    SELECT l.id AS idLeitor, l.idEvento, l.idSetor,
+           p.id AS idPessoa,
+           c.id AS idCredencial, c.idLote, c.codigoCredencial,
+           r.id AS idRelLoteSetor,
+           lp.dataInicio, lp.dataTermino, lp.horaInicio, lp.horaTermino
+      FROM tblLeitor l
+      LEFT JOIN tblPessoa p
+             ON p.id = %s AND p.status = 'T'
+      LEFT JOIN tblCredencial c
+             ON c.id = (SELECT c2.id FROM tblCredencial c2
+                         WHERE c2.idPessoa = p.id AND c2.status = 'T'
+                         ORDER BY c2.dataCadastro DESC LIMIT 1)
+      LEFT JOIN tblRelLoteSetor r
+             ON r.id = (SELECT r2.id FROM tblRelLoteSetor r2
+                         WHERE r2.idLote = c.idLote AND r2.idSetor = l.idSetor AND r2.status = 'T'
+                         LIMIT 1)
+      LEFT JOIN tblLotePeriodo lp
+             ON lp.idLote = c.idLote AND lp.status = 'T'
+     WHERE l.id = (SELECT l2.id FROM tblLeitor l2
+                    WHERE l2.deviceId = %s AND l2.status = 'T' LIMIT 1)
+"""
+
+
+def _lerCache(device_id, user_id):
+    """
+    Monta os dados da decisão a partir do cache, etapa por etapa.
+
+    Returns:
+        tuple: (leitor, cred, rel, indice_periodos) ou None se faltar no cache
+        algum dado necessário para decidir
+    """
+    leitor = cacheAcesso.leitores.obter(device_id)
+    if leitor is cacheAcesso.AUSENTE:
+        return None
+    if not leitor:
+        return leitor, None, None, None
+
+    cred = cacheAcesso.credenciais.obter(user_id)
+    if cred is cacheAcesso.AUSENTE:
+        return None
+    if not cred:
+        return leitor, cred, None, None
+
+    rel = cacheAcesso.lotesSetores.obter((cred['idLote'], leitor['idSetor']))
+    if rel is cacheAcesso.AUSENTE:
+        return None
+    if not rel:
+        return leitor, cred, rel, None
+
+    indice_periodos = cacheAcesso.periodos.obter(cred['idLote'])
+    if indice_periodos is cacheAcesso.AUSENTE:
+        return None
+    return leitor, cred, rel, indice_periodos
+
+
+def _consultarDadosAcesso(device_id, user_id):
+    """
+    Busca todos os dados da decisão em uma única ida ao banco e atualiza o
+    cache. O cursor comum monta a consulta no cliente e a envia em um só
+    COM_QUERY; um statement preparado a cada chamada custaria PREPARE,
+    EXECUTE e CLOSE.
+
+    Returns:
+        tuple: (leitor, cred, rel, indice_periodos), onde leitor é None se o
+        leitor não existir, cred é None se a pessoa não existir e {} se ela não
+        tiver credencial ativa
+    """
+    conn = connection_pool.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(SQL_DADOS_ACESSO, (user_id, device_id))
+        linhas = cursor.fetchall()
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+    if not linhas:
+        cacheAcesso.leitores.definir(device_id, None)
+        return None, None, None, None
+
+    primeira = linhas[0]
+    leitor = {'id': primeira['idLeitor'], 'idEvento': primeira['idEvento'], 'idSetor': primeira['idSetor']}
+    cacheAcesso.leitores.definir(device_id, leitor)
+
+    if primeira['idPessoa'] is None:
+        cacheAcesso.credenciais.definir(user_id, None)
+        return leitor, None, None, None
+
+    if primeira['idCredencial'] is None:
+        cacheAcesso.credenciais.definir(user_id, {})
+        return leitor, {}, None, None
+
+    cred = {'id': primeira['idCredencial'], 'idLote': primeira['idLote'], 'codigoCredencial': primeira['codigoCredencial']}
+    cacheAcesso.credenciais.definir(user_id, cred)
+
+    rel = primeira['idRelLoteSetor'] is not None
+    cacheAcesso.lotesSetores.definir((cred['idLote'], leitor['idSetor']), rel)
+
+    # Os períodos do lote são indexados mesmo sem acesso ao setor, pois são
+    # reaproveitados por outros leitores do mesmo lote
+    indice_periodos = compilarPeriodos([linha for linha in linhas if linha['dataInicio'] is not None])
+    cacheAcesso.periodos.definir(cred['idLote'], indice_periodos)
+
+    return leitor, cred, rel, indice_periodos
@@ -0,0 +1,75 @@
+"""
+Índice pré-compilado dos períodos de acesso de um lote (tblLotePeriodo).
+
+Os períodos são convertidos uma única vez em intervalos (inicio, fim) em epoch,
+ordenados e mesclados, de forma que a verificação de um instante é feita com
+busca binária, sem alocar datetimes a cada requisição.
+"""
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+
+class IndicePeriodos:
+    """Intervalos disjuntos e ordenados de um lote, consultados com bisect."""
+
+    __slots__ = ('inicios', 'fins')
+
+    def __init__(self, intervalos):
+        self.inicios = tuple(inicio for inicio, _ in intervalos)
+        self.fins = tuple(fim for _, fim in intervalos)
+
+    def __len__(self):
+        return len(self.inicios)
+
+    def contem(self, ts=None):
+        """
+        Verifica se o instante está dentro de algum período.
+
+        Args:
+            ts: Timestamp epoch (default: agora)
+
+        Returns:
+            bool: True se o instante estiver em algum período do lote
+        """
+        if ts is None:
+            ts = time.time()
+        i = bisect_right(self.inicios, ts) - 1
+        return i >= 0 and ts <= self.fins[i]
+
+
+def _paraTimestamp(data, hora):
+    """Combina DATE + TIME do MySQL (TIME vem como timedelta) em epoch local."""
+    if isinstance(hora, timedelta):
+        return datetime.combine(data, datetime.min.time()).timestamp() + hora.total_seconds()
+    return datetime.combine(data, hora).timestamp()
+
+
+def compilarPeriodos(periodos):
+    """
+    Compila as linhas de tblLotePeriodo em um IndicePeriodos.
+
+    Args:
+        periodos: Linhas com dataInicio, dataTermino, horaInicio e horaTermino
+
+    Returns:
+        IndicePeriodos: Índice com os intervalos mesclados (vazio se não houver períodos)
+    """
+    intervalos = []
+    for p in periodos or ():
+        inicio = _paraTimestamp(p['dataInicio'], p['horaInicio'])
+        fim = _paraTimestamp(p['dataTermino'], p['horaTermino'])
+        if fim >= inicio:
+            intervalos.append((inicio, fim))
+    intervalos.sort()
+
+    # Mescla intervalos sobrepostos para que a busca binária seja exata
+    mesclados = []
+    for inicio, fim in intervalos:
+        if mesclados and inicio <= mesclados[-1][1]:
+            if fim > mesclados[-1][1]:
+                mesclados[-1] = (mesclados[-1][0], fim)
+        else:
+            mesclados.append((inicio, fim))
+
+    return IndicePeriodos(mesclados)
@@ -0,0 +1,75 @@
+"""
+Estágios de pipeline com threads e filas limitadas.
+
+estagio(iteravel, tamanho_fila) consome um iterável (normalmente um gerador)
+em uma thread própria e entrega os itens por uma fila com no máximo
+tamanho_fila itens à frente do consumidor. Encadeando estágios, as etapas
+(consulta ao banco, leitura do disco, envio ao leitor) rodam ao mesmo tempo e a
+memória fica limitada ao tamanho das filas:
+
+    linhas = estagio(buscarLinhas(), 200, 'banco')
+    imagens = estagio(lerImagens(linhas), 16, 'disco')
+    for imagem in imagens:
+        ...
+
+Exceções do produtor são relançadas no consumidor. Se o consumidor parar antes
+do fim (break, exceção, close()), o produtor é avisado e encerra o iterável.
+"""
+import queue
+import threading
+
+_FIM = object()
+
+
+class _Falha:
+    def __init__(self, excecao):
+        self.excecao = excecao
+
+
+def estagio(iteravel, tamanho_fila, nome='pipeline'):
+    """
+    Gera os itens do iterável, produzidos em uma thread separada.
+
+    Args:
+        iteravel: Iterável consumido pela thread do estágio
+        tamanho_fila: Itens que o produtor pode adiantar em relação ao consumidor
+        nome: Nome da thread (para logs e depuração)
+    """
+    fila = queue.Queue(maxsize=tamanho_fila)
+    parar = threading.Event()
+
+    def colocar(item):
+        while not parar.is_set():
+            try:
+                fila.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produzir():
+        final = _FIM
+        try:
+            for item in iteravel:
+                if not colocar(item):
+                    return
+        except BaseException as e:
+            final = _Falha(e)
+        finally:
+            fechar = getattr(iteravel, 'close', None)
+            if fechar:
+                fechar()
+        colocar(final)
+
+    thread = threading.Thread(target=produzir, name=nome, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = fila.get()
+            if item is _FIM:
+                return
+            if isinstance(item, _Falha):
+                raise item.excecao
+            yield item
+    finally:
+        parar.set()
@@ -7,13 +7,29 @@ Similar ao sistema de queue/jobs do Laravel.
 Este script processa a tabela tblJobSync, enviando imagens específicas para todos os leitores
 quando uma nova foto é cadastrada no sistema.
 
+Os jobs são reservados com SELECT ... FOR UPDATE SKIP LOCKED (ver
+reivindicarJobs), então várias execuções, no mesmo host ou em hosts
+diferentes, podem processar a fila ao mesmo tempo sem repetir jobs. Requer a
+coluna tblJobSync.trabalhador (sql/tblJobSync_trabalhador.sql).
+
+Os jobs reservados juntos são processados em conjunto (ver processarJobs):
+jobs antigos de uma mesma pessoa são substituídos pelo mais recente, cada
+leitor recebe as imagens em lotes de várias imagens e os jobs concluídos são
+marcados com um único UPDATE. A entrega de cada job é registrada por leitor
+(tblJobSyncLeitor, sql/tblJobSyncLeitor.sql): uma nova tentativa só envia aos
+leitores que falharam e é agendada com espera exponencial (proximaTentativa).
+
 Uso:
     python processarJobsSync.py [--limit N] [--job-id ID]
+    python processarJobsSync.py --daemon [--concorrencia N] [--lote N]
+    python processarJobsSync.py --despertar
     
 Exemplos:
     python processarJobsSync.py                    # Processa até 10 jobs pendentes
     python processarJobsSync.py --limit 50         # Processa até 50 jobs
     python processarJobsSync.py --job-id 123       # Processa apenas o job 123
+    python processarJobsSync.py --daemon           # Trabalhador residente (encerra com SIGTERM)
+    python processarJobsSync.py --despertar        # Avisa os trabalhadores residentes de um job novo
 """
 
 import sys
@@ -22,106 +38,73 @@ import os
 # Adiciona o diretório raiz do servidor ao path para permitir importações
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
-import requests
 import time
 import json
 import argparse
-import base64
-from datetime import datetime, timedelta
-from contextlib import contextmanager
-import fcntl
-from db import conectarBancoEvento
+import random
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from db import conectarBancoEvento, registrarLeitorFotos
 from webservices.controlid.configurarLeitor import isSessionValid
-from config import SISTEMA_GERENCIAMENTO
+from webservices.controlid.usuariosLeitor import garantirUsuarios
+from webservices.controlid.clienteLeitor import estatisticasClientes
+from webservices.controlid.loteAdaptativo import enviarImagensAdaptativo, registrosLeitorFoto
+from webservices.controlid.imagensLeitor import lerImagemBase64, estatisticasImagens
+from webservices.controlid.fanout import executarEmLeitores
+from webservices.controlid.despertarJobs import DespertadorJobs, despertarTrabalhadores
+from config import (
+    JOBS_CONCORRENCIA,
+    JOBS_LOTE,
+    JOBS_INTERVALO_CONSULTA,
+    JOBS_PRAZO_PROCESSANDO,
+    JOBS_INTERVALO_RECUPERACAO,
+    JOBS_BACKOFF_BASE,
+    JOBS_BACKOFF_MAXIMO,
+)
 from logging_config import get_processar_jobs_logger
 
 # Obtém o logger configurado para este módulo
 logging = get_processar_jobs_logger()
 
-def lerImagemBase64(pathLocal, pathNuvem=None):
-    """
-    Lê uma imagem do disco ou nuvem e retorna em base64.
-    
-    Args:
-        pathLocal: Caminho local da imagem (ex: /midia/pessoas/5/imagens/avatar/...)
-        pathNuvem: URL da nuvem (se disponível)
-        
-    Returns:
-        str: Imagem em base64 ou None se não encontrada
-    """
-    try:
-        # Se tem pathNuvem, retorna diretamente (já está em base64)
-        if pathNuvem:
-            return pathNuvem
-        
-        # Se tem pathLocal, lê do disco
-        if pathLocal:
-            # Monta o caminho completo
-            caminho_completo = os.path.join(SISTEMA_GERENCIAMENTO, pathLocal.lstrip('/'))
-            
-            if not os.path.exists(caminho_completo):
-                logging.error('Arquivo não encontrado: %s', caminho_completo)
-                return None
-            
-            # Lê o arquivo e converte para base64
-            with open(caminho_completo, 'rb') as f:
-                imagem_bytes = f.read()
-                imagem_base64 = base64.b64encode(imagem_bytes).decode('utf-8')
-                return imagem_base64
-        
-        return None
-        
-    except Exception as e:
-        logging.error('Erro ao ler imagem: %s', str(e))
-        return None
-
-@contextmanager
-def file_lock(lock_path):
-    """Context manager para lock de arquivo"""
-    lock_file = None
-    try:
-        lock_file = open(lock_path, 'w')
-        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-        logging.info('Lock adquirido')
-        yield lock_file
-    except IOError:
-        logging.warning('Outro processo já está executando')
-        raise
-    finally:
-        if lock_file:
-            try:
-                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
-                lock_file.close()
-                logging.info('Lock liberado')
-            except Exception as e:
-                logging.error('Erro ao liberar lock: %s', str(e))
+TRABALHADOR = f'{socket.gethostname()}:{os.getpid()}'
 
-def buscarJobsPendentes(limit=10, job_id=None):
+def reivindicarJobs(limit=10, job_id=None, trabalhador=TRABALHADOR):
     """
-    Busca jobs pendentes ou prontos para reprocessar.
+    Reserva atomicamente jobs pendentes (ou prontos para reprocessar) e os
+    marca como PROCESSANDO, incrementando tentativas.
+    
+    A seleção usa SELECT ... FOR UPDATE SKIP LOCKED: linhas já travadas por
+    outro trabalhador são ignoradas, então vários processos (em um ou mais
+    hosts) podem drenar a fila ao mesmo tempo sem pegar o mesmo job.
     
     Args:
-        limit: Número máximo de jobs a retornar
-        job_id: Se fornecido, busca apenas este job específico
+        limit: Número máximo de jobs a reservar
+        job_id: Se fornecido, reserva apenas este job específico
+        trabalhador: Identificação gravada em tblJobSync.trabalhador
         
     Returns:
-        list: Lista de jobs pendentes
+        list: Jobs reservados (com tentativas já incrementada)
     """
+    if limit <= 0:
+        return []
+    conn = None
     try:
         conn = conectarBancoEvento()
         cursor = conn.cursor(dictionary=True)
         
         if job_id:
-            # Busca job específico
+            # Busca job específico (se não estiver em processamento)
             cursor.execute("""
-                SELECT * FROM tblJobSync
-                WHERE id = %s
-                LIMIT 1
+                SELECT id FROM tblJobSync
+                WHERE id = %s AND status <> 'PROCESSANDO'
+                FOR UPDATE SKIP LOCKED
             """, (job_id,))
         else:
             # Busca jobs pendentes ou que falharam mas podem tentar novamente
             cursor.execute("""
-                SELECT * FROM tblJobSync
+                SELECT id FROM tblJobSync
                 WHERE (
                     status = 'PENDENTE' 
                     OR (
@@ -129,61 +112,101 @@ def buscarJobsPendentes(limit=10, job_id=None):
                         AND tentativas < maxTentativas 
                     )
                 )
+                AND (proximaTentativa IS NULL OR proximaTentativa <= NOW())
                 ORDER BY dataAgendamento ASC
                 LIMIT %s
+                FOR UPDATE SKIP LOCKED
             """, (limit,))
         
+        ids = [linha['id'] for linha in cursor.fetchall()]
+        if not ids:
+            conn.rollback()
+            cursor.close()
+            return []
+        
+        marcadores = ', '.join(['%s'] * len(ids))
+        cursor.execute(f"""
+            UPDATE tblJobSync
+            SET status = 'PROCESSANDO',
+                tentativas = tentativas + 1,
+                dataInicio = NOW(),
+                trabalhador = %s
+            WHERE id IN ({marcadores})
+        """, (trabalhador, *ids))
+        cursor.execute(f"""
+            SELECT * FROM tblJobSync
+            WHERE id IN ({marcadores})
+            ORDER BY dataAgendamento ASC
+        """, tuple(ids))
         jobs = cursor.fetchall()
+        
+        conn.commit()
         cursor.close()
-        conn.close()
         
-        logging.info('Encontrados %d jobs para processar', len(jobs))
+        logging.info('%d jobs reservados: %s', len(jobs), ids)
         return jobs
         
     except Exception as e:
-        logging.error('Erro ao buscar jobs pendentes: %s', str(e))
+        logging.error('Erro ao reservar jobs: %s', str(e))
+        if conn is not None:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
         return []
+    finally:
+        if conn is not None:
+            conn.close()
 
-def marcarJobComoProcessando(job_id):
+def recuperarJobsTravados(prazo=JOBS_PRAZO_PROCESSANDO):
     """
-    Marca um job como PROCESSANDO e incrementa tentativas.
+    Devolve à fila jobs em PROCESSANDO há mais de `prazo` segundos (o
+    trabalhador que os reservou foi interrompido). Jobs sem tentativas
+    restantes são marcados como FALHA.
     
-    Args:
-        job_id: ID do job
-        
     Returns:
-        bool: True se marcado com sucesso
+        int: Número de jobs recuperados
     """
+    conn = None
     try:
         conn = conectarBancoEvento()
         cursor = conn.cursor()
         
         cursor.execute("""
             UPDATE tblJobSync
-            SET status = 'PROCESSANDO',
-                tentativas = tentativas + 1,
-                dataInicio = NOW()
-            WHERE id = %s
-        """, (job_id,))
+            SET mensagemErro = CONCAT('Processamento interrompido (trabalhador ', COALESCE(trabalhador, '?'), ')'),
+                dataConclusao = IF(tentativas >= maxTentativas, NOW(), dataConclusao),
+                status = IF(tentativas >= maxTentativas, 'FALHA', 'PENDENTE'),
+                trabalhador = NULL
+            WHERE status = 'PROCESSANDO'
+            AND dataInicio < NOW() - INTERVAL %s SECOND
+        """, (prazo,))
+        recuperados = cursor.rowcount
         
         conn.commit()
         cursor.close()
-        conn.close()
         
-        logging.info('Job %d marcado como PROCESSANDO', job_id)
-        return True
+        if recuperados:
+            logging.warning('%d jobs abandonados em PROCESSANDO voltaram para a fila', recuperados)
+        return recuperados
         
     except Exception as e:
-        logging.error('Erro ao marcar job %d como processando: %s', job_id, str(e))
-        return False
+        logging.error('Erro ao recuperar jobs travados: %s', str(e))
+        return 0
+    finally:
+        if conn is not None:
+            conn.close()
 
-def marcarJobComoConcluido(job_id):
+def marcarJobComoConcluido(job_id, trabalhador=TRABALHADOR):
     """
     Marca um job como CONCLUIDO.
     
     Args:
         job_id: ID do job
+        trabalhador: Trabalhador que reservou o job (se o job foi recuperado e
+            reservado por outro, a atualização é ignorada)
     """
+    conn = None
     try:
         conn = conectarBancoEvento()
         cursor = conn.cursor()
@@ -193,19 +216,66 @@ def marcarJobComoConcluido(job_id):
             SET status = 'CONCLUIDO',
                 dataConclusao = NOW(),
                 mensagemErro = NULL
-            WHERE id = %s
-        """, (job_id,))
+            WHERE id = %s AND status = 'PROCESSANDO' AND trabalhador = %s
+        """, (job_id, trabalhador))
         
         conn.commit()
         cursor.close()
-        conn.close()
         
         logging.info('Job %d marcado como CONCLUIDO', job_id)
         
     except Exception as e:
         logging.error('Erro ao marcar job %d como concluído: %s', job_id, str(e))
+    finally:
+        if conn is not None:
+            conn.close()
 
-def marcarJobComoFalha(job_id, mensagem_erro, tentativas, max_tentativas):
+def marcarJobsComoConcluidos(job_ids, mensagem=None, trabalhador=TRABALHADOR):
+    """
+    Marca vários jobs como CONCLUIDO em um único UPDATE.
+    
+    Args:
+        job_ids: IDs dos jobs
+        mensagem: Gravada em mensagemErro (ex: motivo de o job ter sido substituído)
+        trabalhador: Trabalhador que reservou os jobs
+    """
+    if not job_ids:
+        return
+    conn = None
+    try:
+        conn = conectarBancoEvento()
+        cursor = conn.cursor()
+        
+        marcadores = ', '.join(['%s'] * len(job_ids))
+        cursor.execute(f"""
+            UPDATE tblJobSync
+            SET status = 'CONCLUIDO',
+                dataConclusao = NOW(),
+                mensagemErro = %s
+            WHERE id IN ({marcadores}) AND status = 'PROCESSANDO' AND trabalhador = %s
+        """, (mensagem, *job_ids, trabalhador))
+        
+        conn.commit()
+        cursor.close()
+        
+        logging.info('%d jobs marcados como CONCLUIDO', len(job_ids))
+        
+    except Exception as e:
+        logging.error('Erro ao marcar jobs %s como concluídos: %s', job_ids, str(e))
+    finally:
+        if conn is not None:
+            conn.close()
+
+def atrasoProximaTentativa(tentativas):
+    """
+    Segundos até a próxima tentativa de um job: JOBS_BACKOFF_BASE dobrando a
+    cada tentativa, limitado a JOBS_BACKOFF_MAXIMO, com metade aleatória para
+    que jobs que falharam juntos não voltem todos ao mesmo tempo.
+    """
+    atraso = min(JOBS_BACKOFF_MAXIMO, JOBS_BACKOFF_BASE * 2 ** max(0, tentativas - 1))
+    return int(atraso / 2 + random.uniform(0, atraso / 2))
+
+def marcarJobComoFalha(job_id, mensagem_erro, tentativas, max_tentativas, trabalhador=TRABALHADOR):
     """
     Marca um job como FALHA ou volta para PENDENTE se ainda há tentativas.
     
@@ -214,7 +284,9 @@ def marcarJobComoFalha(job_id, mensagem_erro, tentativas, max_tentativas):
         mensagem_erro: Mensagem de erro
         tentativas: Número atual de tentativas
         max_tentativas: Máximo de tentativas permitidas
+        trabalhador: Trabalhador que reservou o job
     """
+    conn = None
     try:
         conn = conectarBancoEvento()
         cursor = conn.cursor()
@@ -226,25 +298,29 @@ def marcarJobComoFalha(job_id, mensagem_erro, tentativas, max_tentativas):
                 SET status = 'FALHA',
                     mensagemErro = %s,
                     dataConclusao = NOW()
-                WHERE id = %s
-            """, (mensagem_erro, job_id))
+                WHERE id = %s AND status = 'PROCESSANDO' AND trabalhador = %s
+            """, (mensagem_erro, job_id, trabalhador))
             logging.error('Job %d marcado como FALHA definitiva após %d tentativas', job_id, tentativas)
         else:
             # Aguarda para próxima tentativa (delay exponencial)
+            atraso = atrasoProximaTentativa(tentativas)
             cursor.execute("""
                 UPDATE tblJobSync
                 SET status = 'PENDENTE',
-                    mensagemErro = %s
-                WHERE id = %s
-            """, (mensagem_erro, job_id))
-            logging.warning('Job %d voltou para PENDENTE.', job_id)
+                    mensagemErro = %s,
+                    proximaTentativa = NOW() + INTERVAL %s SECOND
+                WHERE id = %s AND status = 'PROCESSANDO' AND trabalhador = %s
+            """, (mensagem_erro, atraso, job_id, trabalhador))
+            logging.warning('Job %d voltou para PENDENTE (próxima tentativa em %ds).', job_id, atraso)
         
         conn.commit()
         cursor.close()
-        conn.close()
         
     except Exception as e:
         logging.error('Erro ao marcar job %d como falha: %s', job_id, str(e))
+    finally:
+        if conn is not None:
+            conn.close()
 
 def buscarLeitoresAtivos():
     """
@@ -253,6 +329,7 @@ def buscarLeitoresAtivos():
     Returns:
         list: Lista de leitores
     """
+    conn = None
     try:
         conn = conectarBancoEvento()
         cursor = conn.cursor(dictionary=True)
@@ -265,7 +342,6 @@ def buscarLeitoresAtivos():
         
         leitores = cursor.fetchall()
         cursor.close()
-        conn.close()
         
         logging.info('Encontrados %d leitores ativos', len(leitores))
         return leitores
@@ -273,254 +349,462 @@ def buscarLeitoresAtivos():
     except Exception as e:
         logging.error('Erro ao buscar leitores ativos: %s', str(e))
         return []
+    finally:
+        if conn is not None:
+            conn.close()
 
-def processarJobSyncImagem(job):
+def separarJobsSubstituidos(jobs):
     """
-    Processa um job de sincronização de imagem.
-    Envia a imagem para todos os leitores ativos.
+    Mantém, para cada pessoa, apenas o job mais recente. Um job é substituído
+    se outro job da mesma pessoa (reservado junto, pendente, em processamento
+    ou concluído) tem id maior: a foto dele é a atual e será ou já foi enviada
+    por esse job. Jobs mais novos em FALHA não substituem: a foto não chegou
+    aos leitores por eles.
     
     Args:
-        job: Dados do job
+        jobs: Jobs reservados
         
     Returns:
-        tuple: (sucesso: bool, mensagem: str)
+        tuple: (jobs a processar: list, jobs substituídos: list)
     """
-    job_id = job['id']
-    pessoa_id = job['idPessoa']
-    arquivo_id = job['idArquivo']
+    pessoas = sorted({job['idPessoa'] for job in jobs})
+    conn = conectarBancoEvento()
+    cursor = conn.cursor()
+    try:
+        marcadores = ', '.join(['%s'] * len(pessoas))
+        cursor.execute(f"""
+            SELECT idPessoa, MAX(id) FROM tblJobSync
+            WHERE idPessoa IN ({marcadores})
+              AND status IN ('PENDENTE', 'PROCESSANDO', 'CONCLUIDO')
+            GROUP BY idPessoa
+        """, tuple(pessoas))
+        mais_recente = {int(pessoa): int(job_id) for pessoa, job_id in cursor.fetchall()}
+    finally:
+        cursor.close()
+        conn.close()
     
-    logging.info('Processando job %d: Sincronizar imagem do arquivo %d (pessoa %d)', 
-                 job_id, arquivo_id, pessoa_id)
+    vigentes, substituidos = [], []
+    for job in jobs:
+        if job['id'] >= mais_recente.get(int(job['idPessoa']), job['id']):
+            vigentes.append(job)
+        else:
+            substituidos.append(job)
+    return vigentes, substituidos
+
+def buscarImagensJobs(jobs):
+    """
+    Busca pessoa e arquivo de cada job em uma única consulta.
     
+    Returns:
+        dict: {id do job: dict com id, nome, pathLocal e pathNuvem}
+    """
+    condicoes = ' OR '.join(['(p.id = %s AND a.id = %s)'] * len(jobs))
+    conn = conectarBancoEvento()
+    cursor = conn.cursor(dictionary=True)
     try:
-        # Busca informações da pessoa e arquivo
-        conn = conectarBancoEvento()
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT p.id, p.nome, a.pathLocal, a.pathNuvem
+        cursor.execute(f"""
+            SELECT p.id, p.nome, a.id AS idArquivo, a.pathLocal, a.pathNuvem
             FROM tblPessoa p
             INNER JOIN tblArquivo a ON a.idReferencia = p.id
-            WHERE p.id = %s AND a.id = %s
+            WHERE ({condicoes})
             AND a.tipoReferencia = 'PESSOA' AND a.tipoArquivo = 'AVATAR'
-            LIMIT 1
-        """, (pessoa_id, arquivo_id))
-        
-        dados = cursor.fetchone()
+        """, tuple(valor for job in jobs for valor in (job['idPessoa'], job['idArquivo'])))
+        por_chave = {(int(linha['id']), int(linha['idArquivo'])): linha for linha in cursor.fetchall()}
+    finally:
         cursor.close()
         conn.close()
-        
-        if not dados:
-            return False, f'Pessoa ou arquivo não encontrado (pessoa: {pessoa_id}, arquivo: {arquivo_id})'
-        
-        # Lê a imagem do disco e converte para base64
-        imagem_base64 = lerImagemBase64(dados['pathLocal'], dados['pathNuvem'])
-        
-        if not imagem_base64:
-            return False, 'Imagem não encontrada ou erro ao ler arquivo'
-        
-        # Busca leitores ativos
-        leitores = buscarLeitoresAtivos()
-        if not leitores:
-            return False, 'Nenhum leitor ativo encontrado'
-        
-        # Envia para cada leitor
-        erros = []
-        sucessos = 0
-        
-        for leitor in leitores:
-            try:
-                # Valida sessão
-                session = isSessionValid(leitor)
-                if not session:
-                    erros.append(f'Leitor {leitor["nomeLeitor"]}: sessão inválida')
-                    continue
-                
-                # Verifica se usuário existe no leitor
-                user_exists_response = requests.post(
-                    f"http://{leitor['ip']}/load_objects.fcgi?session={session}",
-                    json={
-                        'object': 'users',
-                        'where': [{'object': 'users', 'field': 'id', 'operator': '=', 'value': pessoa_id}]
-                    },
-                    headers={'Content-Type': 'application/json'},
-                    timeout=5
-                )
-                
-                if user_exists_response.status_code == 200:
-                    users = user_exists_response.json().get('users', [])
-                    if not users:
-                        # Cria usuário
-                        create_user_response = requests.post(
-                            f"http://{leitor['ip']}/create_objects.fcgi?session={session}",
-                            json={
-                                'object': 'users',
-                                'values': [{
-                                    'id': pessoa_id,
-                                    'registration': str(pessoa_id),
-                                    'name': dados['nome']
-                                }]
-                            },
-                            headers={'Content-Type': 'application/json'},
-                            timeout=5
-                        )
-                        
-                        if create_user_response.status_code != 200:
-                            erros.append(f'Leitor {leitor["nomeLeitor"]}: falha ao criar usuário')
-                            continue
-                
-                # Envia a imagem
-                response = requests.post(
-                    f"http://{leitor['ip']}/user_set_image_list.fcgi?session={session}",
-                    json={
-                        'match': False,
-                        'user_images': [{
-                            'user_id': pessoa_id,
-                            'timestamp': int(time.time()),
-                            'image': imagem_base64
-                        }]
-                    },
-                    headers={'Content-Type': 'application/json'},
-                    timeout=90
-                )
-                
-                # Registra resultado
-                conn = conectarBancoEvento()
-                cursor = conn.cursor()
-                
-                if response.status_code == 200:
-                    sucessos += 1
-                    cursor.execute("""
-                        INSERT INTO tblLeitorFoto (idEvento, idLeitor, idArquivo, status, mensagem, dataCadastro)
-                        VALUES (%s, %s, %s, 1, 'Sincronizado via job', NOW())
-                    """, (leitor['idEvento'], leitor['id'], arquivo_id))
-                    logging.info('Imagem enviada com sucesso para o leitor %s', leitor['nomeLeitor'])
-                else:
-                    erros.append(f'Leitor {leitor["nomeLeitor"]}: {response.text[:100]}')
-                    cursor.execute("""
-                        INSERT INTO tblLeitorFoto (idEvento, idLeitor, idArquivo, status, mensagem, dataCadastro)
-                        VALUES (%s, %s, %s, 0, %s, NOW())
-                    """, (leitor['idEvento'], leitor['id'], arquivo_id, f'Erro: {response.text[:200]}'))
-                
-                conn.commit()
-                cursor.close()
-                conn.close()
-                
-            except Exception as e:
-                erro_msg = f'Leitor {leitor["nomeLeitor"]}: {str(e)}'
-                logging.error(erro_msg)
-                erros.append(erro_msg)
-        
-        # Resultado final
-        if sucessos == 0:
-            return False, f'Falha em todos os leitores. Erros: {"; ".join(erros[:3])}'
-        elif sucessos == len(leitores):
-            return True, f'Imagem enviada para {sucessos} leitor(es) com sucesso'
-        else:
-            return True, f'Enviado para {sucessos}/{len(leitores)} leitores. Alguns erros: {"; ".join(erros[:2])}'
-        
-    except Exception as e:
-        return False, f'Erro inesperado: {str(e)}'
+    
+    dados = {}
+    for job in jobs:
+        linha = por_chave.get((int(job['idPessoa']), int(job['idArquivo'])))
+        if linha:
+            dados[job['id']] = linha
+    return dados
 
-def processarJob(job):
+def buscarEntregasConcluidas(job_ids):
     """
-    Processa um job de acordo com seu tipo.
+    Leitores que já receberam (ou recusaram) a imagem de cada job em
+    tentativas anteriores; eles não recebem um novo envio.
+    
+    Returns:
+        dict: {id do job: set de ids de leitores}
+    """
+    entregues = {}
+    if not job_ids:
+        return entregues
+    conn = conectarBancoEvento()
+    cursor = conn.cursor()
+    try:
+        marcadores = ', '.join(['%s'] * len(job_ids))
+        cursor.execute(f"""
+            SELECT idJob, idLeitor FROM tblJobSyncLeitor
+            WHERE idJob IN ({marcadores}) AND status IN ('ENVIADO', 'RECUSADA')
+        """, tuple(job_ids))
+        for job_id, leitor_id in cursor.fetchall():
+            entregues.setdefault(int(job_id), set()).add(int(leitor_id))
+    finally:
+        cursor.close()
+        conn.close()
+    return entregues
+
+def registrarEntregasJobs(entregas):
+    """
+    Grava o estado da entrega de cada job por leitor em tblJobSyncLeitor
+    (INSERT de várias linhas com upsert em (idJob, idLeitor)).
     
     Args:
-        job: Dados do job
+        entregas: Lista de tuplas (idJob, idLeitor, status, mensagem)
+    """
+    if not entregas:
+        return
+    conn = conectarBancoEvento()
+    cursor = conn.cursor()
+    try:
+        for i in range(0, len(entregas), 500):
+            bloco = entregas[i:i + 500]
+            cursor.execute(f"""
+                INSERT INTO tblJobSyncLeitor (idJob, idLeitor, status, mensagem)
+                VALUES {', '.join(['(%s, %s, %s, %s)'] * len(bloco))}
+                ON DUPLICATE KEY UPDATE
+                    status = VALUES(status),
+                    mensagem = VALUES(mensagem),
+                    tentativas = tentativas + 1
+            """, [valor for entrega in bloco for valor in entrega])
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+def enviarImagensLeitor(leitor, pessoas, imagens_por_leitor, cancelamento=None):
+    """
+    Envia a um leitor as imagens pendentes para ele, em lotes de vários
+    usuários limitados em bytes (ver loteAdaptativo).
+    Executada pelo fan-out (ver fanout), uma vez por leitor.
+    
+    Args:
+        leitor: Leitor (tblLeitor)
+        pessoas: Lista de dicts com 'id' e 'nome'
+        imagens_por_leitor: {id do leitor: lista de dicts com user_id,
+            timestamp, image e arquivo_id}
         
     Returns:
-        bool: True se processado com sucesso
+        list: Resultado por imagem (arquivo_id, user_id, sucesso, recusada, mensagem)
+    
+    Raises:
+        RuntimeError: Sessão inválida
     """
-    job_id = job['id']
+    imagens = imagens_por_leitor.get(leitor['id'], [])
+    usuarios = {int(img['user_id']) for img in imagens}
     
-    # Marca como processando
-    if not marcarJobComoProcessando(job_id):
-        return False
+    # Valida sessão
+    session = isSessionValid(leitor)
+    if not session:
+        raise RuntimeError('sessão inválida')
     
-    try:
-        sucesso, mensagem = processarJobSyncImagem(job)
-        
-        # Marca resultado
-        if sucesso:
-            marcarJobComoConcluido(job_id)
-            logging.info('Job %d concluído: %s', job_id, mensagem)
-        else:
-            marcarJobComoFalha(job_id, mensagem, job['tentativas'] + 1, job['maxTentativas'])
-            logging.error('Job %d falhou: %s', job_id, mensagem)
+    # Verifica/cria os usuários no leitor
+    cadastrados, erros_usuario = garantirUsuarios(
+        leitor, session, [p for p in pessoas if int(p['id']) in usuarios]
+    )
+    enviaveis = [img for img in imagens if int(img['user_id']) in cadastrados]
+    erro_usuario = erros_usuario[0] if erros_usuario else 'falha ao criar usuário'
+    resultados = [
+        {'arquivo_id': img['arquivo_id'], 'user_id': img['user_id'], 'sucesso': False,
+         'recusada': False, 'mensagem': erro_usuario}
+        for img in imagens if int(img['user_id']) not in cadastrados
+    ]
+    
+    if enviaveis:
+        resultados.extend(enviarImagensAdaptativo(leitor, enviaveis, cancelamento=cancelamento))
+    logging.info('Leitor %s: %d de %d imagens enviadas com sucesso',
+                 leitor['nomeLeitor'], sum(r['sucesso'] for r in resultados), len(imagens))
+    return resultados
+
+def processarJobs(jobs):
+    """
+    Processa em conjunto jobs já reservados por reivindicarJobs.
+    
+    Jobs antigos de uma mesma pessoa são substituídos pelo mais recente
+    (concluídos sem envio); as imagens restantes são enviadas a cada leitor em
+    lotes de várias imagens e os jobs concluídos são marcados de uma vez.
+    
+    A entrega é registrada por leitor em tblJobSyncLeitor: um job é concluído
+    quando todos os leitores ativos receberam a imagem (ou a recusaram) e, em
+    uma nova tentativa, só os leitores que falharam recebem o envio.
+    
+    Args:
+        jobs: Jobs reservados (status PROCESSANDO, tentativas já incrementada)
         
-        return sucesso
+    Returns:
+        tuple: (sucessos: int, falhas: int)
+    """
+    if not jobs:
+        return 0, 0
+    falhas = {}
+    substituidos = []
+    try:
+        jobs, substituidos = separarJobsSubstituidos(jobs)
+        if substituidos:
+            logging.info('%d jobs substituídos por jobs mais recentes da mesma pessoa', len(substituidos))
+            marcarJobsComoConcluidos([job['id'] for job in substituidos], 'Substituído por job mais recente da pessoa')
+        
+        logging.info('Processando %d jobs: %s', len(jobs), [job['id'] for job in jobs])
+        dados = buscarImagensJobs(jobs)
+        
+        # Lê as imagens do disco e converte para base64
+        pessoas, imagens, job_por_arquivo = [], [], {}
+        agora = int(time.time())
+        for job in jobs:
+            linha = dados.get(job['id'])
+            if not linha:
+                falhas[job['id']] = f'Pessoa ou arquivo não encontrado (pessoa: {job["idPessoa"]}, arquivo: {job["idArquivo"]})'
+                continue
+            imagem_base64 = lerImagemBase64(linha['pathLocal'], linha['pathNuvem'], job['idArquivo'])
+            if not imagem_base64:
+                falhas[job['id']] = 'Imagem não encontrada ou erro ao ler arquivo'
+                continue
+            pessoas.append({'id': job['idPessoa'], 'nome': linha['nome']})
+            imagens.append({'user_id': job['idPessoa'], 'timestamp': agora,
+                            'image': imagem_base64, 'arquivo_id': job['idArquivo']})
+            job_por_arquivo[int(job['idArquivo'])] = job
+        
+        if imagens:
+            # Busca leitores ativos
+            leitores = buscarLeitoresAtivos()
+            if not leitores:
+                for job in job_por_arquivo.values():
+                    falhas[job['id']] = 'Nenhum leitor ativo encontrado'
+            else:
+                # Cada leitor recebe só as imagens que ainda não tem
+                entregues = buscarEntregasConcluidas([job['id'] for job in job_por_arquivo.values()])
+                imagens_por_leitor = {
+                    leitor['id']: [
+                        img for img in imagens
+                        if leitor['id'] not in entregues.get(job_por_arquivo[int(img['arquivo_id'])]['id'], ())
+                    ]
+                    for leitor in leitores
+                }
+                destinos = [leitor for leitor in leitores if imagens_por_leitor[leitor['id']]]
+                
+                # Envia para os leitores ao mesmo tempo (ver fanout)
+                resultados = executarEmLeitores(destinos, enviarImagensLeitor, pessoas, imagens_por_leitor)
+                
+                # Resultado de todos os leitores gravado de uma vez em tblLeitorFoto e tblJobSyncLeitor
+                registros = []
+                entregas = []
+                pendentes = {arquivo_id: 0 for arquivo_id in job_por_arquivo}
+                erros = {arquivo_id: [] for arquivo_id in job_por_arquivo}
+                for resultado in resultados:
+                    leitor = resultado['leitor']
+                    envios = resultado['retorno'] or []
+                    registros.extend(registrosLeitorFoto(leitor, envios, 'Sincronizado via job'))
+                    por_arquivo = {int(envio['arquivo_id']): envio for envio in envios}
+                    for img in imagens_por_leitor[leitor['id']]:
+                        arquivo_id = int(img['arquivo_id'])
+                        envio = por_arquivo.get(arquivo_id)
+                        if envio and envio['sucesso']:
+                            status, mensagem = 'ENVIADO', None
+                        else:
+                            mensagem = (envio['mensagem'] if envio else resultado['erro']) or 'Erro desconhecido'
+                            # Imagem recusada pelo leitor não é reenviada
+                            status = 'RECUSADA' if envio and envio['recusada'] else 'FALHA'
+                            erros[arquivo_id].append(f'Leitor {leitor["nomeLeitor"]}: {mensagem}')
+                            if status == 'FALHA':
+                                pendentes[arquivo_id] += 1
+                        entregas.append((job_por_arquivo[arquivo_id]['id'], leitor['id'], status,
+                                         mensagem[:255] if mensagem else None))
+                registrarLeitorFotos(registros)
+                registrarEntregasJobs(entregas)
+                
+                for arquivo_id, job in job_por_arquivo.items():
+                    if erros[arquivo_id]:
+                        logging.error('Job %d: %s', job['id'], '; '.join(erros[arquivo_id][:3]))
+                    if pendentes[arquivo_id]:
+                        falhas[job['id']] = (f'Falha em {pendentes[arquivo_id]}/{len(leitores)} leitores. '
+                                             f'Erros: {"; ".join(erros[arquivo_id][:3])}')
         
     except Exception as e:
         mensagem = f'Erro ao processar job: {str(e)}'
-        marcarJobComoFalha(job_id, mensagem, job['tentativas'] + 1, job['maxTentativas'])
-        logging.error('Job %d - %s', job_id, mensagem)
-        return False
+        logging.error('Jobs %s - %s', [job['id'] for job in jobs], mensagem)
+        for job in jobs:
+            falhas.setdefault(job['id'], mensagem)
+    
+    # Marca resultado
+    concluidos = [job['id'] for job in jobs if job['id'] not in falhas]
+    marcarJobsComoConcluidos(concluidos)
+    for job in jobs:
+        if job['id'] in falhas:
+            marcarJobComoFalha(job['id'], falhas[job['id']], job['tentativas'], job['maxTentativas'])
+            logging.error('Job %d falhou: %s', job['id'], falhas[job['id']])
+    
+    return len(concluidos) + len(substituidos), len(falhas)
+
+class TrabalhadorJobs:
+    """
+    Trabalhador residente da fila tblJobSync: reserva lotes de até `lote`
+    jobs com reivindicarJobs conforme há vagas e processa até `concorrencia`
+    lotes ao mesmo tempo (ver processarJobs). Vários trabalhadores podem rodar
+    em paralelo, no mesmo host ou em hosts diferentes.
+    
+    Com `despertar`, o trabalhador também reserva jobs assim que recebe um
+    aviso de despertarJobs, sem esperar a consulta periódica.
+    """
+    
+    def __init__(self, concorrencia=JOBS_CONCORRENCIA, intervalo=JOBS_INTERVALO_CONSULTA, lote=JOBS_LOTE,
+                 processar=processarJobs, despertar=False):
+        self.concorrencia = concorrencia
+        self.intervalo = intervalo
+        self.lote = lote
+        self.processar = processar
+        self.despertar = despertar
+        self.processados = 0
+        self.sucessos = 0
+        self.falhas = 0
+        self._parar = threading.Event()
+        # Sinalizado quando um lote termina, chega um aviso ou o trabalhador é encerrado
+        self._evento = threading.Event()
+        self._em_andamento = {}
+    
+    def parar(self, *args):
+        """Encerra após concluir os jobs em andamento (também usado como handler de sinal)."""
+        if not self._parar.is_set():
+            logging.info('Encerrando trabalhador %s', TRABALHADOR)
+            self._parar.set()
+            self._evento.set()
+    
+    def executar(self, ate_esvaziar=False):
+        """
+        Laço principal do trabalhador.
+        
+        Args:
+            ate_esvaziar: Retorna quando a fila estiver vazia e não houver
+                jobs em andamento (em vez de continuar consultando)
+        """
+        logging.info('Trabalhador %s iniciado (concorrência %d, lotes de %d jobs)',
+                     TRABALHADOR, self.concorrencia, self.lote)
+        despertador = DespertadorJobs(self._evento) if self.despertar else None
+        try:
+            self._executar(ate_esvaziar)
+        finally:
+            if despertador:
+                despertador.fechar()
+        logging.info('Trabalhador %s finalizado: %d jobs (%d sucessos, %d falhas)',
+                     TRABALHADOR, self.processados, self.sucessos, self.falhas)
+    
+    def _executar(self, ate_esvaziar):
+        proxima_recuperacao = 0
+        with ThreadPoolExecutor(max_workers=self.concorrencia, thread_name_prefix='job') as executor:
+            while not self._parar.is_set():
+                if time.monotonic() >= proxima_recuperacao:
+                    recuperarJobsTravados()
+                    proxima_recuperacao = time.monotonic() + JOBS_INTERVALO_RECUPERACAO
+                
+                # Um lote por vaga livre, até a fila esvaziar
+                fila_vazia = False
+                while len(self._em_andamento) < self.concorrencia:
+                    jobs = reivindicarJobs(self.lote)
+                    if jobs:
+                        futuro = executor.submit(self.processar, jobs)
+                        self._em_andamento[futuro] = len(jobs)
+                        futuro.add_done_callback(lambda _: self._evento.set())
+                    if len(jobs) < self.lote:
+                        fila_vazia = True
+                        break
+                
+                if ate_esvaziar and fila_vazia and not self._em_andamento:
+                    break
+                # Fila vazia ou todas as vagas ocupadas: espera um lote terminar, um aviso ou o intervalo
+                self._aguardar()
+            
+            self._coletar(wait(list(self._em_andamento)).done)
+    
+    def _aguardar(self):
+        self._evento.wait(self.intervalo)
+        self._evento.clear()
+        # Avisos que chegarem daqui em diante são atendidos na próxima reserva
+        self._coletar([futuro for futuro in self._em_andamento if futuro.done()])
+    
+    def _coletar(self, concluidos):
+        for futuro in concluidos:
+            quantidade = self._em_andamento.pop(futuro)
+            try:
+                sucessos, falhas = futuro.result()
+            except Exception as e:
+                logging.error('Erro inesperado no processamento de jobs: %s', str(e))
+                sucessos, falhas = 0, quantidade
+            self.processados += sucessos + falhas
+            self.sucessos += sucessos
+            self.falhas += falhas
 
 def main():
     """Função principal"""
     parser = argparse.ArgumentParser(description='Processa jobs de sincronização de imagens')
     parser.add_argument('--limit', type=int, default=10, help='Número máximo de jobs a processar')
     parser.add_argument('--job-id', type=int, help='Processar apenas um job específico')
+    parser.add_argument('--daemon', action='store_true', help='Executa como trabalhador residente')
+    parser.add_argument('--despertar', action='store_true',
+                        help='Apenas avisa os trabalhadores residentes deste host de que há jobs novos')
+    parser.add_argument('--concorrencia', type=int, default=JOBS_CONCORRENCIA,
+                        help='Lotes processados ao mesmo tempo (com --daemon)')
+    parser.add_argument('--lote', type=int, default=JOBS_LOTE,
+                        help='Jobs reservados e enviados juntos (com --daemon)')
     args = parser.parse_args()
     
-    lock_file_path = '/tmp/processar_jobs_sync.lock'
+    if args.despertar:
+        avisados = despertarTrabalhadores()
+        print(json.dumps({'sucesso': avisados > 0, 'trabalhadores_avisados': avisados}))
+        return
+    
+    if args.daemon:
+        trabalhador = TrabalhadorJobs(concorrencia=args.concorrencia, lote=args.lote, despertar=True)
+        signal.signal(signal.SIGTERM, trabalhador.parar)
+        signal.signal(signal.SIGINT, trabalhador.parar)
+        try:
+            trabalhador.executar()
+        except Exception as e:
+            logging.error('Erro fatal: %s', str(e), exc_info=True)
+            sys.exit(1)
+        return
     
     try:
-        with file_lock(lock_file_path):
-            logging.info('='*60)
-            logging.info('INICIANDO PROCESSAMENTO DE JOBS')
-            logging.info('='*60)
-            
-            inicio = time.time()
-            
-            # Busca jobs pendentes
-            jobs = buscarJobsPendentes(limit=args.limit, job_id=args.job_id)
-            
-            if not jobs:
-                logging.info('Nenhum job pendente para processar')
-                print(json.dumps({'sucesso': True, 'jobs_processados': 0, 'mensagem': 'Nenhum job pendente'}))
-                return
-            
-            # Processa cada job
-            total_processados = 0
-            total_sucesso = 0
-            total_falha = 0
-            
-            for job in jobs:
-                logging.info('Processando job %d (tentativa %d/%d)', 
-                           job['id'], job['tentativas'] + 1, job['maxTentativas'])
-                
-                if processarJob(job):
-                    total_sucesso += 1
-                else:
-                    total_falha += 1
-                
-                total_processados += 1
-            
-            duracao = time.time() - inicio
-            
-            # Log final
-            logging.info('='*60)
-            logging.info('PROCESSAMENTO FINALIZADO')
-            logging.info('Jobs processados: %d', total_processados)
-            logging.info('Sucessos: %d', total_sucesso)
-            logging.info('Falhas: %d', total_falha)
-            logging.info('Duração: %.2f segundos', duracao)
-            logging.info('='*60)
-            
-            # Saída para o PHP
-            print(json.dumps({
-                'sucesso': True,
-                'jobs_processados': total_processados,
-                'sucessos': total_sucesso,
-                'falhas': total_falha,
-                'duracao_segundos': round(duracao, 2)
-            }, ensure_ascii=False))
-            
-    except IOError:
-        print(json.dumps({'sucesso': False, 'mensagem': 'Outro processo já está executando'}))
-        sys.exit(1)
+        logging.info('='*60)
+        logging.info('INICIANDO PROCESSAMENTO DE JOBS')
+        logging.info('='*60)
+        
+        inicio = time.time()
+        
+        # Reserva jobs pendentes (outros processos em execução pegam jobs diferentes)
+        jobs = reivindicarJobs(limit=args.limit, job_id=args.job_id)
+        
+        if not jobs:
+            logging.info('Nenhum job pendente para processar')
+            print(json.dumps({'sucesso': True, 'jobs_processados': 0, 'mensagem': 'Nenhum job pendente'}))
+            return
+        
+        total_sucesso, total_falha = processarJobs(jobs)
+        total_processados = total_sucesso + total_falha
+        
+        duracao = time.time() - inicio
+        
+        # Log final
+        logging.info('='*60)
+        logging.info('PROCESSAMENTO FINALIZADO')
+        logging.info('Jobs processados: %d', total_processados)
+        logging.info('Sucessos: %d', total_sucesso)
+        logging.info('Falhas: %d', total_falha)
+        logging.info('Duração: %.2f segundos', duracao)
+        logging.info('Latência por leitor: %s', json.dumps(estatisticasClientes()))
+        logging.info('Cache de imagens: %s', json.dumps(estatisticasImagens()))
+        logging.info('='*60)
+        
+        # Saída para o PHP
+        print(json.dumps({
+            'sucesso': True,
+            'jobs_processados': total_processados,
+            'sucessos': total_sucesso,
+            'falhas': total_falha,
+            'duracao_segundos': round(duracao, 2)
+        }, ensure_ascii=False))
+        
     except Exception as e:
         logging.error('Erro fatal: %s', str(e), exc_info=True)
         print(json.dumps({'sucesso': False, 'mensagem': f'Erro: {str(e)}'}))
@@ -528,4 +812,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
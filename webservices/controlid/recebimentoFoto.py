@@ -0,0 +1,261 @@
+"""
+Recebimento em streaming das fotos de acesso (/api/notifications/access_photo).
+
+O corpo JSON é lido em pedaços com request.stream(). O valor do campo
+access_photo é decodificado de base64 à medida que chega e gravado em um
+arquivo temporário, sem montar em memória nem o corpo nem a imagem. Os demais
+campos (device_id, user_id, event...) são pequenos e decodificados com json.
+"""
+import base64
+import binascii
+import json
+import os
+import re
+import uuid
+from config import FOTO_ACESSO_DIRETORIO_TEMPORARIO, FOTO_ACESSO_TAMANHO_MAXIMO, FOTO_ACESSO_TAMANHO_ESCRITA
+from db.execucaoAssincrona import executarBloqueante
+
+_ESPACOS = b' \t\r\n'
+_ASPAS, _BARRA, _VIRGULA = ord('"'), ord('\\'), ord(',')
+_ABRE, _FECHA = b'{[', b'}]'
+_FIM_SEGMENTO_FOTO = re.compile(rb'["\\]')
+
+
+class JSONInvalidoError(ValueError):
+    """O corpo da requisição não é um objeto JSON válido."""
+    pass
+
+
+class FotoInvalidaError(ValueError):
+    """A foto não é base64 válido ou excede FOTO_ACESSO_TAMANHO_MAXIMO."""
+    pass
+
+
+class DecodificadorFotoAcesso:
+    """
+    Parser incremental de um objeto JSON. O valor (string base64) do campo da
+    foto é entregue já decodificado à função escrever(bytes); os demais campos
+    ficam em self.campos.
+    """
+
+    def __init__(self, escrever, campo_foto='access_photo', limite_foto=FOTO_ACESSO_TAMANHO_MAXIMO, limite_campos=64 * 1024):
+        self._escrever = escrever
+        self._campo_foto = campo_foto
+        self._limite_foto = limite_foto
+        self._limite_campos = limite_campos
+        self._estado = 'INICIO'
+        self._chave = None
+        self._bruto = bytearray()
+        self._bytes_campos = 0
+        self._profundidade = 0
+        self._em_string = False
+        self._escape = False
+        self._resto_base64 = b''
+        self.campos = {}
+        self.bytes_foto = 0
+        self.iniciado = False
+
+    def alimentar(self, pedaco):
+        """Processa mais um pedaço do corpo da requisição."""
+        i = 0
+        n = len(pedaco)
+        while i < n:
+            if self._estado == 'FOTO':
+                i = self._lerFoto(pedaco, i)
+                continue
+
+            b = pedaco[i]
+            i += 1
+            if self._estado == 'CHAVE':
+                self._lerChave(b)
+            elif self._estado == 'VALOR':
+                self._lerValor(b)
+            elif b in _ESPACOS:
+                continue
+            elif self._estado == 'INICIO':
+                if b != _ABRE[0]:
+                    raise JSONInvalidoError('O corpo deve ser um objeto JSON')
+                self.iniciado = True
+                self._estado = 'ESPERA_CHAVE'
+            elif self._estado == 'ESPERA_CHAVE':
+                if b == _ASPAS:
+                    self._bruto = bytearray(b'"')
+                    self._estado = 'CHAVE'
+                elif b == _FECHA[0] and not self.campos and self._chave is None:
+                    self._estado = 'FIM'
+                else:
+                    raise JSONInvalidoError('Chave esperada')
+            elif self._estado == 'DOIS_PONTOS':
+                if b != ord(':'):
+                    raise JSONInvalidoError("':' esperado")
+                self._estado = 'ESPERA_VALOR'
+            elif self._estado == 'ESPERA_VALOR':
+                if self._chave == self._campo_foto and b == _ASPAS:
+                    self._estado = 'FOTO'
+                else:
+                    self._bruto = bytearray()
+                    self._profundidade = 0
+                    self._em_string = False
+                    self._estado = 'VALOR'
+                    self._lerValor(b)
+            elif self._estado == 'APOS_VALOR':
+                if b == _VIRGULA:
+                    self._estado = 'ESPERA_CHAVE'
+                elif b == _FECHA[0]:
+                    self._estado = 'FIM'
+                else:
+                    raise JSONInvalidoError("',' ou '}' esperado")
+            else:
+                raise JSONInvalidoError('Conteúdo após o fim do objeto JSON')
+
+    def finalizar(self):
+        """Confere se o objeto JSON terminou."""
+        if self._estado != 'FIM':
+            raise JSONInvalidoError('JSON incompleto')
+
+    def _acumular(self, b):
+        self._bruto.append(b)
+        self._bytes_campos += 1
+        if self._bytes_campos > self._limite_campos:
+            raise JSONInvalidoError('Campos da requisição excedem o limite')
+
+    def _lerChave(self, b):
+        self._acumular(b)
+        if self._escape:
+            self._escape = False
+        elif b == _BARRA:
+            self._escape = True
+        elif b == _ASPAS:
+            self._chave = self._decodificar()
+            self._estado = 'DOIS_PONTOS'
+
+    def _lerValor(self, b):
+        if self._em_string:
+            if self._escape:
+                self._escape = False
+            elif b == _BARRA:
+                self._escape = True
+            elif b == _ASPAS:
+                self._em_string = False
+        elif b == _ASPAS:
+            self._em_string = True
+        elif b in _ABRE:
+            self._profundidade += 1
+        elif b in _FECHA or b == _VIRGULA:
+            if self._profundidade == 0:
+                if b == _FECHA[1]:
+                    raise JSONInvalidoError("']' inesperado")
+                # Fim do valor: ',' passa para a próxima chave, '}' fecha o objeto
+                self.campos[self._chave] = self._decodificar()
+                self._estado = 'ESPERA_CHAVE' if b == _VIRGULA else 'FIM'
+                return
+            if b != _VIRGULA:
+                self._profundidade -= 1
+        self._acumular(b)
+
+    def _decodificar(self):
+        try:
+            return json.loads(self._bruto.decode('utf-8'))
+        except ValueError as e:
+            raise JSONInvalidoError(str(e))
+
+    def _lerFoto(self, pedaco, i):
+        """Consome a string base64 da foto a partir de pedaco[i]; retorna a nova posição."""
+        if self._escape:
+            # Escapes possíveis em base64 são só '\/' e quebras de linha
+            self._escape = False
+            b = pedaco[i]
+            if b == ord('/'):
+                self._base64(b'/')
+            elif b not in b'nrt':
+                raise FotoInvalidaError('Foto em base64 inválida')
+            return i + 1
+
+        m = _FIM_SEGMENTO_FOTO.search(pedaco, i)
+        fim = m.start() if m else len(pedaco)
+        if fim > i:
+            self._base64(pedaco[i:fim])
+        if m is None:
+            return fim
+        if pedaco[fim] == _ASPAS:
+            self._base64(b'', final=True)
+            self._estado = 'APOS_VALOR'
+        else:
+            self._escape = True
+        return fim + 1
+
+    def _base64(self, segmento, final=False):
+        dados = self._resto_base64 + bytes(segmento).translate(None, _ESPACOS)
+        if final:
+            dados += b'=' * (-len(dados) % 4)
+            corte = len(dados)
+        else:
+            corte = len(dados) - len(dados) % 4
+        self._resto_base64 = dados[corte:]
+        if not corte:
+            return
+        try:
+            decodificado = base64.b64decode(dados[:corte], validate=True)
+        except binascii.Error:
+            raise FotoInvalidaError('Foto em base64 inválida')
+        self.bytes_foto += len(decodificado)
+        if self.bytes_foto > self._limite_foto:
+            raise FotoInvalidaError(f'Foto excede o tamanho máximo de {self._limite_foto} bytes')
+        self._escrever(decodificado)
+
+
+def _abrirTemporario(caminho):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    return open(caminho, 'wb')
+
+
+def descartarTemporario(caminho):
+    """Remove o arquivo temporário, se ainda existir."""
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+
+async def receberFotoAcesso(request):
+    """
+    Lê o corpo da requisição em streaming e grava a foto decodificada em um
+    arquivo temporário em FOTO_ACESSO_DIRETORIO_TEMPORARIO.
+
+    Args:
+        request: Request do FastAPI/Starlette
+
+    Returns:
+        tuple: (campos, arquivo_temporario). campos é None se o corpo estiver
+        vazio; arquivo_temporario é None se a requisição não trouxe foto
+
+    Raises:
+        JSONInvalidoError: Corpo não é um objeto JSON válido
+        FotoInvalidaError: Foto não é base64 válido ou é grande demais
+    """
+    caminho = os.path.join(FOTO_ACESSO_DIRETORIO_TEMPORARIO, f'{uuid.uuid4().hex}.part')
+    pendente = bytearray()
+    decodificador = DecodificadorFotoAcesso(pendente.extend)
+
+    arquivo = await executarBloqueante('arquivo', _abrirTemporario, caminho)
+    try:
+        async for pedaco in request.stream():
+            decodificador.alimentar(pedaco)
+            if len(pendente) >= FOTO_ACESSO_TAMANHO_ESCRITA:
+                dados = bytes(pendente)
+                pendente.clear()
+                await executarBloqueante('arquivo', arquivo.write, dados)
+        if decodificador.iniciado:
+            decodificador.finalizar()
+        if pendente:
+            await executarBloqueante('arquivo', arquivo.write, bytes(pendente))
+        await executarBloqueante('arquivo', arquivo.close)
+    except BaseException:
+        arquivo.close()
+        descartarTemporario(caminho)
+        raise
+
+    if not decodificador.bytes_foto:
+        await executarBloqueante('arquivo', descartarTemporario, caminho)
+        caminho = None
+    return (decodificador.campos if decodificador.iniciado else None), caminho
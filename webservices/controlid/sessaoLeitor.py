@@ -0,0 +1,166 @@
+"""
+Sessões dos leitores Control iD, compartilhadas pelo processo.
+
+As sessões ficam em cache com validade conhecida (LEITOR_SESSAO_VALIDADE) e são
+renovadas com um novo login pouco antes de expirar, sem chamar
+session_is_valid.fcgi antes de cada operação. Se uma chamada for recusada por
+sessão inválida, a sessão é renovada e a chamada repetida uma única vez
+(sessaoLeitor(leitor).post(...)). As sessões novas são gravadas na tblLeitor em
+lote, ao fim do processo ou com persistirSessoes().
+"""
+import atexit
+import threading
+import time
+import requests
+from db.funcoes import updateLeitoresSession
+from webservices.controlid.clienteLeitor import clienteLeitor
+from config import LEITOR_SESSAO_VALIDADE, LEITOR_SESSAO_RENOVAR_ANTES, LEITOR_SESSAO_STATUS_INVALIDA
+from logging_config import get_config_leitor_logger
+
+# Obtém o logger configurado para este módulo
+logging = get_config_leitor_logger()
+
+
+class SessaoIndisponivelError(requests.exceptions.ConnectionError):
+    """Não foi possível obter uma sessão do leitor (login recusado ou sem conexão)."""
+    pass
+
+
+class GerenciadorSessoes:
+    """Cache de sessões por leitor, com renovação antecipada e gravação adiada."""
+
+    def __init__(self, validade=LEITOR_SESSAO_VALIDADE, renovar_antes=LEITOR_SESSAO_RENOVAR_ANTES):
+        self.validade = validade
+        self.renovar_antes = renovar_antes
+        self._sessoes = {}
+        self._pendentes = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _lockLeitor(self, leitor_id):
+        with self._lock:
+            return self._locks.setdefault(leitor_id, threading.Lock())
+
+    def obter(self, leitor):
+        """
+        Retorna uma sessão do leitor, sem consultar o leitor se a sessão em
+        cache ainda estiver dentro da validade.
+
+        Args:
+            leitor: Leitor (tblLeitor)
+
+        Returns:
+            str: Sessão ou None se o login falhar
+        """
+        item = self._sessoes.get(leitor['id'])
+        if item is None and leitor.get('session'):
+            # Sessão gravada no banco: usada até ser recusada ou perto de expirar
+            item = self._sessoes.setdefault(leitor['id'], (leitor['session'], time.monotonic()))
+        if item is not None:
+            session, obtida_em = item
+            if time.monotonic() - obtida_em < self.validade - self.renovar_antes:
+                leitor['session'] = session
+                return session
+        return self.renovar(leitor, item[0] if item else None)
+
+    def renovar(self, leitor, session_anterior=None):
+        """
+        Faz login no leitor e guarda a nova sessão. Se outra thread já
+        renovou a sessão (diferente de session_anterior), reaproveita a dela.
+
+        Returns:
+            str: Sessão ou None se o login falhar
+        """
+        with self._lockLeitor(leitor['id']):
+            item = self._sessoes.get(leitor['id'])
+            if item is not None and item[0] != session_anterior:
+                leitor['session'] = item[0]
+                return item[0]
+
+            session = self._login(leitor)
+            with self._lock:
+                if session:
+                    self._sessoes[leitor['id']] = (session, time.monotonic())
+                    self._pendentes[leitor['id']] = session
+                else:
+                    self._sessoes.pop(leitor['id'], None)
+            if session:
+                leitor['session'] = session
+            return session
+
+    @staticmethod
+    def _login(leitor):
+        try:
+            response = clienteLeitor(leitor).post(
+                "login.fcgi",
+                data={'login': leitor['usuario'], 'password': leitor['senha']},
+                timeout=5
+            )
+        except requests.exceptions.RequestException as e:
+            logging.error('Erro de conexão ao tentar logar no leitor %s: %s', leitor['nomeLeitor'], str(e))
+            return None
+        if response.status_code == 200:
+            logging.info('Sessão do leitor %s foi renovada com sucesso', leitor['nomeLeitor'])
+            return response.json().get('session')
+        logging.error('Falha ao logar no leitor facial %s: %s', leitor['nomeLeitor'], response.text)
+        return None
+
+    def persistir(self):
+        """Grava na tblLeitor, em um único comando, as sessões obtidas desde a última gravação."""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, {}
+        if not pendentes:
+            return
+        try:
+            updateLeitoresSession(pendentes)
+        except Exception as e:
+            logging.error('Erro ao gravar as sessões de %d leitores: %s', len(pendentes), e)
+            with self._lock:
+                for leitor_id, session in pendentes.items():
+                    self._pendentes.setdefault(leitor_id, session)
+
+
+gerenciador_sessoes = GerenciadorSessoes()
+atexit.register(gerenciador_sessoes.persistir)
+
+
+class ClienteAutenticado:
+    """Chamadas a um leitor com a sessão atual anexada e uma nova tentativa se ela for recusada."""
+
+    def __init__(self, leitor):
+        self.leitor = leitor
+
+    def get(self, caminho, **kwargs):
+        return self.requisicao('GET', caminho, **kwargs)
+
+    def post(self, caminho, **kwargs):
+        return self.requisicao('POST', caminho, **kwargs)
+
+    def requisicao(self, metodo, caminho, **kwargs):
+        """
+        Faz a requisição com ?session=... da sessão em cache.
+
+        Raises:
+            SessaoIndisponivelError: Login recusado ou leitor sem conexão
+            requests.exceptions.RequestException: Erro de comunicação
+        """
+        session = gerenciador_sessoes.obter(self.leitor)
+        for tentativa in range(2):
+            if not session:
+                raise SessaoIndisponivelError(f'Falha ao logar no leitor {self.leitor["nomeLeitor"]}')
+            separador = '&' if '?' in caminho else '?'
+            response = clienteLeitor(self.leitor).requisicao(metodo, f"{caminho}{separador}session={session}", **kwargs)
+            if response.status_code not in LEITOR_SESSAO_STATUS_INVALIDA or tentativa:
+                return response
+            logging.info('Sessão recusada pelo leitor %s, renovando', self.leitor['nomeLeitor'])
+            session = gerenciador_sessoes.renovar(self.leitor, session)
+
+
+def sessaoLeitor(leitor):
+    """Retorna um cliente do leitor que cuida da sessão (ver ClienteAutenticado)."""
+    return ClienteAutenticado(leitor)
+
+
+def persistirSessoes():
+    """Grava as sessões novas na tblLeitor (também executado ao fim do processo)."""
+    gerenciador_sessoes.persistir()
@@ -4,15 +4,25 @@ import time
 import os
 import fcntl
 import signal
-import base64
-from threading import Thread
 from contextlib import contextmanager
+from datetime import datetime, timedelta
 from db.funcoes import (
     findLeitores,
+    updateLeitorSincronizacaoImagens,
 )
 from db import conectarBancoEvento
 from webservices.controlid.configurarLeitor import isSessionValid
-from config import SISTEMA_GERENCIAMENTO
+from webservices.controlid.usuariosLeitor import garantirUsuarios
+from webservices.controlid.imagensLeitor import lerImagemBase64, imagemDisponivel, estatisticasImagens
+from webservices.controlid.loteAdaptativo import enviarLotesAdaptativos, registrarResultadosImagens
+from webservices.controlid.pipeline import estagio
+from webservices.controlid.fanout import executarEmLeitores, Cancelamento, OperacaoCancelada
+from config import (
+    SINCRONIZACAO_IMAGENS_MARGEM,
+    PIPELINE_LINHAS_BLOCO,
+    PIPELINE_FILA_LINHAS,
+    PIPELINE_FILA_IMAGENS,
+)
 from logging_config import get_sincronizar_imagens_logger
 
 # Obtém o logger configurado para este módulo
@@ -21,43 +31,6 @@ logging = get_sincronizar_imagens_logger()
 # Timeout global para evitar que o script fique travado (em segundos)
 TIMEOUT_GLOBAL = 160  # 2min 40seg (antes dos 3 minutos do cron)
 
-def lerImagemBase64(pathLocal, pathNuvem=None):
-    """
-    Lê uma imagem do disco ou nuvem e retorna em base64.
-    
-    Args:
-        pathLocal: Caminho local da imagem (ex: /midia/pessoas/5/imagens/avatar/...)
-        pathNuvem: URL da nuvem (se disponível)
-        
-    Returns:
-        str: Imagem em base64 ou None se não encontrada
-    """
-    try:
-        # Se tem pathNuvem, retorna diretamente (já está em base64)
-        if pathNuvem:
-            return pathNuvem
-        
-        # Se tem pathLocal, lê do disco
-        if pathLocal:
-            # Monta o caminho completo
-            caminho_completo = os.path.join(SISTEMA_GERENCIAMENTO, pathLocal.lstrip('/'))
-            
-            if not os.path.exists(caminho_completo):
-                logging.error('Arquivo não encontrado: %s', caminho_completo)
-                return None
-            
-            # Lê o arquivo e converte para base64
-            with open(caminho_completo, 'rb') as f:
-                imagem_bytes = f.read()
-                imagem_base64 = base64.b64encode(imagem_bytes).decode('utf-8')
-                return imagem_base64
-        
-        return None
-        
-    except Exception as e:
-        logging.error('Erro ao ler imagem: %s', str(e))
-        return None
-
 class TimeoutError(Exception):
     """Exceção levantada quando o timeout é atingido"""
     pass
@@ -95,10 +68,129 @@ def file_lock(lock_path, timeout=5):
             except Exception as e:
                 logging.error('Erro ao liberar o lock: %s', str(e))
 
-def sincronizarImagens():
+# Marca d'água usada quando o leitor nunca foi sincronizado (envia tudo)
+DATA_SEM_SINCRONIZACAO = datetime(1970, 1, 1)
+
+# Imagem mais recente (AVATAR) de cada pessoa com credencial ativa, restrita às
+# pessoas cujo avatar, credencial ou cadastro mudou desde a marca d'água, e que
+# ainda não foi sincronizada com o leitor
+SQL_IMAGENS_ALTERADAS = """
+    WITH alteradas AS (
+        SELECT a.idReferencia AS idPessoa
+          FROM tblArquivo a
+         WHERE a.tipoReferencia = 'PESSOA' AND a.tipoArquivo = 'AVATAR' AND a.dataCadastro > %(desde)s
+        UNION
+        SELECT c.idPessoa FROM tblCredencial c WHERE c.dataEdicao > %(desde)s
+        UNION
+        SELECT p.id FROM tblPessoa p WHERE p.dataEdicao > %(desde)s
+    ),
+    ultimas AS (
+        SELECT a.id, p.id AS idPessoa, p.nome, a.pathLocal, a.pathNuvem,
+               ROW_NUMBER() OVER (PARTITION BY p.id ORDER BY a.dataCadastro DESC, a.id DESC) AS ordem
+          FROM alteradas x
+          JOIN tblPessoa p ON p.id = x.idPessoa AND p.status = 'T'
+          JOIN tblArquivo a
+            ON a.idReferencia = p.id AND a.tipoReferencia = 'PESSOA' AND a.tipoArquivo = 'AVATAR'
+         WHERE EXISTS (SELECT 1 FROM tblCredencial c WHERE c.idPessoa = p.id AND c.status = 'T')
+    )
+    SELECT u.id, u.idPessoa, u.nome, u.pathLocal, u.pathNuvem
+      FROM ultimas u
+     WHERE u.ordem = 1
+       AND NOT EXISTS (
+           SELECT 1 FROM tblLeitorFoto lf
+            WHERE lf.idArquivo = u.id AND lf.idLeitor = %(leitor)s AND lf.status = 1
+       )
+"""
+
+def buscarImagensAlteradas(leitor, session, desde, estado):
+    """
+    Estágio do banco: lê as imagens a enviar para o leitor em uma consulta
+    (liberando a conexão em seguida) e as percorre em blocos de
+    PIPELINE_LINHAS_BLOCO linhas; a cada bloco, cadastra no leitor os
+    usuários que faltam (ver usuariosLeitor).
+    
+    Args:
+        leitor: Leitor (tblLeitor)
+        session: Sessão válida do leitor
+        desde: Marca d'água da última sincronização completa do leitor
+        estado: dict atualizado com o total de 'linhas' e os 'erros' de cadastro
+        
+    Yields:
+        dict: Linhas com id (arquivo), idPessoa, nome, pathLocal e pathNuvem
+        cuja imagem existe e cuja pessoa está cadastrada no leitor
+    """
+    # Só as linhas (caminhos, não as imagens) são lidas de uma vez: a conexão
+    # volta ao pool antes das chamadas ao leitor e dos envios do pipeline
+    conn = conectarBancoEvento()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(SQL_IMAGENS_ALTERADAS, {'desde': desde, 'leitor': leitor['id']})
+        todas = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+    
+    for inicio in range(0, len(todas), PIPELINE_LINHAS_BLOCO):
+        linhas = todas[inicio:inicio + PIPELINE_LINHAS_BLOCO]
+        estado['linhas'] += len(linhas)
+        
+        disponiveis = []
+        for linha in linhas:
+            if imagemDisponivel(linha['pathLocal'], linha['pathNuvem']):
+                disponiveis.append(linha)
+            else:
+                logging.warning('Imagem não encontrada para pessoa %s (arquivo %s)', linha['idPessoa'], linha['id'])
+        
+        try:
+            cadastrados, erros = garantirUsuarios(
+                leitor, session, [{'id': l['idPessoa'], 'nome': l['nome']} for l in disponiveis]
+            )
+        except requests.exceptions.RequestException as e:
+            logging.error('Erro ao verificar/criar usuários no leitor %s: %s', leitor['nomeLeitor'], str(e))
+            raise
+        estado['erros'].extend(erros)
+        
+        for linha in disponiveis:
+            if int(linha['idPessoa']) in cadastrados:
+                yield linha
+
+def lerImagensAlteradas(linhas):
+    """
+    Estágio do disco: lê e codifica (com cache) a imagem de cada linha.
+    
+    Yields:
+        dict: user_id, timestamp, image (base64) e arquivo_id
+    """
+    try:
+        for linha in linhas:
+            imagem_base64 = lerImagemBase64(linha['pathLocal'], linha['pathNuvem'], linha['id'])
+            if not imagem_base64:
+                continue
+            yield {
+                'user_id': linha['idPessoa'],
+                'timestamp': int(time.time()),
+                'image': imagem_base64,
+                'arquivo_id': linha['id']
+            }
+    finally:
+        linhas.close()
+
+def atualizarMarcaSincronizacao(leitor, inicio_sincronizacao):
+    """
+    Avança a marca d'água do leitor para o início desta sincronização, com uma
+    margem para alterações gravadas em transações ainda abertas naquele momento.
+    """
+    marca = inicio_sincronizacao - timedelta(seconds=SINCRONIZACAO_IMAGENS_MARGEM)
+    updateLeitorSincronizacaoImagens(leitor['id'], marca)
+    leitor['dataSincronizacaoImagens'] = marca
+
+def sincronizarImagens(cancelamento=None):
     """
     Sincroniza imagens de todas as pessoas com credenciais ativas para todos os leitores.
     Executa uma única vez e retorna.
+
+    Args:
+        cancelamento: Cancelamento que interrompe todos os leitores (ex.: prazo do Agendador)
     """
     print("Sincronizando imagens")
     leitores = findLeitores()
@@ -107,36 +199,42 @@ def sincronizarImagens():
         logging.info('Nenhum leitor facial encontrado para sincronização')
         return
     
-    threads = []
+    ativos = []
     for leitor in leitores:
         if leitor.get('status') == 'T' and leitor.get('configurado') == 'T':
-            thread = Thread(target=sincronizarImagensLeitor, args=(leitor,))
-            thread.daemon = True
-            thread.start()
-            threads.append(thread)
-            logging.info('Thread de sincronização iniciada para o leitor %s', leitor['nomeLeitor'])
+            ativos.append(leitor)
         else:
             print(f"Leitor {leitor['nomeLeitor']} ignorado (status={leitor.get('status')}, configurado={leitor.get('configurado')})")
             logging.info('Leitor %s ignorado (status=%s, configurado=%s)', 
                         leitor['nomeLeitor'], leitor.get('status'), leitor.get('configurado'))
-            
-    print(f"Threads iniciadas: {threads}")
     
-    # Aguarda todas as threads completarem (com timeout de segurança)
-    for thread in threads:
-        thread.join(timeout=100)  # Timeout de 100 segundos por thread
-        if thread.is_alive():
-            logging.error('Thread de sincronização para um leitor não finalizou no tempo esperado')
+    # Todos os leitores ao mesmo tempo, com threads e prazo limitados (ver fanout)
+    logging.info('Sincronizando %d leitores', len(ativos))
+    resultados = executarEmLeitores(ativos, sincronizarImagensLeitor, cancelamento=cancelamento)
+    
+    for resultado in resultados:
+        if not resultado['sucesso']:
+            logging.error('Sincronização do leitor %s não concluída em %.1fs: %s',
+                          resultado['leitor']['nomeLeitor'], resultado['duracao'], resultado['erro'] or 'falha')
     
-    logging.info('Todas as threads de sincronização finalizadas.')
+    logging.info('Sincronização finalizada para %d leitores.', len(resultados))
 
-def sincronizarImagensLeitor(leitor, max_retries=3, retry_delay=5):
+def sincronizarImagensLeitor(leitor, max_retries=3, retry_delay=5, cancelamento=None):
     """
     Sincroniza imagens de um leitor específico (execução única).
+    
+    Args:
+        leitor: Leitor (tblLeitor)
+        cancelamento: Cancelamento do fan-out; interrompe entre tentativas e lotes
+    
+    Raises:
+        OperacaoCancelada: Se a sincronização foi cancelada ou excedeu o prazo
     """
+    cancelamento = cancelamento or Cancelamento()
     logging.info('Iniciando sincronização para o leitor %s', leitor['nomeLeitor'])
     
     for attempt in range(max_retries):
+        cancelamento.verificar()
         try:
             # Verifica se a sessão é válida
             session = isSessionValid(leitor)
@@ -144,7 +242,7 @@ def sincronizarImagensLeitor(leitor, max_retries=3, retry_delay=5):
                 logging.error('Sessão inválida para o leitor %s (tentativa %d/%d)', 
                             leitor['nomeLeitor'], attempt + 1, max_retries)
                 if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
+                    cancelamento.aguardar(retry_delay)
                     continue
                 else:
                     return False
@@ -152,125 +250,47 @@ def sincronizarImagensLeitor(leitor, max_retries=3, retry_delay=5):
             # Atualiza a sessão no objeto leitor
             leitor['session'] = session
             
-            # Busca pessoas com credenciais ativas que precisam sincronizar imagens
             conn = conectarBancoEvento()
             cursor = conn.cursor(dictionary=True)
-            
-            # Query para encontrar pessoas com credenciais ativas
-            cursor.execute("""
-                SELECT DISTINCT p.id, p.nome
-                FROM tblPessoa p
-                INNER JOIN tblCredencial c ON p.id = c.idPessoa
-                WHERE c.status = 'T' AND p.status = 'T'
-            """)
-            pessoas = cursor.fetchall()
-            
-            if not pessoas:
-                logging.info('Nenhuma pessoa com credencial ativa encontrada para o leitor %s', leitor['nomeLeitor'])
+            try:
+                cursor.execute("SELECT NOW() AS agora")
+                inicio_sincronizacao = cursor.fetchone()['agora']
+            finally:
                 cursor.close()
                 conn.close()
-                return True
-            
-            user_images = []
             
-            for pessoa in pessoas:
-                # Busca a imagem mais recente da pessoa que não foi sincronizada com este leitor
-                cursor.execute("""
-                    SELECT a.id, a.pathLocal, a.pathNuvem
-                    FROM tblArquivo a
-                    WHERE a.idReferencia = %s 
-                    AND a.tipoReferencia = 'PESSOA'
-                    AND a.tipoArquivo = 'AVATAR'
-                    AND NOT EXISTS (
-                        SELECT 1 
-                        FROM tblLeitorFoto lf 
-                        WHERE lf.idArquivo = a.id 
-                        AND lf.idLeitor = %s 
-                        AND lf.status = 1
-                    )
-                    ORDER BY a.dataCadastro DESC 
-                    LIMIT 1
-                """, (pessoa['id'], leitor['id']))
-                
-                arquivo = cursor.fetchone()
-                
-                if arquivo:
-                    # Lê a imagem do disco e converte para base64
-                    imagem_base64 = lerImagemBase64(arquivo['pathLocal'], arquivo['pathNuvem'])
-                    
-                    if not imagem_base64:
-                        logging.warning('Imagem não encontrada para pessoa %s (arquivo %s)', pessoa['id'], arquivo['id'])
-                        continue
-                    
-                    # Verifica se o usuário existe no leitor, se não, cria
-                    try:
-                        user_exists_response = requests.post(
-                            f"http://{leitor['ip']}/load_objects.fcgi?session={session}",
-                            json={
-                                'object': 'users',
-                                'where': [{'object': 'users', 'field': 'id', 'operator': '=', 'value': pessoa['id']}]
-                            },
-                            headers={'Content-Type': 'application/json'},
-                            timeout=5
-                        )
-                        
-                        if user_exists_response.status_code == 200:
-                            users = user_exists_response.json().get('users', [])
-                            if not users:
-                                # Cria o usuário no leitor
-                                create_user_response = requests.post(
-                                    f"http://{leitor['ip']}/create_objects.fcgi?session={session}",
-                                    json={
-                                        'object': 'users',
-                                        'values': [{
-                                            'id': pessoa['id'], 
-                                            'registration': str(pessoa['id']), 
-                                            'name': pessoa['nome']
-                                        }]
-                                    },
-                                    headers={'Content-Type': 'application/json'},
-                                    timeout=5
-                                )
-                                
-                                if create_user_response.status_code != 200:
-                                    logging.error('Falha ao criar usuário %s no leitor %s: %s', 
-                                                pessoa['id'], leitor['nomeLeitor'], create_user_response.text)
-                                    continue
-                                else:
-                                    logging.info('Usuário %s criado no leitor %s', pessoa['nome'], leitor['nomeLeitor'])
-                        
-                        # Adiciona à lista para envio
-                        user_images.append({
-                            'user_id': pessoa['id'],
-                            'timestamp': int(time.time()),
-                            'image': imagem_base64,
-                            'arquivo_id': arquivo['id']
-                        })
-                        
-                    except requests.exceptions.RequestException as e:
-                        logging.error('Erro ao verificar/criar usuário %s no leitor %s: %s', 
-                                    pessoa['id'], leitor['nomeLeitor'], str(e))
-                        continue
+            # Só as imagens alteradas desde a última sincronização completa do
+            # leitor (marca d'água em tblLeitor.dataSincronizacaoImagens), em
+            # pipeline: banco -> disco -> envio, com filas limitadas entre as etapas
+            desde = leitor.get('dataSincronizacaoImagens') or DATA_SEM_SINCRONIZACAO
+            estado = {'linhas': 0, 'erros': []}
+            linhas = estagio(buscarImagensAlteradas(leitor, session, desde, estado),
+                             PIPELINE_FILA_LINHAS, f'delta-leitor-{leitor["id"]}')
+            imagens = estagio(lerImagensAlteradas(linhas), PIPELINE_FILA_IMAGENS, f'imagens-leitor-{leitor["id"]}')
+            try:
+                completo = enviarImagensEmLotes(leitor, session, imagens, cancelamento=cancelamento)
+            finally:
+                imagens.close()
+            completo = completo and not estado['erros']
             
-            cursor.close()
-            conn.close()
+            if not estado['linhas']:
+                logging.info('Nenhuma imagem alterada desde %s para o leitor %s', desde, leitor['nomeLeitor'])
             
-            # Envia as imagens em lotes
-            if user_images:
-                logging.info('Enviando %d imagens para o leitor %s', len(user_images), leitor['nomeLeitor'])
-                enviarImagensEmLotes(leitor, session, user_images)
-            else:
-                logging.info('Nenhuma imagem nova para sincronizar com o leitor %s', leitor['nomeLeitor'])
+            # A marca só avança quando tudo foi enviado; as falhas voltam no próximo delta
+            if completo:
+                atualizarMarcaSincronizacao(leitor, inicio_sincronizacao)
             
             # Sincronização concluída com sucesso
             logging.info('Sincronização concluída para o leitor %s', leitor['nomeLeitor'])
             return True
             
+        except OperacaoCancelada:
+            raise
         except Exception as e:
             logging.error('Erro inesperado na sincronização do leitor %s (tentativa %d/%d): %s', 
                         leitor['nomeLeitor'], attempt + 1, max_retries, str(e))
             if attempt < max_retries - 1:
-                time.sleep(retry_delay)
+                cancelamento.aguardar(retry_delay)
                 continue
             else:
                 logging.error('Falha na sincronização do leitor %s após %d tentativas', 
@@ -279,142 +299,28 @@ def sincronizarImagensLeitor(leitor, max_retries=3, retry_delay=5):
     
     return False
 
-def enviarImagensEmLotes(leitor, session, user_images, batch_size=2 * 1024 * 1024):
+def enviarImagensEmLotes(leitor, session, user_images, cancelamento=None):
     """
-    Envia imagens em lotes para não exceder o tamanho máximo da requisição.
-    """
-    current_batch = []
-    current_size = 0
+    Envia as imagens em lotes de tamanho adaptativo (ver loteAdaptativo) e
+    registra o resultado de cada lote em tblLeitorFoto assim que ele termina.
     
-    for image_data in user_images:
-        # Calcula o tamanho da imagem
-        image_size = len(image_data['image'].encode('utf-8')) if image_data['image'] else 0
-        
-        # Se adicionar esta imagem ultrapassar o tamanho do lote, envia o lote atual
-        if current_size + image_size > batch_size and current_batch:
-            enviarLote(leitor, session, current_batch)
-            current_batch = []
-            current_size = 0
-        
-        current_batch.append(image_data)
-        current_size += image_size
+    Args:
+        user_images: Lista ou gerador de imagens (consumido à medida que os lotes são montados)
+        cancelamento: Se informado, é verificado antes de cada lote
     
-    # Envia o último lote se houver imagens restantes
-    if current_batch:
-        enviarLote(leitor, session, current_batch)
-
-def enviarLote(leitor, session, batch, max_retries=3, retry_delay=5):
-    """
-    Envia um lote de imagens para o leitor facial.
+    Returns:
+        bool: True se todas as imagens foram aceitas ou recusadas pelo próprio
+        leitor (imagem inválida); False se alguma não chegou ao leitor
     """
-    conn = None
-    cursor = None
-    
-    try:
-        conn = conectarBancoEvento()
-        cursor = conn.cursor()
-        
-        for attempt in range(max_retries):
-            try:
-                # Verifica se a sessão ainda é válida
-                session_check = isSessionValid(leitor)
-                if not session_check:
-                    logging.error('Sessão inválida ao enviar lote para o leitor %s', leitor['nomeLeitor'])
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    else:
-                        break
-                
-                session = session_check
-                
-                # Prepara o payload para envio
-                payload = {
-                    'match': False,
-                    'user_images': [
-                        {
-                            'user_id': img['user_id'],
-                            'timestamp': img['timestamp'],
-                            'image': img['image']
-                        } 
-                        for img in batch
-                    ]
-                }
-                
-                # Envia as imagens
-                response = requests.post(
-                    f"http://{leitor['ip']}/user_set_image_list.fcgi?session={session}",
-                    json=payload,
-                    headers={'Content-Type': 'application/json'},
-                    timeout=90
-                )
-                
-                # Registra o resultado de cada imagem
-                for image_data in batch:
-                    sucesso = response.status_code == 200
-                    
-                    if sucesso:
-                        mensagem = "Imagem sincronizada com sucesso"
-                        status = 1
-                    else:
-                        mensagem = f"Falha ao sincronizar: {response.text[:200]}"
-                        status = 0
-                    
-                    # Registra na tabela tblLeitorFoto
-                    cursor.execute("""
-                        INSERT INTO tblLeitorFoto (idEvento, idLeitor, idArquivo, status, mensagem, dataCadastro)
-                        VALUES (%s, %s, %s, %s, %s, NOW())
-                    """, (
-                        leitor['idEvento'],
-                        leitor['id'],
-                        image_data['arquivo_id'],
-                        status,
-                        mensagem
-                    ))
-                
-                conn.commit()
-                
-                if response.status_code == 200:
-                    logging.info('Lote de %d imagens enviado com sucesso para o leitor %s', 
-                               len(batch), leitor['nomeLeitor'])
-                    break
-                else:
-                    logging.error('Falha ao enviar lote para o leitor %s: %s', 
-                                leitor['nomeLeitor'], response.text)
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    
-            except requests.exceptions.RequestException as e:
-                logging.error('Erro de requisição ao enviar lote para o leitor %s (tentativa %d/%d): %s', 
-                            leitor['nomeLeitor'], attempt + 1, max_retries, str(e))
-                
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    # Registra falha para todas as imagens do lote
-                    for image_data in batch:
-                        cursor.execute("""
-                            INSERT INTO tblLeitorFoto (idEvento, idLeitor, idArquivo, status, mensagem, dataCadastro)
-                            VALUES (%s, %s, %s, %s, %s, NOW())
-                        """, (
-                            leitor['idEvento'],
-                            leitor['id'],
-                            image_data['arquivo_id'],
-                            0,
-                            f"Erro na requisição: {str(e)[:200]}"
-                        ))
-                    conn.commit()
-                    
-    except Exception as e:
-        logging.error('Erro inesperado ao enviar lote para o leitor %s: %s', leitor['nomeLeitor'], str(e))
-        
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    completo = True
+    total = 0
+    for resultados in enviarLotesAdaptativos(leitor, user_images, cancelamento=cancelamento):
+        registrarResultadosImagens(leitor, resultados, "Imagem sincronizada com sucesso")
+        completo = completo and all(r['sucesso'] or r['recusada'] for r in resultados)
+        total += len(resultados)
+    if total:
+        logging.info('%d imagens processadas para o leitor %s', total, leitor['nomeLeitor'])
+    return completo
 
 # Execução principal com lock e timeout para evitar travamentos
 if __name__ == '__main__':
@@ -434,6 +340,7 @@ if __name__ == '__main__':
             
             duracao = time.time() - inicio
             logging.info('Sincronização finalizada com sucesso em %.2f segundos', duracao)
+            logging.info('Cache de imagens: %s', estatisticasImagens())
             
             # Cancela o alarme se terminou antes do timeout
             signal.alarm(0)
@@ -19,52 +19,16 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
 
 import requests
 import time
-import base64
 from db import conectarBancoEvento
-from webservices.controlid.configurarLeitor import isSessionValid, login
-from config import SISTEMA_GERENCIAMENTO
+from webservices.controlid.configurarLeitor import isSessionValid
+from webservices.controlid.usuariosLeitor import garantirUsuarios
+from webservices.controlid.imagensLeitor import lerImagemBase64
+from webservices.controlid.loteAdaptativo import enviarImagensAdaptativo, registrarResultadosImagens
 from logging_config import get_logger
 
 # Obtém o logger configurado para este módulo
 logging = get_logger('SincronizarLeitor', arquivo_log='logSincronizarLeitor.log')
 
-def lerImagemBase64(pathLocal, pathNuvem=None):
-    """
-    Lê uma imagem do disco ou nuvem e retorna em base64.
-    
-    Args:
-        pathLocal: Caminho local da imagem (ex: /midia/pessoas/5/imagens/avatar/...)
-        pathNuvem: URL da nuvem (se disponível)
-        
-    Returns:
-        str: Imagem em base64 ou None se não encontrada
-    """
-    try:
-        # Se tem pathNuvem, retorna diretamente (já está em base64)
-        if pathNuvem:
-            return pathNuvem
-        
-        # Se tem pathLocal, lê do disco
-        if pathLocal:
-            # Monta o caminho completo
-            caminho_completo = os.path.join(SISTEMA_GERENCIAMENTO, pathLocal.lstrip('/'))
-            
-            if not os.path.exists(caminho_completo):
-                logging.error('Arquivo não encontrado: %s', caminho_completo)
-                return None
-            
-            # Lê o arquivo e converte para base64
-            with open(caminho_completo, 'rb') as f:
-                imagem_bytes = f.read()
-                imagem_base64 = base64.b64encode(imagem_bytes).decode('utf-8')
-                return imagem_base64
-        
-        return None
-        
-    except Exception as e:
-        logging.error('Erro ao ler imagem: %s', str(e))
-        return None
-
 def buscarLeitor(leitor_id):
     """
     Busca informações de um leitor específico pelo ID.
@@ -76,18 +40,15 @@ def buscarLeitor(leitor_id):
         dict: Dados do leitor ou None se não encontrado
     """
     try:
-        conn = conectarBancoEvento()
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT * FROM tblLeitor 
-            WHERE id = %s
-            LIMIT 1
-        """, (leitor_id,))
-        
-        leitor = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with conectarBancoEvento() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT * FROM tblLeitor 
+                WHERE id = %s
+                LIMIT 1
+            """, (leitor_id,))
+            leitor = cursor.fetchone()
+            cursor.close()
         
         if leitor:
             logging.info('Leitor encontrado: %s (IP: %s)', leitor['nomeLeitor'], leitor['ip'])
@@ -158,114 +119,83 @@ def sincronizarLeitorForcado(leitor_id, max_retries=3, retry_delay=5):
             leitor['session'] = session
             
             # Busca TODAS as pessoas com credenciais ativas
-            conn = conectarBancoEvento()
-            cursor = conn.cursor(dictionary=True)
+            with conectarBancoEvento() as conn:
+                cursor = conn.cursor(dictionary=True)
             
-            cursor.execute("""
-                SELECT DISTINCT p.id, p.nome
-                FROM tblPessoa p
-                INNER JOIN tblCredencial c ON p.id = c.idPessoa
-                WHERE c.status = 'T' AND p.status = 'T'
-                ORDER BY p.nome
-            """)
-            pessoas = cursor.fetchall()
+                cursor.execute("""
+                    SELECT DISTINCT p.id, p.nome
+                    FROM tblPessoa p
+                    INNER JOIN tblCredencial c ON p.id = c.idPessoa
+                    WHERE c.status = 'T' AND p.status = 'T'
+                    ORDER BY p.nome
+                """)
+                pessoas = cursor.fetchall()
             
-            if not pessoas:
-                resultado['sucesso'] = True
-                resultado['mensagem'] = 'Nenhuma pessoa com credencial ativa encontrada'
-                logging.info(resultado['mensagem'])
-                cursor.close()
-                conn.close()
-                return resultado
+                if not pessoas:
+                    resultado['sucesso'] = True
+                    resultado['mensagem'] = 'Nenhuma pessoa com credencial ativa encontrada'
+                    logging.info(resultado['mensagem'])
+                    cursor.close()
+                    return resultado
             
-            resultado['total_pessoas'] = len(pessoas)
-            logging.info('Encontradas %d pessoas com credenciais ativas', len(pessoas))
+                resultado['total_pessoas'] = len(pessoas)
+                logging.info('Encontradas %d pessoas com credenciais ativas', len(pessoas))
             
-            user_images = []
+                candidatos = []
             
-            for pessoa in pessoas:
-                # Busca a imagem mais recente (IGNORA se já foi sincronizada)
-                cursor.execute("""
-                    SELECT a.id, a.pathLocal, a.pathNuvem
-                    FROM tblArquivo a
-                    WHERE a.idReferencia = %s 
-                    AND a.tipoReferencia = 'PESSOA'
-                    AND a.tipoArquivo = 'AVATAR'
-                    ORDER BY a.dataCadastro DESC 
-                    LIMIT 1
-                """, (pessoa['id'],))
+                for pessoa in pessoas:
+                    # Busca a imagem mais recente (IGNORA se já foi sincronizada)
+                    cursor.execute("""
+                        SELECT a.id, a.pathLocal, a.pathNuvem
+                        FROM tblArquivo a
+                        WHERE a.idReferencia = %s 
+                        AND a.tipoReferencia = 'PESSOA'
+                        AND a.tipoArquivo = 'AVATAR'
+                        ORDER BY a.dataCadastro DESC 
+                        LIMIT 1
+                    """, (pessoa['id'],))
                 
-                arquivo = cursor.fetchone()
+                    arquivo = cursor.fetchone()
                 
-                if arquivo:
-                    # Lê a imagem do disco e converte para base64
-                    imagem_base64 = lerImagemBase64(arquivo['pathLocal'], arquivo['pathNuvem'])
+                    if arquivo:
+                        # Lê a imagem do disco e converte para base64
+                        imagem_base64 = lerImagemBase64(arquivo['pathLocal'], arquivo['pathNuvem'], arquivo['id'])
                     
-                    if not imagem_base64:
-                        erro = f'Imagem não encontrada para pessoa {pessoa["nome"]} (arquivo {arquivo["id"]})'
-                        logging.warning(erro)
-                        resultado['erros'].append(erro)
-                        continue
+                        if not imagem_base64:
+                            erro = f'Imagem não encontrada para pessoa {pessoa["nome"]} (arquivo {arquivo["id"]})'
+                            logging.warning(erro)
+                            resultado['erros'].append(erro)
+                            continue
                     
-                    # Verifica/cria usuário no leitor
-                    try:
-                        user_exists_response = requests.post(
-                            f"http://{leitor['ip']}/load_objects.fcgi?session={session}",
-                            json={
-                                'object': 'users',
-                                'where': [{'object': 'users', 'field': 'id', 'operator': '=', 'value': pessoa['id']}]
-                            },
-                            headers={'Content-Type': 'application/json'},
-                            timeout=5
-                        )
-                        
-                        if user_exists_response.status_code == 200:
-                            users = user_exists_response.json().get('users', [])
-                            if not users:
-                                # Cria o usuário no leitor
-                                create_user_response = requests.post(
-                                    f"http://{leitor['ip']}/create_objects.fcgi?session={session}",
-                                    json={
-                                        'object': 'users',
-                                        'values': [{
-                                            'id': pessoa['id'], 
-                                            'registration': str(pessoa['id']), 
-                                            'name': pessoa['nome']
-                                        }]
-                                    },
-                                    headers={'Content-Type': 'application/json'},
-                                    timeout=5
-                                )
-                                
-                                if create_user_response.status_code != 200:
-                                    erro = f'Falha ao criar usuário {pessoa["nome"]}: {create_user_response.text}'
-                                    logging.error(erro)
-                                    resultado['erros'].append(erro)
-                                    continue
-                                else:
-                                    logging.info('Usuário %s criado no leitor', pessoa['nome'])
-                        
-                        # Adiciona à lista para envio
-                        user_images.append({
-                            'user_id': pessoa['id'],
-                            'user_name': pessoa['nome'],
-                            'timestamp': int(time.time()),
-                            'image': imagem_base64,
-                            'arquivo_id': arquivo['id']
-                        })
-                        
-                    except requests.exceptions.RequestException as e:
-                        erro = f'Erro ao verificar/criar usuário {pessoa["nome"]}: {str(e)}'
-                        logging.error(erro)
+                        candidatos.append((pessoa, arquivo, imagem_base64))
+                    else:
+                        erro = f'Nenhuma imagem encontrada para pessoa {pessoa["nome"]}'
+                        logging.warning(erro)
                         resultado['erros'].append(erro)
-                        continue
-                else:
-                    erro = f'Nenhuma imagem encontrada para pessoa {pessoa["nome"]}'
-                    logging.warning(erro)
+            
+                # Verifica/cria de uma vez os usuários no leitor
+                try:
+                    cadastrados, erros = garantirUsuarios(leitor, session, [pessoa for pessoa, _, _ in candidatos])
+                    resultado['erros'].extend(erros)
+                except requests.exceptions.RequestException as e:
+                    erro = f'Erro ao verificar/criar usuários no leitor: {str(e)}'
+                    logging.error(erro)
                     resultado['erros'].append(erro)
+                    cadastrados = set()
             
-            cursor.close()
-            conn.close()
+                # Adiciona à lista para envio
+                user_images = [
+                    {
+                        'user_id': pessoa['id'],
+                        'user_name': pessoa['nome'],
+                        'timestamp': int(time.time()),
+                        'image': imagem_base64,
+                        'arquivo_id': arquivo['id']
+                    }
+                    for pessoa, arquivo, imagem_base64 in candidatos
+                    if int(pessoa['id']) in cadastrados
+                ]
+                cursor.close()
             
             # Envia as imagens
             if user_images:
@@ -302,164 +232,25 @@ def sincronizarLeitorForcado(leitor_id, max_retries=3, retry_delay=5):
     
     return resultado
 
-def enviarImagensEmLotes(leitor, session, user_images, batch_size=2 * 1024 * 1024, forcado=False):
+def enviarImagensEmLotes(leitor, session, user_images, forcado=False):
     """
-    Envia imagens em lotes para não exceder o tamanho máximo da requisição.
+    Envia as imagens em lotes de tamanho adaptativo (ver loteAdaptativo) e
+    registra o resultado de cada imagem em tblLeitorFoto.
     
     Args:
         leitor: Dados do leitor
         session: Sessão válida
         user_images: Lista de imagens a enviar
-        batch_size: Tamanho máximo do lote em bytes
         forcado: Se True, marca como sincronização forçada
         
     Returns:
         bool: True se todas as imagens foram enviadas com sucesso
     """
-    current_batch = []
-    current_size = 0
-    sucesso_geral = True
-    
-    for image_data in user_images:
-        image_size = len(image_data['image'].encode('utf-8')) if image_data['image'] else 0
-        
-        if current_size + image_size > batch_size and current_batch:
-            if not enviarLote(leitor, session, current_batch, forcado):
-                sucesso_geral = False
-            current_batch = []
-            current_size = 0
-        
-        current_batch.append(image_data)
-        current_size += image_size
-    
-    if current_batch:
-        if not enviarLote(leitor, session, current_batch, forcado):
-            sucesso_geral = False
-    
-    return sucesso_geral
-
-def enviarLote(leitor, session, batch, forcado=False, max_retries=3, retry_delay=5):
-    """
-    Envia um lote de imagens para o leitor facial.
-    
-    Args:
-        leitor: Dados do leitor
-        session: Sessão válida
-        batch: Lista de imagens do lote
-        forcado: Se True, marca como sincronização forçada
-        max_retries: Número máximo de tentativas
-        retry_delay: Delay entre tentativas
-        
-    Returns:
-        bool: True se o lote foi enviado com sucesso
-    """
-    conn = None
-    cursor = None
-    
-    try:
-        conn = conectarBancoEvento()
-        cursor = conn.cursor()
-        
-        for attempt in range(max_retries):
-            try:
-                # Verifica sessão
-                session_check = isSessionValid(leitor)
-                if not session_check:
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    else:
-                        return False
-                
-                session = session_check
-                
-                # Prepara payload
-                payload = {
-                    'match': False,
-                    'user_images': [
-                        {
-                            'user_id': img['user_id'],
-                            'timestamp': img['timestamp'],
-                            'image': img['image']
-                        } 
-                        for img in batch
-                    ]
-                }
-                
-                # Envia as imagens
-                response = requests.post(
-                    f"http://{leitor['ip']}/user_set_image_list.fcgi?session={session}",
-                    json=payload,
-                    headers={'Content-Type': 'application/json'},
-                    timeout=90
-                )
-                
-                # Registra o resultado
-                for image_data in batch:
-                    sucesso = response.status_code == 200
-                    
-                    if sucesso:
-                        mensagem = "Imagem sincronizada (FORÇADO)" if forcado else "Imagem sincronizada"
-                        status = 1
-                    else:
-                        mensagem = f"Falha na sincronização forçada: {response.text[:200]}"
-                        status = 0
-                    
-                    # Registra na tabela tblLeitorFoto
-                    cursor.execute("""
-                        INSERT INTO tblLeitorFoto (idEvento, idLeitor, idArquivo, status, mensagem, dataCadastro)
-                        VALUES (%s, %s, %s, %s, %s, NOW())
-                    """, (
-                        leitor['idEvento'],
-                        leitor['id'],
-                        image_data['arquivo_id'],
-                        status,
-                        mensagem
-                    ))
-                
-                conn.commit()
-                
-                if response.status_code == 200:
-                    logging.info('Lote de %d imagens enviado com sucesso', len(batch))
-                    return True
-                else:
-                    logging.error('Falha ao enviar lote: %s', response.text)
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    return False
-                    
-            except requests.exceptions.RequestException as e:
-                logging.error('Erro ao enviar lote (tentativa %d/%d): %s', attempt + 1, max_retries, str(e))
-                
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    # Registra falha
-                    for image_data in batch:
-                        cursor.execute("""
-                            INSERT INTO tblLeitorFoto (idEvento, idLeitor, idArquivo, status, mensagem, dataCadastro)
-                            VALUES (%s, %s, %s, %s, %s, NOW())
-                        """, (
-                            leitor['idEvento'],
-                            leitor['id'],
-                            image_data['arquivo_id'],
-                            0,
-                            f"Erro na requisição: {str(e)[:200]}"
-                        ))
-                    conn.commit()
-                    return False
-                    
-    except Exception as e:
-        logging.error('Erro inesperado ao enviar lote: %s', str(e))
-        return False
-        
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    resultados = enviarImagensAdaptativo(leitor, user_images)
+    registrarResultadosImagens(
+        leitor, resultados, "Imagem sincronizada (FORÇADO)" if forcado else "Imagem sincronizada"
+    )
+    return all(r['sucesso'] for r in resultados)
 
 def main():
     """Função principal"""
@@ -0,0 +1,5 @@
+-- Índice usado para relacionar as fotos de acesso com as tentativas
+-- (db/vinculoFotos.py): busca por leitor + pessoa + horário da tentativa
+
+ALTER TABLE `tblEntradas`
+ADD INDEX `idx_entradas_leitor_pessoa_data` (`idLeitor`, `idPessoa`, `dataTentativa`);
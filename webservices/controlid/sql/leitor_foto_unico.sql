@@ -0,0 +1,19 @@
+-- Um registro por leitor e imagem em tblLeitorFoto (db.funcoes.registrarLeitorFotos)
+-- O resultado de cada envio é gravado com INSERT ... ON DUPLICATE KEY UPDATE
+-- em (idLeitor, idArquivo), substituindo o resultado anterior.
+
+-- 1. Remove as linhas duplicadas, mantendo a mais recente de cada par
+DELETE antigo
+  FROM `tblLeitorFoto` antigo
+  JOIN `tblLeitorFoto` recente
+    ON recente.`idLeitor` = antigo.`idLeitor`
+   AND recente.`idArquivo` = antigo.`idArquivo`
+   AND recente.`id` > antigo.`id`;
+
+-- 2. Chave única do upsert (também atende o NOT EXISTS da sincronização incremental)
+ALTER TABLE `tblLeitorFoto`
+ADD UNIQUE KEY `uk_leitor_foto_leitor_arquivo` (`idLeitor`, `idArquivo`);
+
+-- 3. Índice substituído pela chave única (criado em sincronizacao_incremental_imagens.sql)
+ALTER TABLE `tblLeitorFoto`
+DROP INDEX `idx_leitor_foto_leitor_arquivo`;
@@ -0,0 +1,20 @@
+-- Sincronização incremental de imagens (sincronizarImagens.py)
+
+-- 1. Marca d'água: início da última sincronização completa de cada leitor
+ALTER TABLE `tblLeitor`
+ADD COLUMN `dataSincronizacaoImagens` timestamp NULL DEFAULT NULL AFTER `configurado`;
+
+-- 2. Índices da consulta de imagens alteradas
+ALTER TABLE `tblArquivo`
+ADD INDEX `idx_arquivo_referencia_tipo_data` (`idReferencia`, `tipoReferencia`, `tipoArquivo`, `dataCadastro`),
+ADD INDEX `idx_arquivo_tipo_data` (`tipoReferencia`, `tipoArquivo`, `dataCadastro`);
+
+ALTER TABLE `tblCredencial`
+ADD INDEX `idx_credencial_data_edicao` (`dataEdicao`),
+ADD INDEX `idx_credencial_pessoa_status` (`idPessoa`, `status`);
+
+ALTER TABLE `tblPessoa`
+ADD INDEX `idx_pessoa_data_edicao` (`dataEdicao`);
+
+ALTER TABLE `tblLeitorFoto`
+ADD INDEX `idx_leitor_foto_leitor_arquivo` (`idLeitor`, `idArquivo`, `status`);
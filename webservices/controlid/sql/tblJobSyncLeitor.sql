@@ -0,0 +1,20 @@
+-- Entrega de cada job de tblJobSync por leitor (processarJobsSync.py)
+-- Uma nova tentativa do job envia a imagem apenas aos leitores que ainda não
+-- a receberam; tentativas são reagendadas com espera exponencial.
+
+CREATE TABLE IF NOT EXISTS `tblJobSyncLeitor` (
+  `idJob` int NOT NULL,
+  `idLeitor` int NOT NULL,
+  `status` enum('ENVIADO','FALHA','RECUSADA') NOT NULL COMMENT 'RECUSADA: o leitor rejeitou a imagem (não é reenviada)',
+  `tentativas` tinyint NOT NULL DEFAULT '1' COMMENT 'Envios feitos a este leitor',
+  `mensagem` varchar(255) DEFAULT NULL COMMENT 'Última mensagem de erro, se houver',
+  `dataAtualizacao` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`idJob`, `idLeitor`),
+  KEY `idx_leitor` (`idLeitor`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='Estado da entrega de cada job de sincronização por leitor';
+
+-- Próxima tentativa agendada de jobs que falharam (espera exponencial)
+ALTER TABLE `tblJobSync`
+ADD COLUMN `proximaTentativa` timestamp NULL DEFAULT NULL COMMENT 'Job só é reservado a partir deste horário' AFTER `dataAgendamento`;
+
+CREATE INDEX idx_jobs_proxima_tentativa ON tblJobSync (status, proximaTentativa);
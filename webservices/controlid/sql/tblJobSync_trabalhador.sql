@@ -0,0 +1,8 @@
+-- Trabalhadores concorrentes da fila tblJobSync (processarJobsSync.py --daemon)
+
+-- 1. Identificação do trabalhador (host:pid) que reservou o job
+ALTER TABLE `tblJobSync`
+ADD COLUMN `trabalhador` varchar(100) DEFAULT NULL COMMENT 'Trabalhador (host:pid) que reservou o job' AFTER `status`;
+
+-- 2. Busca de jobs abandonados em PROCESSANDO (trabalhador interrompido)
+CREATE INDEX idx_jobs_processando ON tblJobSync (status, dataInicio);
@@ -0,0 +1,137 @@
+"""
+Cadastro em lote dos usuários (pessoas) nos leitores faciais.
+
+Antes de enviar imagens, o usuário precisa existir no leitor. Em vez de um
+load_objects (e talvez um create_objects) por pessoa, os ids já cadastrados
+são consultados uma vez (com IN em blocos, ou a lista completa paginada para
+conjuntos grandes), a diferença é calculada localmente e os usuários que
+faltam são criados em poucos create_objects com vários valores.
+"""
+import requests
+from webservices.controlid.sessaoLeitor import sessaoLeitor
+from config import (
+    USUARIOS_LEITOR_PAGINA,
+    USUARIOS_LEITOR_LOTE_CONSULTA,
+    USUARIOS_LEITOR_LOTE_CRIACAO,
+)
+from logging_config import get_logger
+
+# Obtém o logger configurado para este módulo
+logging = get_logger('UsuariosLeitor', arquivo_log='logUsuariosLeitor.log')
+
+TIMEOUT_REQUISICAO = 15
+
+
+def _carregarUsuarios(leitor, session, payload):
+    response = sessaoLeitor(leitor).post(
+        "load_objects.fcgi",
+        json=payload,
+        headers={'Content-Type': 'application/json'},
+        timeout=TIMEOUT_REQUISICAO
+    )
+    response.raise_for_status()
+    return response.json().get('users', [])
+
+
+def carregarIdsUsuarios(leitor, session, ids=None):
+    """
+    Busca os ids dos usuários cadastrados no leitor.
+
+    Args:
+        leitor: Leitor (tblLeitor)
+        session: Sessão válida do leitor
+        ids: Restringe a consulta a estes ids (None = todos os usuários)
+
+    Returns:
+        set: ids (int) cadastrados no leitor
+
+    Raises:
+        requests.exceptions.RequestException: Falha na comunicação com o leitor
+    """
+    existentes = set()
+
+    # Conjuntos pequenos: consulta com IN em blocos; grandes: lista completa paginada
+    if ids is not None and len(ids) <= USUARIOS_LEITOR_PAGINA:
+        ids = list(ids)
+        for i in range(0, len(ids), USUARIOS_LEITOR_LOTE_CONSULTA):
+            usuarios = _carregarUsuarios(leitor, session, {
+                'object': 'users',
+                'fields': ['id'],
+                'where': [{'object': 'users', 'field': 'id', 'operator': 'IN', 'value': ids[i:i + USUARIOS_LEITOR_LOTE_CONSULTA]}]
+            })
+            existentes.update(int(u['id']) for u in usuarios)
+        return existentes
+
+    offset = 0
+    while True:
+        usuarios = _carregarUsuarios(leitor, session, {
+            'object': 'users',
+            'fields': ['id'],
+            'limit': USUARIOS_LEITOR_PAGINA,
+            'offset': offset,
+        })
+        existentes.update(int(u['id']) for u in usuarios)
+        if len(usuarios) < USUARIOS_LEITOR_PAGINA:
+            return existentes
+        offset += USUARIOS_LEITOR_PAGINA
+
+
+def _criarUsuarios(leitor, session, pessoas, erros):
+    """Cria os usuários em um create_objects; se o lote falhar, divide ao meio."""
+    response = sessaoLeitor(leitor).post(
+        "create_objects.fcgi",
+        json={
+            'object': 'users',
+            'values': [
+                {'id': int(p['id']), 'registration': str(p['id']), 'name': p['nome']}
+                for p in pessoas
+            ]
+        },
+        headers={'Content-Type': 'application/json'},
+        timeout=TIMEOUT_REQUISICAO
+    )
+    if response.status_code == 200:
+        return {int(p['id']) for p in pessoas}
+
+    if len(pessoas) == 1:
+        erro = f'Falha ao criar usuário {pessoas[0]["nome"]} no leitor {leitor["nomeLeitor"]}: {response.text[:200]}'
+        logging.error(erro)
+        erros.append(erro)
+        return set()
+
+    # Isola o(s) usuário(s) recusado(s) sem perder o restante do lote
+    meio = len(pessoas) // 2
+    return _criarUsuarios(leitor, session, pessoas[:meio], erros) | _criarUsuarios(leitor, session, pessoas[meio:], erros)
+
+
+def garantirUsuarios(leitor, session, pessoas):
+    """
+    Garante que as pessoas estão cadastradas como usuários no leitor,
+    criando as que faltam em lotes.
+
+    Args:
+        leitor: Leitor (tblLeitor)
+        session: Sessão válida do leitor
+        pessoas: Lista de dicts com 'id' e 'nome'
+
+    Returns:
+        tuple: (ids cadastrados no leitor ao final: set, erros: list)
+
+    Raises:
+        requests.exceptions.RequestException: Falha na comunicação com o leitor
+    """
+    por_id = {int(p['id']): p for p in pessoas}
+    if not por_id:
+        return set(), []
+
+    existentes = carregarIdsUsuarios(leitor, session, por_id.keys()) & por_id.keys()
+    faltantes = [p for pid, p in por_id.items() if pid not in existentes]
+
+    erros = []
+    for i in range(0, len(faltantes), USUARIOS_LEITOR_LOTE_CRIACAO):
+        existentes |= _criarUsuarios(leitor, session, faltantes[i:i + USUARIOS_LEITOR_LOTE_CRIACAO], erros)
+
+    if faltantes:
+        logging.info('%d de %d usuários criados no leitor %s',
+                     len(faltantes) - len(erros), len(faltantes), leitor['nomeLeitor'])
+    return existentes, erros